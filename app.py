@@ -11,9 +11,20 @@ from frontend.login import login_page, register_page, admin_page, admin_login_pa
 import glob 
 import io
 import ujson
+import base64
 from io import BytesIO
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    DF_FORMAT = "arrow"
+except ImportError:
+    DF_FORMAT = "json"
 
 avatar_url = "frontend/assets/middleware_icon.png"
+# Rows shown per table, and fetched from the backend per "Load more rows" click.
+PAGE_ROWS = 10
+# Display order of the post-query stages, which may arrive in any order.
+STAGE_ORDER = ("chart", "answer", "summary", "followups")
 st.set_page_config(page_title="LLM Middleware", layout="wide")
 
 def set_question(question):
@@ -27,17 +38,33 @@ def reset_button():
     st.session_state.run_once_flag = False
     # st.experimental_rerun()
 
+def load_more_rows(index):
+    # Only the first page of a result is sent with the answer; later pages are
+    # pulled from the backend when the user asks for them.
+    message = st.session_state.chat_history_1[index]
+    message['visible_rows'] = message.get('visible_rows', PAGE_ROWS) + PAGE_ROWS
+    if message['visible_rows'] > len(message['table']) and message.get('page_token'):
+        page = fetch_page(message['page_token'], max(PAGE_ROWS, message['visible_rows'] - len(message['table'])))
+        message['table'] = pd.concat([message['table'], decode_dataframe(page['response'])], ignore_index=True)
+        message['page_token'] = page['page_token']
+    # Re-render the history instead of asking the last question again.
+    st.session_state["my_question"] = None
+    st.session_state["show_history"] = True
+
 def writeResults():
-    for message in st.session_state.chat_history_1:
+    for i, message in enumerate(st.session_state.chat_history_1):
         if message["role"] == "assistant":
             with st.chat_message(message["role"], avatar=avatar_url,):
                 st.markdown(message["content"])
             if 'table' in message:
                 with st.chat_message(message["role"], avatar=avatar_url,):
                     df = message['table']
-                    if len(df) > 10:
-                        st.write("First 10 rows of data")
-                        st.dataframe(df.head(10))
+                    visible_rows = message.get('visible_rows', PAGE_ROWS)
+                    total_rows = message.get('total_rows', len(df))
+                    if len(df) > visible_rows or message.get('page_token'):
+                        st.write(f"First {min(visible_rows, len(df))} of {total_rows if total_rows is not None else 'many'} rows of data")
+                        st.dataframe(df.head(visible_rows))
+                        st.button("Load more rows", on_click=load_more_rows, args=(i,), key=f"more_rows_{i}")
                     else:
                         st.dataframe(df)
             if 'chart' in message:
@@ -47,6 +74,76 @@ def writeResults():
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
 
+def decode_dataframe(value):
+    """Decode a DataFrame sent by the backend: Arrow IPC / Parquet envelope or legacy JSON records."""
+    if isinstance(value, dict):
+        data = base64.b64decode(value["data"])
+        if value["format"] == "arrow":
+            return pa.ipc.open_stream(data).read_pandas()
+        if value["format"] == "parquet":
+            return pq.read_table(pa.BufferReader(data)).to_pandas()
+        value = data.decode("utf-8")
+    return pd.read_json(io.StringIO(value), dtype=None, precise_float=True)
+
+def error_message(response):
+    """The backend's message for a failed call (unknown session, busy server, ...), or the HTTP status."""
+    try:
+        body = response.json()
+        message = body.get('response') if isinstance(body, dict) else None
+    except ValueError:
+        message = None
+    return message or f"{response.status_code} {response.reason}"
+
+def stream_answer(messages):
+    """Yield answer text as the backend streams it."""
+    with requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_answer_stream',
+                       json={'session_id': st.session_state["session_id"], 'question': messages},
+                       headers=api_headers(), stream=True) as response:
+        if not response.ok:
+            # A JSON error body is not part of the answer.
+            raise requests.HTTPError(error_message(response), response=response)
+        for text in response.iter_content(chunk_size=None, decode_unicode=True):
+            yield text
+
+def api_headers():
+    """Headers sent with every backend call: the current question's trace id, and the profiling opt-in."""
+    if "trace_id" not in st.session_state:
+        st.session_state["trace_id"] = uuid.uuid4().hex
+    headers = {'X-Trace-Id': st.session_state["trace_id"]}
+    if st.session_state.get("profile_requests"):
+        headers['X-Profile'] = os.getenv('PROFILE_TOKEN', '1')
+    return headers
+
+def show_trace(elapsed):
+    """Show the trace id of the last question and offer its CPU profile for download."""
+    trace_id = st.session_state["trace_id"]
+    st.caption(f"Trace `{trace_id}` · {elapsed:.2f} s in the app")
+    if st.session_state.get("profile_requests"):
+        response = requests.get(os.getenv('API_URL', 'http://backend:8000')+f'/api/v2/traces/{trace_id}/profile')
+        if response.ok:
+            st.download_button("Download profile", response.content, file_name=f"profile-{trace_id}.folded", key=f"profile_{trace_id}")
+
+def fetch_page(page_token, page_size=PAGE_ROWS):
+    return requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/fetch_page',
+                         json={'session_id': st.session_state["session_id"], 'page_token': page_token, 'page_size': page_size, 'df_format': DF_FORMAT},
+                         headers=api_headers()).json()
+
+def stream_ask(question, messages):
+    """Yield (event, data) pairs from the backend's /api/v2/ask Server-Sent Events stream."""
+    with requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/ask',
+                       json={'session_id': st.session_state["session_id"], 'question': question, 'messages': messages, 'df_format': DF_FORMAT},
+                       headers=api_headers(), stream=True) as response:
+        if not response.ok:
+            # Unknown session, busy server, ...: a JSON error instead of an event stream.
+            yield "error", {"stage": "request", "reason": "status", "message": error_message(response)}
+            return
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, orjson.loads(line[len("data: "):])
+
 def save_df(df):
     # Let user specify a server‐side path (must exist or be creatable)
     save_dir = os.path.join(os.getcwd(), "data_storage")
@@ -99,6 +196,9 @@ def stramlit_ui():
         st.session_state.sql_mode = True
     if "run_once_flag" not in st.session_state:
         st.session_state["run_once_flag"] = False
+    if "session_id" not in st.session_state:
+        # Replaced by the id setup_vanna hands out.
+        st.session_state["session_id"] = None
 
     st.markdown(
             """
@@ -175,6 +275,7 @@ def stramlit_ui():
     # st.sidebar.checkbox("Show Summary", value=True, key="show_summary")
     # st.sidebar.checkbox("Show Follow-up Questions", value=True, key="show_followup")
     st.sidebar.button("Reset", on_click=lambda: reset_button(), use_container_width=True)
+    st.sidebar.checkbox("Profile requests", value=False, key="profile_requests")
     if st.sidebar.button("Logout", use_container_width=True):
         st.session_state["token"] = None
         st.rerun()
@@ -225,7 +326,9 @@ def stramlit_ui():
         st.session_state["run_once_flag"] = True
         with st.spinner("Calling LLM..."):
             try:
-                questions = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/setup_vanna/', json={'configs': configs}).json()['response']
+                setup = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/setup_vanna/', json={'session_id': st.session_state["session_id"], 'configs': configs}, headers=api_headers()).json()
+                questions = setup['response']
+                st.session_state["session_id"] = setup.get('session_id', st.session_state["session_id"])
             except requests.exceptions.RequestException as e:
                 # st.error(f"Error fetching data: {e}")
                 st.error(f"[ERROR] Cannot connect to LLM, Please reload application or check the internet connections")
@@ -268,6 +371,8 @@ def stramlit_ui():
         st.session_state["my_question"] = None
 
     my_question = st.session_state.get("my_question", default=None)
+    if my_question is None and st.session_state.pop("show_history", False):
+        writeResults()
     # if st.session_state.is_processing == False:
     if my_question is None:
         my_question = st.chat_input(
@@ -278,185 +383,146 @@ def stramlit_ui():
         # st.session_state.is_processing = True
         st.session_state["my_question"] = my_question
         st.session_state.chat_history_1.append({"role": "user", "content": my_question})
+        # One trace per question, shared by every backend call it makes.
+        st.session_state["trace_id"] = uuid.uuid4().hex
+        started = time.perf_counter()
 
         if st.session_state.sql_mode:
-        # sql = generate_sql_cached(question=my_question)
-            try:
-                sql = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_sql_cached/', json={'question': my_question}).json()['response']
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error fetching data: {e}")
-                # print("sql was:", repr(sql))
-                return None
-
-            try:
-                is_sql_valid = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/is_sql_valid_cached/', json={'sql': sql}).json()['response']
-            except requests.exceptions.RequestException as e:
-                st.error(f"Error fetching data: {e}")
-                print("is_sql_valid was:", repr(is_sql_valid))
-                return None
-        else:
-            sql = None
-            is_sql_valid = None
-        
-        if sql and is_sql_valid and st.session_state.sql_mode:
+            qlist = []
+            for message in st.session_state.chat_history_1:
+                qlist.append({'role': message['role'], 'content':message["content"]})
             writeResults()
 
-            # st.session_state.chat_history_1.append({"role": "assistant", "content": f"SQL generated:\n```sql\n{sql}\n```"})
+            sql_is_valid = True
+            # Chat bubbles for stages whose text arrives token by token.
+            placeholders = {}
+            streamed = {}
+            # The backend runs the post-query stages concurrently; each one
+            # renders into its own container so the page layout is stable.
+            slots = {}
+            stage_history = {}
+
+            def slot(stage):
+                if stage not in slots:
+                    slots[stage] = st.container()
+                return slots[stage]
 
-            # df = run_sql_cached(sql=sql)
             try:
-                df = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/run_sql_cached/', 
-                                   json={'sql': orjson.dumps(sql, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8")}).json()['response']
-                print(df)
-                try:
-                    df = orjson.loads(df)
-                except orjson.JSONDecodeError as e:
-                    print(f"JSON decoding failed: {e}")
-                    print("run_sql_cached was:", repr(df))
-                df = pd.read_json(io.StringIO(df), dtype=None, precise_float=True)
+                for event, data in stream_ask(my_question, qlist):
+                    if event == "sql":
+                        sql_is_valid = data["valid"]
+
+                    elif event == "table":
+                        df = decode_dataframe(data["df"])
+                        st.session_state["df"] = df
+                        for warning in data.get("warnings", []):
+                            st.warning(warning)
+                        if st.session_state.get("show_table", True):
+                            st.write("### Query Results")
+                            if len(df) > PAGE_ROWS or data.get("page_token"):
+                                total_rows = data.get("total_rows")
+                                st.write(f"First {min(PAGE_ROWS, len(df))} of {total_rows if total_rows is not None else 'many'} rows of data")
+                                st.dataframe(df.head(PAGE_ROWS))
+                            else:
+                                st.dataframe(df)
+                            st.session_state.chat_history_1.append({"role": "assistant", "content": "### Query Table", 'table':df,
+                                                                    'page_token': data.get("page_token"), 'total_rows': data.get("total_rows")})
+                        save_df(df)
+                        for stage in STAGE_ORDER:
+                            slot(stage)
+
+                    elif event == "plotly_code":
+                        if st.session_state.get("show_plotly_code", False):
+                            slot("chart").code(data["code"], language="python")
+
+                    elif event == "figure":
+                        if data["figure"]:
+                            fig = pio.from_json(data["figure"])
+                            slot("chart").plotly_chart(fig, key=f"chart_{str(uuid.uuid4())}")
+                            stage_history["chart"] = {"role": "assistant", "content": "### Query Chart", 'chart':fig}
+                        else:
+                            stage_history["chart"] = {"role": "assistant", "content": "I couldn't generate a chart"}
+
+                    elif event in ("answer_token", "summary_token"):
+                        stage = event[:-len("_token")]
+                        if stage == "summary" and not st.session_state.get("show_summary", True):
+                            continue
+                        if stage not in placeholders:
+                            if stage == "summary":
+                                slot("summary").write("### Conclusion")
+                            placeholders[stage] = slot(stage).chat_message("assistant", avatar=avatar_url).empty()
+                            streamed[stage] = ""
+                        streamed[stage] += data["text"]
+                        placeholders[stage].text(streamed[stage])
+
+                    elif event == "answer":
+                        if "answer" in placeholders:
+                            placeholders["answer"].text(data["answer"])
+                        else:
+                            assistant_message_answer = slot("answer").chat_message(
+                                "assistant", avatar=avatar_url
+                            )
+                            assistant_message_answer.text(data["answer"])
+                        stage_history["answer"] = {"role": "assistant", "content": data["answer"]}
+
+                    elif event == "summary":
+                        if st.session_state.get("show_summary", True):
+                            if "summary" not in placeholders:
+                                slot("summary").write("### Conclusion")
+                            summary = data["summary"]
+                            if summary is not None:
+                                if "summary" in placeholders:
+                                    placeholders["summary"].text(summary)
+                                else:
+                                    assistant_message_summary = slot("summary").chat_message(
+                                        "assistant", avatar=avatar_url
+                                    )
+                                    assistant_message_summary.text(summary)
+                                stage_history["summary"] = {"role": "assistant", "content": summary}
+                            else:
+                                stage_history["summary"] = {"role": "assistant", "content": "I couldn't summarize"}
+
+                    elif event == "followups":
+                        followup_questions = data["questions"]
+                        if st.session_state.get("show_followup", True) and followup_questions:
+                            followups = slot("followups")
+                            followups.write("### Follow-Up Questions")
+                            for question in followup_questions[:5]:
+                                unique_key = str(uuid.uuid4())
+                                followups.button(question, on_click=set_question, args=(question,), key=unique_key)
+                            followups.button("Others", on_click=set_question, args=(None,), key=str(uuid.uuid4()))
+
+                    elif event == "error":
+                        if data.get("reason") in ("timeout", "rejected", "status"):
+                            st.error(f"[Error] {data['message']}")
+                        elif data["stage"] in ("sql", "table"):
+                            st.error(f"[Error] LLM cannot query data correctly")
+                        else:
+                            slot(data["stage"]).error(f"Error in {data['stage']}: {data['message']}")
             except requests.exceptions.RequestException as e:
-                # st.error(f"Error fetching data: {e}")
-                st.error(f"[Error] LLM cannot query data correctly")
+                st.error(f"Error fetching data: {e}")
                 return None
-
-            if df is not None:
-                st.session_state["df"] = df
-
-            if st.session_state.get("df") is not None:
-                if st.session_state.get("show_table", True):
-                    st.write("### Query Results")
-                    if len(df) > 10:
-                        st.write("First 10 rows of data")
-                        st.dataframe(df.head(10))
-                    else:
-                        st.dataframe(df)
-                    st.session_state.chat_history_1.append({"role": "assistant", "content": "### Query Table", 'table':df})
-                    
-                save_df(df)
-
-                # try:
-                #     should_generate_chart = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/should_generate_chart_cached/', 
-                #                     json={
-                #                         'sql': orjson.dumps(sql, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                #                         'df': orjson.dumps(df.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                #                         'question': orjson.dumps(my_question, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                #                     }).json()['response']
-                # except requests.exceptions.RequestException as e:
-                #     st.error(f"Error fetching data: {e}")
-                #     return None
-        
-                # if should_generate_chart_cached(question=my_question, sql=sql, df=df):
-                # if should_generate_chart:
-
-                # cap only 100 rows
-                if len(df) > 200:
-                    df = df.head(200)
-
-                if True:
-                    # plot_code = generate_plotly_code_cached(question=my_question, sql=sql, df=df)
-                    try:
-                        plot_code = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_plotly_code_cached/', 
-                                        json={
-                                            'sql': orjson.dumps(sql, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                            'df': orjson.dumps(df.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                            'question': orjson.dumps(my_question, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                        }).json()['response']
-                    except requests.exceptions.RequestException as e:
-                        st.error(f"Error fetching data: {e}")
-                        return None
-                    
-                    if st.session_state.get("show_plotly_code", False):
-                        st.code(plot_code, language="python")
-                    # fig = generate_plot_cached(code=plot_code, df=df)
-
-                    try:
-                        fig = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_plot_cached/', 
-                                        json={
-                                            'code': orjson.dumps(plot_code, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                            'df': orjson.dumps(df.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                        }).json()['response']
-                        fig = pio.from_json(orjson.loads(fig))
-                    except requests.exceptions.RequestException as e:
-                        st.error(f"Error fetching data: {e}")
-                        return None
-                    
-                    if fig:
-                        st.plotly_chart(fig, key=f"chart_{str(uuid.uuid4())}")
-                        st.session_state.chat_history_1.append({"role": "assistant", "content": "### Query Chart", 'chart':fig})
-                    else:
-                        st.session_state.chat_history_1.append({"role": "assistant", "content": "I couldn't generate a chart"})
-
-                try:
-                    # st.session_state.chat_history_1.append({"role": "user", "content": my_question})
-                    qlist = []
-                    for message in st.session_state.chat_history_1:
-                        qlist.append({'role': message['role'], 'content':message["content"]})
-                    print('qlist: ', qlist)
-                    answer = requests.post(os.getenv('API_URL', 'http:/backend:8000')+'/api/v2/generate_answer_cached/', json={'question':  qlist}).json()['response']
-                except requests.exceptions.RequestException as e:
-                    st.error(f"Error fetching data: {e}")
-                    return None
-                if answer is not None:
-                        assistant_message_answer = st.chat_message(
-                            "assistant", avatar=avatar_url
-                        )
-                        assistant_message_answer.text(answer)
-                st.session_state.chat_history_1.append({"role": "assistant", "content": answer})
-                
-                if st.session_state.get("show_summary", True):
-                    st.write("### Conclusion")
-                    # summary = generate_summary_cached(question=my_question, df=df)
-                    try:
-                        summary = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_summary_cached/', 
-                                        json={
-                                            'question': orjson.dumps(my_question, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                            'df': orjson.dumps(df.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                        }).json()['response']
-                    except requests.exceptions.RequestException as e:
-                        st.error(f"Error fetching data: {e}")
-                        return None
-                    if summary is not None:
-                        assistant_message_summary = st.chat_message(
-                            "assistant", avatar=avatar_url
-                        )
-                        assistant_message_summary.text(summary)
-                        st.session_state.chat_history_1.append({"role": "assistant", "content": summary})
-                    else:
-                        st.session_state.chat_history_1.append({"role": "assistant", "content": "I couldn't summarize"})
-
-                # Generate follow-up questions
-                if st.session_state.get("show_followup", True):
-                    # followup_questions = generate_followup_cached(question=my_question, sql=sql, df=df)
-                    try:
-                        followup_questions = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_followup_cached/', 
-                                        json={
-                                            'question': orjson.dumps(my_question, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                            'df': orjson.dumps(df.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                            'sql': orjson.dumps(sql, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
-                                        }).json()['response']
-                    except requests.exceptions.RequestException as e:
-                        st.error(f"Error fetching data: {e}")
-                        return None
-                    if followup_questions:
-                        st.write("### Follow-Up Questions")
-                        for question in followup_questions[:5]:
-                            unique_key = str(uuid.uuid4())
-                            st.button(question, on_click=set_question, args=(question,), key=unique_key)
-                        st.button("Others", on_click=set_question, args=(None,), key=str(uuid.uuid4()))
-
+            # Stages finish in any order; keep the chat history in reading order.
+            for stage in STAGE_ORDER:
+                if stage in stage_history:
+                    st.session_state.chat_history_1.append(stage_history[stage])
+
+            show_trace(time.perf_counter() - started)
+            if not sql_is_valid:
+                st.button("Others", on_click=set_question, args=(None,), key=str(uuid.uuid4()))
         else:
+            qlist = []
+            for message in st.session_state.chat_history_1:
+                qlist.append({'role': message['role'], 'content':message["content"]})
+            writeResults()
             try:
-                # st.session_state.chat_history_1.append({"role": "user", "content": my_question})
-                qlist = []
-                for message in st.session_state.chat_history_1:
-                    qlist.append({'role': message['role'], 'content':message["content"]})
-                answer = requests.post(os.getenv('API_URL', 'http://backend:8000')+'/api/v2/generate_answer_cached/', json={'question':  qlist}).json()['response']
+                with st.chat_message("assistant", avatar=avatar_url):
+                    answer = st.write_stream(stream_answer(qlist))
             except requests.exceptions.RequestException as e:
                 st.error(f"Error fetching data: {e}")
                 return None
             st.session_state.chat_history_1.append({"role": "assistant", "content": answer})
-
-            writeResults()
+            show_trace(time.perf_counter() - started)
 
             st.button("Others", on_click=set_question, args=(None,), key=str(uuid.uuid4()))
 
@@ -0,0 +1,71 @@
+"""
+Query embedding throughput under concurrency, with and without micro-batching.
+
+Each of `--concurrency` threads encodes one question at a time, like
+concurrent `/ask` requests do, until `--requests` questions are done.
+
+    python benchmarks/embedding_batching.py --model all-MiniLM-L6-v2 --concurrency 1 8 32
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.embedding_batcher import BatchedEmbedding  # noqa: E402
+from lib.embedding_models import DEFAULT_EMBEDDING_MODEL, _local_loader  # noqa: E402
+
+
+def run(model, concurrency: int, requests: int) -> tuple:
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            model.encode_queries([f"How many orders did customer {i} place last month?"])
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return requests / wall, statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--max-batch", type=int, default=None, help="Defaults to EMBED_BATCH_MAX")
+    parser.add_argument("--max-wait-ms", type=float, default=None, help="Defaults to EMBED_BATCH_WAIT_MS")
+    args = parser.parse_args()
+
+    model = _local_loader(args.model)()
+    batched = BatchedEmbedding(model, args.model, args.max_batch, args.max_wait_ms)
+    model.encode_queries(["warm up"])
+
+    print(f"{'mode':<10}{'threads':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for concurrency in args.concurrency:
+        for mode, encoder in (("direct", model), ("batched", batched)):
+            qps, p50, p95 = run(encoder, concurrency, args.requests)
+            print(f"{mode:<10}{concurrency:>8}{qps:>10.1f}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Backend cold start benchmark.
+
+Measures, in fresh interpreters, how long importing an app module takes and
+how long a uvicorn server needs until `/healthz` answers (listening) and
+`/ready` answers 200 (background model loads done). With `--importtime` it
+also lists the slowest imports from `python -X importtime`.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --app middlewareV1/middleware.py --runs 5 --importtime
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _module(app_path: str):
+    app_dir, filename = os.path.split(os.path.abspath(app_path))
+    return app_dir, os.path.splitext(filename)[0]
+
+
+def time_import(app_path: str) -> float:
+    app_dir, module = _module(app_path)
+    code = (
+        "import sys, time; sys.path.insert(0, %r); t = time.perf_counter(); "
+        "import %s; print(time.perf_counter() - t)" % (app_dir, module)
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(app_path: str, top: int = 15) -> list:
+    app_dir, module = _module(app_path)
+    code = "import sys; sys.path.insert(0, %r); import %s" % (app_dir, module)
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            rows.append((int(match.group(2)) / 1e6, len(match.group(3)), match.group(4)))
+    # Top level imports only, so nested modules are not counted twice.
+    outer = min((depth for _, depth, _ in rows), default=0)
+    return sorted((r for r in rows if r[1] == outer), reverse=True)[:top]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, deadline: float, expect_ok: bool) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if not expect_ok or response.status == 200:
+                    return time.perf_counter()
+        except urllib.error.HTTPError:
+            if not expect_ok:
+                return time.perf_counter()
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(url)
+
+
+def time_serve(app_path: str, timeout: float) -> tuple:
+    app_dir, module = _module(app_path)
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--app-dir", app_dir, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+    )
+    try:
+        deadline = start + timeout
+        listening = _wait_for(f"http://127.0.0.1:{port}/healthz", deadline, expect_ok=False)
+        ready = _wait_for(f"http://127.0.0.1:{port}/ready", deadline, expect_ok=True)
+        return listening - start, ready - start
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _summary(values: list) -> str:
+    return f"median {statistics.median(values):.2f}s  min {min(values):.2f}s  max {max(values):.2f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="middleware.py", help="App module file, relative to the repository root")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for /ready")
+    parser.add_argument("--no-serve", action="store_true", help="Only time the import")
+    parser.add_argument("--importtime", action="store_true", help="List the slowest top level imports")
+    args = parser.parse_args()
+    app_path = os.path.join(ROOT, args.app)
+
+    imports = [time_import(app_path) for _ in range(args.runs)]
+    print(f"import {args.app}: {_summary(imports)}")
+    if not args.no_serve:
+        serves = [time_serve(app_path, args.timeout) for _ in range(args.runs)]
+        print(f"listening:  {_summary([s[0] for s in serves])}")
+        print(f"ready:      {_summary([s[1] for s in serves])}")
+    if args.importtime:
+        print("slowest imports (cumulative):")
+        for seconds, _, name in slowest_imports(app_path):
+            print(f"  {seconds:8.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
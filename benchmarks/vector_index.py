@@ -0,0 +1,245 @@
+"""
+Recall@k versus latency for vector index settings, on our own embeddings.
+
+The corpus is the vector matrix of a collection snapshot (see
+`lib/vector_snapshot.py`). Queries are either `--queries` rows held out of
+the corpus or the lines of `--questions`, embedded with the snapshot's model.
+Exact neighbours are computed with numpy, then every index configuration of
+the grid is built on a scratch collection and searched one query at a time:
+
+    python benchmarks/vector_index.py data_storage/snapshots/knowledge_base.npz --uri http://localhost:19530
+    python benchmarks/vector_index.py knowledge_base.npz --grid grid.yaml --k 10 --csv results.csv
+
+A grid file is a list of entries shaped like those of
+`config/VectorIndexConfig.yaml`; list values are expanded, e.g.
+
+    - index_type: HNSW
+      build_params: {M: [8, 16, 32], efConstruction: 200}
+      search_params: {ef: [16, 32, 64, 128]}
+      consistency_level: [Bounded, Strong]
+
+Run it against a Milvus server (the `--uri` default is a local one), ideally
+the version used in production. Milvus Lite (a local `.db` uri) builds a FLAT
+index whatever `index_type` asks for, so its recall and latency say nothing
+about the other index types; it is only accepted for grids of FLAT entries.
+"""
+import argparse
+import csv
+import itertools
+import os
+import statistics
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.vector_index import IndexConfig  # noqa: E402
+from lib.vector_snapshot import read_header  # noqa: E402
+
+COLLECTION = "vector_index_benchmark"
+
+DEFAULT_GRID = [
+    {"index_type": "FLAT"},
+    {"index_type": "HNSW", "build_params": {"M": [8, 16, 32], "efConstruction": 200}, "search_params": {"ef": [16, 32, 64, 128, 256]}},
+    {"index_type": "IVF_FLAT", "build_params": {"nlist": [128, 1024]}, "search_params": {"nprobe": [8, 32, 128]}},
+]
+
+
+def _expand(params: dict) -> list:
+    params = params or {}
+    names = list(params)
+    values = [v if isinstance(v, list) else [v] for v in params.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def expand_grid(grid: list, metric_type: str) -> list:
+    """`(build IndexConfig, [search IndexConfig, ...])` for every build combination of the grid."""
+    builds = []
+    for entry in grid:
+        levels = entry.get("consistency_level", "Bounded")
+        levels = levels if isinstance(levels, list) else [levels]
+        for build_params in _expand(entry.get("build_params")):
+            searches = [
+                IndexConfig(entry["index_type"], metric_type, build_params, search_params, level)
+                for search_params in _expand(entry.get("search_params"))
+                for level in levels
+            ]
+            builds.append((searches[0], searches))
+    return builds
+
+
+def load_vectors(snapshot: str, queries: int, questions: str = None, seed: int = 0) -> tuple:
+    """(corpus, queries, model name) from a snapshot, holding out query rows unless `questions` is given."""
+    header = read_header(snapshot)
+    with np.load(snapshot) as data:
+        vectors = np.ascontiguousarray(data["vectors"], dtype=np.float32)
+    if questions:
+        from lib.embedding_models import get_embedding_model
+
+        with open(questions, "r") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        model = get_embedding_model(header["model"], local=True)
+        return vectors, np.asarray(model.encode_queries(texts), dtype=np.float32), header["model"]
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    return vectors[order[queries:]], vectors[order[:queries]], header["model"]
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int, metric_type: str) -> np.ndarray:
+    """Row indices of the true top `k` for each query, in blocks to bound memory."""
+    out = np.empty((len(queries), k), dtype=np.int64)
+    corpus_norms = (corpus * corpus).sum(axis=1)
+    for start in range(0, len(queries), 256):
+        block = queries[start:start + 256]
+        scores = block @ corpus.T
+        if metric_type == "L2":
+            # Squared distance up to the per-query constant |q|^2.
+            scores = corpus_norms[None, :] - 2 * scores
+        else:
+            scores = -scores
+        top = np.argpartition(scores, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(block))[:, None]
+        out[start:start + len(block)] = top[rows, np.argsort(scores[rows, top], axis=1)]
+    return out
+
+
+def create_collection(corpus: np.ndarray, batch_size: int = 10_000):
+    from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+
+    if utility.has_collection(COLLECTION):
+        utility.drop_collection(COLLECTION)
+    schema = CollectionSchema([
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=corpus.shape[1]),
+    ])
+    collection = Collection(COLLECTION, schema)
+    for start in range(0, len(corpus), batch_size):
+        collection.insert([list(range(start, min(start + batch_size, len(corpus)))), corpus[start:start + batch_size]])
+    collection.flush()
+    return collection
+
+
+def build(collection, config: IndexConfig) -> float:
+    collection.release()
+    for index in collection.indexes:
+        collection.drop_index(index_name=index.index_name)
+    start = time.perf_counter()
+    collection.create_index(field_name="embedding", index_params=config.index_params(), index_name="embedding")
+    collection.load()
+    return time.perf_counter() - start
+
+
+def search(collection, config: IndexConfig, queries: np.ndarray, k: int, threads: int) -> tuple:
+    """(result ids per query, latencies, wall time) with `threads` concurrent single-query searches."""
+    results = [None] * len(queries)
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(len(queries)))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            begin = time.perf_counter()
+            hits = collection.search(
+                data=[queries[i]], anns_field="embedding", param=config.search_param(), limit=k,
+                consistency_level=config.consistency_level,
+            )
+            elapsed = time.perf_counter() - begin
+            results[i] = [hit.id for hit in hits[0]]
+            with lock:
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return results, sorted(latencies), time.perf_counter() - start
+
+
+def recall_at_k(results: list, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return sum(len(set(ids) & set(expected)) for ids, expected in zip(results, truth.tolist())) / (len(truth) * k)
+
+
+def is_local_uri(uri: str) -> bool:
+    """Whether `uri` is a Milvus Lite file rather than a server address."""
+    return "://" not in uri
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("snapshot", help="Collection snapshot (.npz) holding the corpus vectors")
+    parser.add_argument("--uri", default="http://localhost:19530", help="Milvus server URI (a Milvus Lite file only for FLAT grids)")
+    parser.add_argument("--grid", help="YAML list of index settings to compare (default: FLAT, HNSW and IVF_FLAT sweeps)")
+    parser.add_argument("--metric", default="L2", choices=["L2", "IP", "COSINE"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500, help="Rows held out of the corpus as queries")
+    parser.add_argument("--questions", help="Text file of questions (one per line) to use as queries instead")
+    parser.add_argument("--threads", type=int, default=1, help="Concurrent searches for the QPS figure")
+    parser.add_argument("--csv", help="Also write the results to this CSV file")
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        import yaml
+
+        with open(args.grid, "r") as f:
+            grid = yaml.safe_load(f)
+    if is_local_uri(args.uri):
+        approximate = sorted({entry["index_type"].upper() for entry in grid} - {"FLAT"})
+        if approximate:
+            parser.error(f"Milvus Lite ({args.uri}) builds FLAT for every index type, so {', '.join(approximate)} "
+                         "would not be measured; pass --uri of a Milvus server")
+
+    corpus, queries, model = load_vectors(args.snapshot, args.queries, args.questions)
+    if args.metric == "COSINE":
+        corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    print(f"{model}: {len(corpus)} vectors of dim {corpus.shape[1]}, {len(queries)} queries, k={args.k}")
+    truth = exact_neighbours(corpus, queries, args.k, "L2" if args.metric == "L2" else "IP")
+
+    from pymilvus import connections, utility
+
+    connections.connect(uri=args.uri)
+    collection = create_collection(corpus)
+
+    rows = []
+    print(f"{'index':<10}{'build params':<34}{'search params':<18}{'consistency':<13}{'build s':>9}{'recall':>8}{'p50 ms':>9}{'p95 ms':>9}{'QPS':>9}")
+    try:
+        for build_config, searches in expand_grid(grid, args.metric):
+            build_seconds = build(collection, build_config)
+            for config in searches:
+                results, latencies, wall = search(collection, config, queries, args.k, args.threads)
+                row = {
+                    "index_type": config.index_type,
+                    "build_params": config.build_params,
+                    "search_params": config.search_params,
+                    "consistency_level": config.consistency_level,
+                    "build_seconds": round(build_seconds, 3),
+                    f"recall@{args.k}": round(recall_at_k(results, truth), 4),
+                    "p50_ms": round(statistics.median(latencies) * 1000, 3),
+                    "p95_ms": round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 3),
+                    "qps": round(len(queries) / wall, 1),
+                }
+                rows.append(row)
+                print(f"{row['index_type']:<10}{str(row['build_params']):<34}{str(row['search_params']):<18}{row['consistency_level']:<13}"
+                      f"{row['build_seconds']:>9.2f}{row[f'recall@{args.k}']:>8.3f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['qps']:>9.1f}")
+    finally:
+        utility.drop_collection(COLLECTION)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,28 @@ import jwt
 import sqlite3
 import datetime
 import secrets
+import threading
 
 # Secret key for token encoding/decoding
 SECRET_KEY = secrets.token_urlsafe(32)
 
+USER_DB_PATH = "data_storage/user_database.db"
+_local = threading.local()
+
+def _connect():
+    """Return this thread's connection to the user database, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(USER_DB_PATH)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
+    return conn
+
 def create_database():
     """Initialize the SQLite database with role support."""
-    conn = sqlite3.connect("data_storage/user_database.db")
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -19,17 +34,15 @@ def create_database():
         )
     """)
     conn.commit()
-    conn.close()
 
 def add_user(username, password, role='user'):
     """Add a new user with optional role."""
-    conn = sqlite3.connect("data_storage/user_database.db")
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
 
     if user:
-        conn.close()
         return False
     else:
         cursor.execute(
@@ -37,42 +50,37 @@ def add_user(username, password, role='user'):
             (username, password, role)
         )
         conn.commit()
-        conn.close()
         return True
     
 def get_all_users():
     """Return a list of all usernames in the DB."""
-    conn = sqlite3.connect("data_storage/user_database.db")
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("SELECT username FROM users")
     users = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return users
 
 def delete_user(username):
     """Delete a user from the DB."""
-    conn = sqlite3.connect("data_storage/user_database.db")
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM users WHERE username = ?", (username,))
     conn.commit()
-    conn.close()
 
 def verify_user(username, password):
     """Verify user credentials."""
-    conn = sqlite3.connect("data_storage/user_database.db")
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
     user = cursor.fetchone()
-    conn.close()
     return user is not None
 
 def get_user_role(username):
     """Return the user's role."""
-    conn = sqlite3.connect("data_storage/user_database.db")
+    conn = _connect()
     cursor = conn.cursor()
     cursor.execute("SELECT role FROM users WHERE username = ?", (username,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
 def generate_token(username):
@@ -91,11 +99,10 @@ def verify_token(token):
         username = decoded.get("username")
         
         # Check if user still exists in the database
-        conn = sqlite3.connect("data_storage/user_database.db")
+        conn = _connect()
         cursor = conn.cursor()
         cursor.execute("SELECT 1 FROM users WHERE username = ?", (username,))
         user_exists = cursor.fetchone() is not None
-        conn.close()
 
         if not user_exists:
             return None  # User revoked/deleted
@@ -0,0 +1,283 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metrics import timed
+
+# Numeric columns that are averages/ratios are averaged into "Other", everything else summed.
+_AVERAGE = re.compile(r"avg|mean|average|rate|ratio|pct|percent|share", re.IGNORECASE)
+# Numeric columns that identify rows rather than measure anything.
+_IDENTIFIER = re.compile(r"(^|_)(id|key|code|no|number|zip)$", re.IGNORECASE)
+OTHER = "Other"
+# Plot code that counts rows or draws their distribution; merging rows (bins,
+# LTTB, "Other" rows) would change what it shows.
+_COUNTS_ROWS = re.compile(r"histogram|density_(heatmap|contour)|ecdf|\bbox\b|violin|\bstrip\b|value_counts|\.count\(|\.size\(|nunique", re.IGNORECASE)
+
+
+def _limits(max_points=None, max_categories=None):
+    max_points = max_points or int(os.getenv("CHART_MAX_POINTS", 2_000))
+    max_categories = max_categories or int(os.getenv("CHART_MAX_CATEGORIES", 20))
+    return max_points, max_categories
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `n_out` points of a series
+    sorted by `x` that keep its visual shape (peaks and troughs).
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i == n_out - 3:
+            avg_x, avg_y = x[n - 1], y[n - 1]
+        else:
+            next_end = edges[i + 2]
+            avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def _as_float(values) -> np.ndarray:
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("int64").to_numpy(dtype=float)
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+
+
+def _even_indices(n: int, n_out: int) -> np.ndarray:
+    return np.unique(np.linspace(0, n - 1, n_out).astype(int))
+
+
+def _is_text(values: pd.Series) -> bool:
+    # object columns, and the `str` dtype pandas 3 uses for strings by default.
+    return values.dtype == object or pd.api.types.is_string_dtype(values.dtype)
+
+
+def _time_column(df: pd.DataFrame):
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            return col
+    for col in [c for c in df.columns if _is_text(df[c])]:
+        if re.search(r"date|time|month|day|year|week", str(col), re.IGNORECASE):
+            parsed = pd.to_datetime(df[col], errors="coerce")
+            if parsed.notna().mean() > 0.9:
+                return col
+    return None
+
+
+def _category_columns(df: pd.DataFrame, exclude=None) -> list:
+    return [
+        col for col in df.columns
+        if col != exclude and (_is_text(df[col]) or isinstance(df[col].dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(df[col]))
+    ]
+
+
+def value_column(df: pd.DataFrame, exclude=None):
+    """
+    The numeric column a chart most likely plots: the last one that does not
+    look like an identifier (SQL puts aggregates after the grouping keys),
+    else the last numeric column, else None.
+    """
+    numeric = [c for c in df.select_dtypes(include="number").columns if c != exclude]
+    measures = [c for c in numeric if not _IDENTIFIER.search(str(c))]
+    if measures:
+        return measures[-1]
+    return numeric[-1] if numeric else None
+
+
+def counts_rows(plotly_code) -> bool:
+    """Whether plot code counts rows or draws their distribution (histograms, box plots, `value_counts`, ...)."""
+    return bool(plotly_code) and _COUNTS_ROWS.search(plotly_code) is not None
+
+
+def cap_categories(df: pd.DataFrame, max_categories: int, exclude=None, fold: bool = True) -> pd.DataFrame:
+    """
+    Keep the `max_categories - 1` largest categories of every high cardinality
+    column (by the plotted value column, see `value_column`, else by row
+    count) and fold the rest into one "Other" row per remaining group. With
+    `fold` off the rest are only relabelled "Other", keeping every row.
+    """
+    numeric = list(df.select_dtypes(include="number").columns)
+    value = value_column(df, exclude)
+    capped = False
+    for col in _category_columns(df, exclude):
+        if df[col].nunique(dropna=False) <= max_categories:
+            continue
+        if value is not None:
+            ranking = df.groupby(col, dropna=False)[value].sum().abs().sort_values(ascending=False)
+        else:
+            ranking = df[col].value_counts(dropna=False)
+        top = ranking.index[:max_categories - 1]
+        if not capped:
+            df = df.copy()
+            capped = True
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+        df[col] = df[col].where(df[col].isin(top), OTHER)
+
+    if not capped or not numeric or not fold:
+        return df
+    keys = [c for c in df.columns if c not in numeric]
+    is_other = np.zeros(len(df), dtype=bool)
+    for col in keys:
+        is_other |= (df[col] == OTHER).to_numpy()
+    agg = {c: ("mean" if _AVERAGE.search(str(c)) else "sum") for c in numeric}
+    other = df[is_other].groupby(keys, dropna=False, sort=False, as_index=False).agg(agg)
+    return pd.concat([df[~is_other], other[df.columns]], ignore_index=True)
+
+
+def downsample_time_series(df: pd.DataFrame, time_col, max_points: int, max_categories: int) -> pd.DataFrame:
+    """LTTB per numeric column, and per series when a low cardinality column splits the frame into several lines."""
+    df = df.sort_values(time_col, kind="stable")
+    x = _as_float(pd.to_datetime(df[time_col], errors="coerce")) if _is_text(df[time_col]) else _as_float(df[time_col])
+    numeric = [c for c in df.select_dtypes(include="number").columns if c != time_col]
+    series_cols = [c for c in _category_columns(df, time_col) if df[c].nunique() <= max_categories]
+
+    positions = np.arange(len(df))
+    groups = [positions] if not series_cols else [positions[g] for g in df.groupby(series_cols, sort=False).indices.values()]
+    budget = max(3, max_points // max(1, len(groups) * max(1, len(numeric))))
+    keep = []
+    for group in groups:
+        if not numeric:
+            keep.append(group[_even_indices(len(group), budget)])
+            continue
+        for col in numeric:
+            keep.append(group[lttb_indices(x[group], df[col].to_numpy()[group], budget)])
+    return df.iloc[np.unique(np.concatenate(keep))]
+
+
+def bin_rows(df: pd.DataFrame, value_col, max_points: int, max_categories: int) -> pd.DataFrame:
+    """
+    Equal-frequency bins along `value_col`: rows are sorted by it and split
+    into bins holding the same number of rows, separately for every
+    combination of the low cardinality columns. Each bin becomes one row with
+    the mean of every numeric column, so quantiles (the shape of the
+    distribution) are kept. Other columns take the bin's first value.
+    """
+    numeric = list(df.select_dtypes(include="number").columns)
+    keys = [c for c in _category_columns(df) if df[c].nunique(dropna=False) <= max_categories]
+    ordered = df.sort_values(value_col, kind="stable")
+    positions = np.arange(len(ordered))
+    groups = [positions] if not keys else list(ordered.groupby(keys, sort=False, dropna=False).indices.values())
+    budget = max(1, max_points // len(groups))
+    bins = np.empty(len(ordered), dtype=np.int64)
+    for g, group in enumerate(groups):
+        bins[group] = g * budget + (np.arange(len(group)) * budget) // len(group)
+    agg = {c: ("mean" if c in numeric else "first") for c in df.columns}
+    return ordered.groupby(bins, sort=True).agg(agg)[df.columns]
+
+
+def downsample_for_chart(df: pd.DataFrame, max_points=None, max_categories=None, plotly_code=None) -> pd.DataFrame:
+    """
+    Bound the frame handed to Plotly code, whatever the size of the result.
+
+    Categorical columns are capped to top-N plus "Other"; time series are
+    reduced with LTTB; anything else still too long is reduced to
+    equal-frequency bins of the plotted value column, one row per bin
+    (`bin_rows`). A frame without any numeric column is sampled at evenly
+    spaced rows.
+
+    When `plotly_code` counts rows or plots their distribution (see
+    `counts_rows`), no rows are merged or dropped, since that would change
+    the counts: categories are only relabelled, and the figure is bounded
+    afterwards by `downsample_figure` (histograms become pre-binned bars).
+    """
+    max_points, max_categories = _limits(max_points, max_categories)
+    if df is None or df.empty:
+        return df
+    n = len(df)
+    time_col = _time_column(df)
+    keep_rows = counts_rows(plotly_code)
+    df = cap_categories(df, max_categories, exclude=time_col, fold=not keep_rows)
+    if len(df) > max_points and not keep_rows:
+        if time_col is not None:
+            df = downsample_time_series(df, time_col, max_points, max_categories)
+        else:
+            value = value_column(df)
+            if value is not None:
+                df = bin_rows(df, value, max_points, max_categories)
+            else:
+                df = df.sort_values(df.columns[0], kind="stable")
+                df = df.iloc[_even_indices(len(df), max_points)]
+    if len(df) < n:
+        df = df.reset_index(drop=True)
+        df.attrs["downsampled_from"] = n
+        print(f"Chart data downsampled from {n} to {len(df)} rows")
+    return df
+
+
+def _histogram_as_bar(trace, max_bins: int):
+    import plotly.graph_objects as go
+
+    vertical = trace.x is not None
+    values = pd.Series(trace.x if vertical else trace.y)
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.notna().all():
+        nbins = (trace.nbinsx if vertical else trace.nbinsy) or min(max_bins, 100)
+        counts, edges = np.histogram(numeric.to_numpy(dtype=float), bins=nbins)
+        positions, widths = (edges[:-1] + edges[1:]) / 2, np.diff(edges)
+    else:
+        value_counts = values.value_counts()
+        positions, counts, widths = value_counts.index.to_numpy(), value_counts.to_numpy(), None
+    bar = dict(name=trace.name, marker=trace.marker, legendgroup=trace.legendgroup, showlegend=trace.showlegend,
+               xaxis=trace.xaxis, yaxis=trace.yaxis, width=widths, orientation="v" if vertical else "h")
+    if vertical:
+        return go.Bar(x=positions, y=counts, **bar)
+    return go.Bar(x=counts, y=positions, **bar)
+
+
+def downsample_figure(fig, max_points=None):
+    """
+    Last line of defence for plot code that builds its own large traces:
+    scatter traces are reduced with LTTB and count histograms are pre-binned
+    into bars, so the figure JSON stays bounded.
+    """
+    import plotly.graph_objects as go
+
+    max_points, _ = _limits(max_points)
+    if fig is None:
+        return fig
+    traces = []
+    changed = False
+    for trace in fig.data:
+        if trace.type in ("scatter", "scattergl") and trace.x is not None and trace.y is not None and len(trace.x) > max_points:
+            x = _as_float(trace.x)
+            if np.all(np.diff(x) >= 0):
+                idx = lttb_indices(x, _as_float(trace.y), max_points)
+            else:
+                idx = _even_indices(len(x), max_points)
+            update = {"x": np.asarray(trace.x)[idx], "y": np.asarray(trace.y)[idx]}
+            for name in ("text", "hovertext", "customdata"):
+                values = getattr(trace, name)
+                if values is not None and not isinstance(values, str) and len(values) == len(x):
+                    update[name] = np.asarray(values)[idx]
+            trace.update(update)
+            changed = True
+        elif trace.type == "histogram" and (trace.x is None) != (trace.y is None) and len(trace.x if trace.x is not None else trace.y) > max_points:
+            trace = _histogram_as_bar(trace, max_points)
+            changed = True
+        traces.append(trace)
+    if not changed:
+        return fig
+    return go.Figure(data=traces, layout=fig.layout)
+
+
+def chart_figure(vn, plotly_code: str, df: pd.DataFrame, max_points=None, max_categories=None):
+    """Run Plotly code on a downsampled copy of `df` and bound the resulting figure."""
+    df = downsample_for_chart(df, max_points, max_categories, plotly_code)
+    with timed("plotly"):
+        fig = vn.get_plotly_figure(plotly_code=plotly_code, df=df)
+    return downsample_figure(fig, max_points)
@@ -1,48 +1,46 @@
 import numpy as np
 import pandas as pd
 import json
+import os
+import sys
 try:
     from .vectordatabase import VectorDB
-except:
-    from vectordatabase import VectorDB
-from sentence_transformers import SentenceTransformer
+    from .ingest import ingest, read_chunks, rows_to_text
+    from .embedding_models import get_embedding_model
+except ImportError:
+    # Run as a script: lib/ is on the path but not the repository root.
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from lib.vectordatabase import VectorDB
+    from lib.ingest import ingest, read_chunks, rows_to_text
+    from lib.embedding_models import get_embedding_model
 import time
 import random
 
-def database_demo():
-        
-    # Load data for retrieval
-    knowledge_base = [
-        {"title": "How do I reset my email password?", "content": "Visit the IT portal and click 'Forgot Password.'"},
-        {"title": "What is the reimbursement process?", "content": "Submit receipts on the Finance portal under 'Reimbursements'."},
-        {"title": "Password Reset", "content": "To reset your password, go to the IT portal and click 'Forgot Password'."},
-        {"title": "Reimbursement Process", "content": "Submit your receipts on the Finance portal under 'Reimbursements'."},
-        {"title": "Leave Policy", "content": "The company offers 20 days of paid leave per year."}
-    ]
+# Load data for retrieval
+knowledge_base = [
+    {"title": "How do I reset my email password?", "content": "Visit the IT portal and click 'Forgot Password.'"},
+    {"title": "What is the reimbursement process?", "content": "Submit receipts on the Finance portal under 'Reimbursements'."},
+    {"title": "Password Reset", "content": "To reset your password, go to the IT portal and click 'Forgot Password'."},
+    {"title": "Reimbursement Process", "content": "Submit your receipts on the Finance portal under 'Reimbursements'."},
+    {"title": "Leave Policy", "content": "The company offers 20 days of paid leave per year."}
+]
 
-    sales_df = pd.read_csv("data_storage/customers.csv")
-    info1 = []
-    for _, row in sales_df.iterrows():
-        row_txt = 'Customer Record: '
-        for key in row.keys():
-            row_txt = row_txt + f'{key} - {row[key]}, '
-        info1.append(row_txt)
+# Tables indexed row by row, with the prefix each row's text starts with.
+SOURCES = [
+    ("data_storage/customers.csv", "Customer Record: "),
+    ("data_storage/orders.csv", "Order Record: "),
+    ("data_storage/products.csv", "Product Record: "),
+]
 
-    sales_df = pd.read_csv("data_storage/orders.csv")
-    info2 = []
-    for _, row in sales_df.iterrows():
-        row_txt = 'Order Record: '
-        for key in row.keys():
-            row_txt = row_txt + f'{key} - {row[key]}, '
-        info2.append(row_txt)
+def knowledge_base_texts():
+    return [f"title : {item['title']}, content : {item['content']}" for item in knowledge_base]
 
-    sales_df = pd.read_csv("data_storage/products.csv")
-    info3 = []
-    for _, row in sales_df.iterrows():
-        row_txt = 'Product Record: '
-        for key in row.keys():
-            row_txt = row_txt + f'{key} - {row[key]}, '
-        info3.append(row_txt)
+def database_demo():
+    # Every text in memory at once; `ingest` streams the same rows instead.
+    infos = []
+    for path, prefix in SOURCES:
+        for df in read_chunks(path):
+            infos += rows_to_text(df, prefix)
 
     # hr_texts = []
     # with open("data_storage/hr_database.jsonl", "r") as file:
@@ -53,25 +51,27 @@ def database_demo():
     #             row_txt = row_txt + f'{key} - {record[key]}, '
     #         hr_texts.append(row_txt)
 
-    knowledge_texts = [f"title : {item['title']}, content : {item['content']}" for item in knowledge_base] + info1 + info2 + info3
+    knowledge_texts = knowledge_base_texts() + infos
     # knowledge_texts = [q for q in knowledge_sql]
-    print(knowledge_texts)
     print(f"Total Entries: {len(knowledge_texts)}")
 
     return knowledge_texts
 
 if __name__ == "__main__":
-    knowledge_texts = database_demo()
-    st_time = time.time()
-    embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
-    embeddings = embedding_model.encode(knowledge_texts, show_progress_bar=True)
-    print(f'encoding time: {time.time() - st_time} s')
-
+    # `--reembed` rebuilds from the CSV files even when a snapshot exists.
+    snapshot = os.getenv("KNOWLEDGE_SNAPSHOT", "data_storage/knowledge_base.npz")
     db = VectorDB(database_path= "data_storage/democompany-vector.db")
-    db.drop_collection()
-    db.create_db()
-    db.insert_data(embeddings, knowledge_texts)
+    if os.path.exists(snapshot) and "--reembed" not in sys.argv:
+        st_time = time.time()
+        db.restore_snapshot(snapshot, model="all-MiniLM-L6-v2")
+        print(f'restore time: {time.time() - st_time} s')
+    else:
+        db.drop_collection()
+        db.create_db()
+        # Chunked reads, a process pool for the embeddings and one flush at the end.
+        print(ingest(db, SOURCES, texts=knowledge_base_texts(), model_name="all-MiniLM-L6-v2"))
+        db.export_snapshot(snapshot, model="all-MiniLM-L6-v2")
     db.getAllData()
-    vector = embedding_model.encode('Who is top spender?')
+    vector = get_embedding_model("all-MiniLM-L6-v2").encode_queries(['Who is top spender?'])[0]
     queries = db.query_topk(vector, topk=2)
-    print(queries)
\ No newline at end of file
+    print(queries)
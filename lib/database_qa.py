@@ -13,6 +13,7 @@ from operator import itemgetter
 import re
 import ast
 from datetime import time
+from .sqlite_pool import get_sqlite_pool
 
 def convert_time_columns(df):
     for col in df.columns:
@@ -29,27 +30,33 @@ def getcsv2sql():
     # df2 = pd.read_csv("data_storage/orders.csv")
     # df3 = pd.read_csv("data_storage/products.csv")
 
-    engine = create_engine("sqlite:///data_storage/demosales.db")
-    metadata = MetaData()
-    metadata.reflect(bind=engine)
-    metadata.drop_all(bind=engine)
+    db_path = "data_storage/demosales.db"
 
     # Read all sheets into a dictionary of DataFrames
     excel_file = "/Users/visarutt/Downloads/POS_Datasource.xlsx"
     sheet_dict = pd.read_excel(excel_file, sheet_name=None, engine="openpyxl")
 
-    # Loop over each sheet and write to SQL
-    for sheet_name, df in sheet_dict.items():
+    # All writes go through the pool's single writer. `to_sql` commits each
+    # table as it is written, so a failure part way leaves the earlier ones.
+    with get_sqlite_pool(db_path).writer() as conn:
+        tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+        for (table,) in tables:
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
 
-        df.columns = [clean_column_names(col) for col in df.columns]
-        # Clean the sheet name to use as table name
-        df = convert_time_columns(df)
-        table_name = sheet_name.lower().replace(" ", "_")
-        
-        # Write to SQL (append=False will overwrite if exists)
-        df.to_sql(table_name, engine, if_exists="replace", index=False)
+        # Loop over each sheet and write to SQL
+        for sheet_name, df in sheet_dict.items():
 
-        print(f"Imported sheet '{sheet_name}' into table '{table_name}'")
+            df.columns = [clean_column_names(col) for col in df.columns]
+            # Clean the sheet name to use as table name
+            df = convert_time_columns(df)
+            table_name = sheet_name.lower().replace(" ", "_")
+
+            # Write to SQL (append=False will overwrite if exists)
+            df.to_sql(table_name, conn, if_exists="replace", index=False)
+
+            print(f"Imported sheet '{sheet_name}' into table '{table_name}'")
+
+    engine = create_engine(f"sqlite:///{db_path}")
 
     # df1.to_sql("customers", engine, index=False)
     # df2.to_sql("orders", engine, index=False)
@@ -60,6 +67,7 @@ def getcsv2sql():
     return db
 
 if __name__ == "__main__":
+    # Run as `python -m lib.database_qa` from the repository root.
     db = getcsv2sql()
     print(db.get_usable_table_names())
 
@@ -0,0 +1,77 @@
+import base64
+import io
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Binary DataFrame formats. JSON (records) stays the fallback so older clients
+# and environments without pyarrow keep working.
+MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "json": "application/json",
+}
+
+
+def negotiate_format(accept: str) -> str:
+    """Pick the DataFrame format for a response from the request's Accept header."""
+    if pa is None or not accept:
+        return "json"
+    for fmt in ("arrow", "parquet"):
+        if MEDIA_TYPES[fmt] in accept:
+            return fmt
+    return "json"
+
+
+def encode_dataframe(df: pd.DataFrame, fmt: str = "arrow"):
+    """Return `(format, payload bytes)`; falls back to JSON when Arrow cannot represent a column."""
+    if fmt in ("arrow", "parquet") and pa is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if fmt == "arrow":
+                sink = pa.BufferOutputStream()
+                with pa.ipc.new_stream(sink, table.schema) as writer:
+                    writer.write_table(table)
+                return fmt, sink.getvalue().to_pybytes()
+            buffer = io.BytesIO()
+            pq.write_table(table, buffer)
+            return fmt, buffer.getvalue()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+            print(f"Falling back to JSON DataFrame transport: {e}")
+    return "json", df.to_json(orient="records").encode("utf-8")
+
+
+def decode_dataframe(data: bytes, fmt: str) -> pd.DataFrame:
+    if fmt == "arrow":
+        return pa.ipc.open_stream(data).read_pandas()
+    if fmt == "parquet":
+        return pq.read_table(pa.BufferReader(data)).to_pandas()
+    return pd.read_json(io.StringIO(data.decode("utf-8")), dtype=None, precise_float=True)
+
+
+def dataframe_to_field(df: pd.DataFrame, fmt: str = "json"):
+    """
+    Embed a DataFrame in a JSON body. JSON keeps the legacy records string;
+    binary formats are sent as `{"format": ..., "data": <base64>}`.
+    """
+    fmt, payload = encode_dataframe(df, fmt)
+    if fmt == "json":
+        return payload.decode("utf-8")
+    return {"format": fmt, "data": base64.b64encode(payload).decode("ascii")}
+
+
+def dataframe_from_field(value) -> pd.DataFrame:
+    """Inverse of `dataframe_to_field`; also accepts the legacy double encoded JSON string."""
+    if isinstance(value, dict):
+        return decode_dataframe(base64.b64decode(value["data"]), value["format"])
+    if isinstance(value, str) and value.startswith('"'):
+        # Legacy clients post orjson.dumps(df.to_json(...)): a JSON string holding JSON.
+        value = json.loads(value)
+    return pd.read_json(io.StringIO(value), dtype=None, precise_float=True)
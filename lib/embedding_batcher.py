@@ -0,0 +1,115 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .metrics import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT
+
+
+class MicroBatcher:
+    """
+    Dynamic batching for an `encoder(list_of_texts)`: calls arriving within
+    `max_wait_ms` of each other (up to `max_batch` texts) are encoded as one
+    batch on a worker thread and each caller gets its own rows back. Calls
+    that already carry `max_batch` texts skip the queue. While requests come
+    one at a time (the last batch held one call and nothing else is queued)
+    there is no wait, so a lone caller pays no extra latency.
+    """
+    def __init__(self, encoder, model: str = "", kind: str = "", max_batch=None, max_wait_ms=None):
+        self.encoder = encoder
+        self.model = model
+        self.kind = kind
+        self.max_batch = max_batch or int(os.getenv("EMBED_BATCH_MAX", 32))
+        wait_ms = max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBED_BATCH_WAIT_MS", 5))
+        self.max_wait = wait_ms / 1000
+        self._queue = queue.Queue()
+        self._last_batch = 1
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def encode(self, texts: list) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if len(texts) >= self.max_batch:
+            EMBED_BATCH_SIZE.observe(len(texts), model=self.model, kind=self.kind)
+            return _as_matrix(self.encoder(texts))
+        future = Future()
+        self._queue.put((texts, future, time.perf_counter()))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"embed-batch-{self.kind}", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        first = self._queue.get()
+        batch = [first]
+        size = len(first[0])
+        busy = self._last_batch > 1 or not self._queue.empty()
+        deadline = first[2] + (self.max_wait if busy else 0)
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                # Past the deadline, still take whatever queued up while the last batch ran.
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        self._last_batch = len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._encode_batch(batch)
+            except BaseException as e:
+                # Whatever goes wrong fails this batch's callers instead of
+                # killing the worker and leaving every later call waiting.
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _encode_batch(self, batch: list):
+        start = time.perf_counter()
+        texts = [text for item in batch for text in item[0]]
+        for _, _, enqueued in batch:
+            EMBED_BATCH_WAIT.observe(start - enqueued, model=self.model, kind=self.kind)
+        EMBED_BATCH_SIZE.observe(len(texts), model=self.model, kind=self.kind)
+        vectors = _as_matrix(self.encoder(texts))
+        offset = 0
+        for item_texts, future, _ in batch:
+            future.set_result(vectors[offset:offset + len(item_texts)])
+            offset += len(item_texts)
+
+
+def _as_matrix(vectors) -> np.ndarray:
+    return np.asarray([np.asarray(v, dtype=np.float32) for v in vectors], dtype=np.float32)
+
+
+class BatchedEmbedding:
+    """An embedding model whose `encode_queries` and `encode_documents` go through a `MicroBatcher` each."""
+    def __init__(self, model, model_name: str = "", max_batch=None, max_wait_ms=None):
+        self.model = model
+        self.queries = MicroBatcher(model.encode_queries, model_name, "query", max_batch, max_wait_ms)
+        self.documents = MicroBatcher(model.encode_documents, model_name, "document", max_batch, max_wait_ms)
+
+    def encode_queries(self, texts: list) -> np.ndarray:
+        return self.queries.encode(texts)
+
+    def encode_documents(self, texts: list) -> np.ndarray:
+        return self.documents.encode(texts)
+
+    def __getattr__(self, name):
+        # model_name, dim, ... of the wrapped model.
+        if "model" not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.__dict__["model"], name)
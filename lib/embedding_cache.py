@@ -0,0 +1,214 @@
+import fcntl
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .metrics import cache_lookup
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _DiskTier:
+    """
+    Append-only float32 matrix (`vectors.f32`, read through `np.memmap`) plus
+    an `index.tsv` of `key<TAB>row` lines. Appends take an exclusive `flock`,
+    so several worker processes can share one directory.
+    """
+    def __init__(self, path: str, dim: int):
+        os.makedirs(path, exist_ok=True)
+        self.dim = dim
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.index_path = os.path.join(path, "index.tsv")
+        self._index = {}
+        self._index_offset = 0
+        self._matrix = None
+        self._lock = threading.Lock()
+        open(self.vectors_path, "ab").close()
+        open(self.index_path, "ab").close()
+        self._load_index()
+
+    def _load_index(self):
+        # Picks up rows appended by other processes since the last read. A
+        # line still being written is left for the next read; a complete but
+        # corrupt one is skipped, so one bad line does not disable the tier.
+        # Vectors are flushed before their index lines, so a row past the end
+        # of the vector file can only come from a corrupt line.
+        rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._index_offset += len(line)
+                try:
+                    key, row = line[:-1].decode("utf-8").split("\t")
+                    row = int(row)
+                except ValueError:
+                    continue
+                if key and 0 <= row < rows:
+                    self._index[key] = row
+
+    def _row(self, row: int) -> np.ndarray:
+        if self._matrix is None or row >= self._matrix.shape[0]:
+            rows = os.path.getsize(self.vectors_path) // (4 * self.dim)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim)) if rows else None
+        return np.array(self._matrix[row])
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                return None
+            return self._row(row)
+
+    def put_many(self, items: list):
+        with self._lock, open(self.index_path, "a", encoding="utf-8") as index, open(self.vectors_path, "ab") as vectors:
+            fcntl.flock(index, fcntl.LOCK_EX)
+            try:
+                self._load_index()
+                items = [(key, vector) for key, vector in items if key not in self._index]
+                # A crashed writer may have left a partial index line or
+                # vectors no index line points at; drop them so the rows
+                # appended now land where their index lines say.
+                row = max(self._index.values(), default=-1) + 1
+                index.truncate(self._index_offset)
+                vectors.truncate(row * 4 * self.dim)
+                lines = []
+                for key, vector in items:
+                    vectors.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    lines.append(f"{key}\t{row}\n")
+                    row += 1
+                vectors.flush()
+                index.write("".join(lines))
+                index.flush()
+            finally:
+                fcntl.flock(index, fcntl.LOCK_UN)
+            self._load_index()
+
+
+class EmbeddingCache:
+    """
+    Embeddings keyed on the SHA-256 of the text, for one model.
+
+    An in-memory LRU of `max_entries` vectors sits in front of an optional
+    on-disk tier under `disk_dir/<model>-<dim>/`, which survives restarts.
+    Texts found in either tier never reach the encoder.
+    """
+    def __init__(self, model_name: str, dim=None, max_entries=None, disk_dir=None):
+        self.model_name = model_name
+        self.max_entries = max_entries or int(os.getenv("EMBED_CACHE_SIZE", 10_000))
+        self.disk_dir = disk_dir if disk_dir is not None else os.getenv("EMBED_CACHE_DIR")
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._disk = None
+        self._lock = threading.Lock()
+        self._safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        if self.disk_dir:
+            # Without a known dimension, reuse the tier a previous run left behind.
+            if self.dim is None and os.path.isdir(self.disk_dir):
+                pattern = re.compile(rf"^{re.escape(self._safe_name)}-(\d+)$")
+                for entry in sorted(os.listdir(self.disk_dir)):
+                    match = pattern.match(entry)
+                    if match:
+                        self.dim = int(match.group(1))
+                        break
+            if self.dim is not None:
+                self._disk_tier(self.dim)
+
+    def _disk_tier(self, dim: int):
+        if self.disk_dir and self._disk is None:
+            self._disk = _DiskTier(os.path.join(self.disk_dir, f"{self._safe_name}-{dim}"), dim)
+        return self._disk
+
+    def get(self, text: str):
+        key = text_key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                return vector
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def encode(self, texts: list, encoder) -> list:
+        """
+        Embeddings of `texts`, calling `encoder(list_of_texts)` once for the
+        ones not cached. Returns float32 vectors in the order of `texts`.
+        """
+        vectors = [self.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        for vector in vectors:
+            cache_lookup("embedding", hit=vector is not None)
+        if not missing:
+            return vectors
+
+        # Duplicates within one call are encoded once.
+        unique = list(dict.fromkeys(texts[i] for i in missing))
+        encoded = {text: np.asarray(vector, dtype=np.float32) for text, vector in zip(unique, encoder(unique))}
+        items = []
+        for text, vector in encoded.items():
+            key = text_key(text)
+            self._remember(key, vector)
+            items.append((key, vector))
+        if self.dim is None:
+            self.dim = int(next(iter(encoded.values())).shape[0])
+        disk = self._disk_tier(self.dim)
+        if disk is not None:
+            disk.put_many(items)
+        for i in missing:
+            vectors[i] = encoded[texts[i]]
+        return vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"model": self.model_name, "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "disk": self._disk is not None}
+
+
+_embedding_caches = {}
+_embedding_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model_name: str, dim=None):
+    """Process wide cache per model name (and dimension), or None when disabled with `EMBED_CACHE=0`."""
+    if os.getenv("EMBED_CACHE", "1") == "0":
+        return None
+    with _embedding_caches_lock:
+        key = (model_name, dim)
+        if key not in _embedding_caches:
+            _embedding_caches[key] = EmbeddingCache(model_name, dim=dim)
+        return _embedding_caches[key]
+
+
+def embedding_cache_stats() -> list:
+    with _embedding_caches_lock:
+        caches = list(_embedding_caches.values())
+    return [cache.stats() for cache in caches]
+
+
+def cached_encode(cache, texts: list, encoder) -> list:
+    """`cache.encode(texts, encoder)`, or plain `encoder(texts)` when caching is off."""
+    if cache is None:
+        return list(encoder(texts))
+    return cache.encode(texts, encoder)
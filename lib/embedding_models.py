@@ -0,0 +1,148 @@
+import os
+import threading
+
+from .warmup import Deferred
+from .embedding_batcher import BatchedEmbedding
+
+# pymilvus' `model.DefaultEmbeddingFunction()`.
+DEFAULT_EMBEDDING_MODEL = "GPTCache/paraphrase-albert-onnx"
+
+# Output dimension of the embedding models in use here, so vector collections
+# can be created without loading a model and encoding a probe text. Others can
+# be added with `EMBED_DIMENSIONS="name=dim,name=dim"`.
+KNOWN_DIMENSIONS = {
+    DEFAULT_EMBEDDING_MODEL: 768,
+    "all-MiniLM-L6-v2": 384,
+    "sentence-transformers/all-MiniLM-L6-v2": 384,
+    "all-mpnet-base-v2": 768,
+    "sentence-transformers/all-mpnet-base-v2": 768,
+    "BAAI/bge-small-en-v1.5": 384,
+    "BAAI/bge-base-en-v1.5": 768,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+_probed = {}
+_probed_lock = threading.Lock()
+
+
+def _configured_dimensions() -> dict:
+    dimensions = dict(KNOWN_DIMENSIONS)
+    for entry in os.getenv("EMBED_DIMENSIONS", "").split(","):
+        name, _, dim = entry.rpartition("=")
+        if name.strip() and dim.strip().isdigit():
+            dimensions[name.strip()] = int(dim)
+    return dimensions
+
+
+def embedding_model_name(embedding_function) -> str:
+    return getattr(embedding_function, "model_name", None) or type(embedding_function).__name__
+
+
+def embedding_dim(model_name: str, embedding_function=None) -> int:
+    """
+    Dimension of `model_name`'s vectors: from the registry when known, else
+    from the function's `dim`, else by encoding one text (remembered for the
+    rest of the process).
+    """
+    dim = _configured_dimensions().get(model_name)
+    if dim is not None:
+        return dim
+    with _probed_lock:
+        if model_name in _probed:
+            return _probed[model_name]
+    if embedding_function is None:
+        raise ValueError(f"Unknown embedding dimension for '{model_name}', set EMBED_DIMENSIONS")
+    dim = getattr(embedding_function, "dim", None)
+    if not isinstance(dim, int):
+        print(f"Probing the dimension of '{model_name}', add it to EMBED_DIMENSIONS to skip this")
+        dim = int(embedding_function.encode_documents(["foo"])[0].shape[0])
+    with _probed_lock:
+        _probed[model_name] = dim
+    return dim
+
+
+def load_default_embedding_function():
+    # pymilvus.model pulls in onnxruntime and the tokenizer; only import it when needed.
+    from pymilvus import model
+
+    return model.DefaultEmbeddingFunction()
+
+
+class SentenceTransformerEmbedding:
+    """A SentenceTransformer behind the `encode_queries` / `encode_documents` interface of pymilvus embedding functions."""
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode_queries(self, texts: list):
+        return self.model.encode(list(texts))
+
+    def encode_documents(self, texts: list):
+        return self.model.encode(list(texts))
+
+
+def _local_loader(model_name: str):
+    if model_name == DEFAULT_EMBEDDING_MODEL:
+        return load_default_embedding_function
+    return lambda: SentenceTransformerEmbedding(model_name)
+
+
+def _load_local(model_name: str):
+    model = _local_loader(model_name)()
+    # Concurrent single question encodes are batched unless EMBED_BATCH=0.
+    if os.getenv("EMBED_BATCH", "1") == "0":
+        return model
+    return BatchedEmbedding(model, model_name)
+
+
+def _connect_remote(socket_path: str, model_name: str):
+    from .embedding_server import RemoteEmbedding
+
+    model = RemoteEmbedding(socket_path, model_name)
+    # The load only succeeds (and `/ready` only passes) once the server answers with this model loaded.
+    model.encode_queries(["ping"])
+    return model
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def embedding_model(model_name: str, local: bool = False) -> Deferred:
+    """
+    The process wide load of `model_name`, shared by every caller so a model
+    sits in memory once per process however many Vanna instances use it.
+
+    With `EMBED_SERVER_SOCKET` set (and `local` not), the value is a client of
+    the embedding server on that socket instead (see `lib.embedding_server`),
+    so several API workers share one copy of the model.
+    """
+    socket_path = None if local else os.getenv("EMBED_SERVER_SOCKET")
+    key = (model_name, socket_path)
+    with _models_lock:
+        if key not in _models:
+            if socket_path:
+                loader = lambda: _connect_remote(socket_path, model_name)
+            else:
+                loader = lambda: _load_local(model_name)
+            _models[key] = Deferred(model_name, loader)
+        return _models[key]
+
+
+def get_embedding_model(model_name: str, local: bool = False):
+    """`embedding_model(model_name).get()`: waits for the model to load."""
+    return embedding_model(model_name, local).get()
+
+
+def embedding_model_stats() -> dict:
+    with _models_lock:
+        models = dict(_models)
+    return {
+        name if socket_path is None else f"{name} @ {socket_path}": model.status()
+        for (name, socket_path), model in models.items()
+    }
@@ -0,0 +1,171 @@
+"""
+Out of process embedding worker.
+
+One process loads the embedding models and serves encode requests on a unix
+socket, so uvicorn workers (and the middlewareV1 app) share a single copy of
+each model instead of loading one per process:
+
+    python -m lib.embedding_server --socket /tmp/llmmiddleware-embed.sock --model GPTCache/paraphrase-albert-onnx
+    EMBED_SERVER_SOCKET=/tmp/llmmiddleware-embed.sock uvicorn middleware:app --workers 4
+
+Frames are a 4 byte big-endian length followed by the payload. A request is
+one JSON frame `{"model", "kind": "query" | "document", "texts"}`; the reply
+is a JSON frame `{"ok", "count", "dim"}` followed by the vectors as raw
+float32 bytes, or `{"ok": false, "error"}`. Only the models the server was
+started with are served.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+_LENGTH = struct.Struct(">I")
+
+
+def _recv_exactly(sock, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding server connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock) -> bytes:
+    (size,) = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    return _recv_exactly(sock, size)
+
+
+def send_frame(sock, payload: bytes):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def encode(model, kind: str, texts: list) -> np.ndarray:
+    encoder = model.encode_queries if kind == "query" else model.encode_documents
+    vectors = encoder(texts)
+    return np.asarray([np.asarray(v, dtype=np.float32) for v in vectors], dtype=np.float32)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        from .embedding_models import get_embedding_model
+
+        models = self.server.models
+        while True:
+            try:
+                request = json.loads(recv_frame(self.request))
+            except ConnectionError:
+                return
+            except ValueError as e:
+                # The frame was read whole, so the connection is still usable.
+                send_frame(self.request, json.dumps({"ok": False, "error": f"malformed request: {e}"}).encode("utf-8"))
+                continue
+            model = request.get("model") if isinstance(request, dict) else None
+            if not isinstance(model, str) or model not in models:
+                # Loading whatever a client names could exhaust memory.
+                send_frame(self.request, json.dumps({"ok": False, "error": f"model {model!r} is not served here"}).encode("utf-8"))
+                continue
+            try:
+                vectors = encode(get_embedding_model(request["model"], local=True), request.get("kind", "document"), request["texts"])
+            except Exception as e:
+                send_frame(self.request, json.dumps({"ok": False, "error": str(e)}).encode("utf-8"))
+                continue
+            count, dim = vectors.shape if vectors.ndim == 2 else (0, 0)
+            send_frame(self.request, json.dumps({"ok": True, "count": count, "dim": dim}).encode("utf-8"))
+            send_frame(self.request, vectors.tobytes())
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, models):
+        super().__init__(socket_path, _Handler)
+        self.models = frozenset(models)
+
+
+def serve(socket_path: str, models=()):
+    from .embedding_models import DEFAULT_EMBEDDING_MODEL, embedding_model
+
+    models = list(models) or [DEFAULT_EMBEDDING_MODEL]
+    for name in models:
+        embedding_model(name, local=True).start()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    with EmbeddingServer(socket_path, models) as server:
+        print(f"embedding server listening on {socket_path}")
+        server.serve_forever()
+
+
+class RemoteEmbedding:
+    """
+    Client of an embedding server with the `encode_queries` /
+    `encode_documents` interface of a local model. Each thread keeps its own
+    connection, reconnecting once if the server restarted. A call waits at
+    most `timeout` seconds (`EMBED_SERVER_TIMEOUT`) for each send or receive.
+    """
+    def __init__(self, socket_path: str, model_name: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.timeout = timeout or float(os.getenv("EMBED_SERVER_TIMEOUT", 60))
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _encode(self, kind: str, texts: list) -> np.ndarray:
+        request = json.dumps({"model": self.model_name, "kind": kind, "texts": list(texts)}).encode("utf-8")
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_frame(sock, request)
+                header = json.loads(recv_frame(sock))
+                if not header["ok"]:
+                    raise RuntimeError(f"embedding server: {header['error']}")
+                data = recv_frame(sock)
+                return np.frombuffer(data, dtype=np.float32).reshape(header["count"], header["dim"])
+            except TimeoutError:
+                # A hung server would hang the retry too; the stream is out of step anyway.
+                self._drop_connection()
+                raise
+            except OSError:
+                self._drop_connection()
+                if attempt:
+                    raise
+
+    def encode_queries(self, texts: list) -> np.ndarray:
+        return self._encode("query", texts)
+
+    def encode_documents(self, texts: list) -> np.ndarray:
+        return self._encode("document", texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve embedding models on a unix socket.")
+    parser.add_argument("--socket", default=os.getenv("EMBED_SERVER_SOCKET", "/tmp/llmmiddleware-embed.sock"))
+    parser.add_argument("--model", action="append", default=[],
+                        help="Model to serve, loaded at start (repeatable; default: the pymilvus default model). Requests for other models are refused")
+    args = parser.parse_args()
+    serve(args.socket, args.model)
+
+
+if __name__ == "__main__":
+    main()
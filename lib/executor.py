@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import run_traced
+from .metrics import POOL_ABANDONED
+
+# Blocking work is split into three pools so a slow provider call cannot
+# starve SQL execution or embedding/Plotly work (and vice versa).
+#   llm : network bound calls to the LLM provider (generate_sql, submit_prompt, ...)
+#   sql : queries against the analytic SQLite database
+#   cpu : embedding, Milvus training and Plotly figure execution
+#   search : the concurrent Milvus searches of one retrieval, submitted from
+#            a job of the other pools (hence a pool of their own)
+# Each pool accepts at most `workers + queue` jobs; anything beyond that is
+# rejected with PoolSaturated instead of piling up behind the event loop.
+POOL_DEFAULTS = {
+    "llm": {"workers": 16, "queue": 64},
+    "sql": {"workers": 4, "queue": 32},
+    "cpu": {"workers": os.cpu_count() or 2, "queue": 16},
+    "search": {"workers": 12, "queue": 36},
+}
+
+
+class PoolSaturated(Exception):
+    pass
+
+
+_cancel = contextvars.ContextVar("pool_cancel", default=None)
+
+
+def cancel_event():
+    """
+    The `threading.Event` set once the caller awaiting the current pool job
+    went away (client disconnect, stage timeout), or None outside of one.
+    Long running jobs can poll it to stop early.
+    """
+    return _cancel.get()
+
+
+def _run_cancellable(cancel, fn, *args, **kwargs):
+    _cancel.set(cancel)
+    return fn(*args, **kwargs)
+
+
+class BoundedPool:
+    def __init__(self, name: str, workers: int, queue: int):
+        self.name = name
+        self.workers = workers
+        self.queue = queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-pool")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._abandoned = 0
+
+    @property
+    def depth(self) -> int:
+        return self._in_flight
+
+    @property
+    def abandoned(self) -> int:
+        """Jobs still holding a slot after their caller was cancelled."""
+        return self._abandoned
+
+    def _abandon(self, future):
+        with self._lock:
+            self._abandoned += 1
+        POOL_ABANDONED.inc(pool=self.name)
+
+        def done(_future):
+            with self._lock:
+                self._abandoned -= 1
+
+        future.add_done_callback(done)
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated(f"{self.name} pool is saturated ({self.workers} workers, {self.queue} queued)")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # Carry the caller's context (trace id, profiling) onto the worker thread.
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, run_traced, fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        cancel = threading.Event()
+        future = self.submit(_run_cancellable, cancel, fn, *args, **kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A queued job is dropped with the awaiting task; a running one
+            # cannot be interrupted and keeps its slot until it returns,
+            # unless it polls `cancel_event()`.
+            cancel.set()
+            if not future.done():
+                self._abandon(future)
+            raise
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> BoundedPool:
+    with _pools_lock:
+        if name not in _pools:
+            defaults = POOL_DEFAULTS[name]
+            workers = int(os.getenv(f"{name.upper()}_POOL_WORKERS", defaults["workers"]))
+            queue = int(os.getenv(f"{name.upper()}_POOL_QUEUE", defaults["queue"]))
+            _pools[name] = BoundedPool(name, workers, queue)
+        return _pools[name]
+
+
+async def run_in_pool(name: str, fn, *args, **kwargs):
+    """Run a blocking callable on the named pool and await its result."""
+    return await get_pool(name).run(fn, *args, **kwargs)
+
+
+_END = object()
+
+
+async def stream_in_pool(name: str, fn, *args, **kwargs):
+    """
+    Iterate a blocking generator on the named pool, yielding its items to the event loop.
+
+    The worker stops pulling from the generator and closes it once the
+    consumer goes away, e.g. when a streaming client disconnects or a stage
+    times out.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def produce():
+        if stop.is_set():
+            return
+        iterator = fn(*args, **kwargs)
+        try:
+            for item in iterator:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_END, e))
+            return
+        finally:
+            # Closing the generator lets it close the provider stream and free the slot.
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        loop.call_soon_threadsafe(queue.put_nowait, (_END, None))
+
+    get_pool(name).submit(_run_cancellable, stop, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def shutdown_pools(wait: bool = False):
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown(wait=wait)
+        _pools.clear()
@@ -1,12 +1,9 @@
 import random
 import json
-import sqlite3
 import pandas as pd
+from .sqlite_pool import get_sqlite_pool
 
-conn = sqlite3.connect(
-    database='data_storage/democompany.db',
-    check_same_thread=False,
-)
+DB_PATH = 'data_storage/democompany.db'
 
 def generate_random_question_and_answer():
     """
@@ -75,6 +72,7 @@ def split_question_sql(input_string):
     return result
 
 if __name__ == "__main__":
+    # Run as `python -m lib.gen_sql_database_from_tables` from the repository root.
     SCHEMA = {
         "customers": ['customer_id','name','email','address'],
         "orders": ['order_id','product_id','customer_id','order_date'],
@@ -107,6 +105,8 @@ if __name__ == "__main__":
 
     print(knowledge_sql)
 
+    # Reader connections belong to the thread that asks for them.
+    conn = get_sqlite_pool(DB_PATH).reader()
     i = 0
     for sql in knowledge_sql:
         try:
@@ -0,0 +1,207 @@
+"""
+Streaming bulk ingestion of tabular files into the `knowledge_base` collection.
+
+Files are read in chunks, rows are turned into text column by column (no
+`iterrows`), chunks are embedded on a process pool and inserted in bounded
+batches with a single flush at the end. Only a few chunks are in flight at a
+time, so memory stays flat however large the input is.
+
+    python -m lib.ingest data_storage/customers.csv="Customer Record: " data_storage/orders.csv="Order Record: " --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .embedding_cache import get_embedding_cache, cached_encode
+    from .embedding_models import get_embedding_model
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from lib.embedding_cache import get_embedding_cache, cached_encode
+    from lib.embedding_models import get_embedding_model
+
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+CHUNK_ROWS = 10_000
+INSERT_BATCH = 5_000
+
+
+def read_chunks(path: str, chunk_rows: int = CHUNK_ROWS):
+    """DataFrames of at most `chunk_rows` rows from a CSV or Excel file."""
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        yield from _excel_chunks(path, chunk_rows)
+    elif path.lower().endswith(".xls"):
+        # The legacy format cannot be streamed.
+        df = pd.read_excel(path)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+def _excel_chunks(path: str, chunk_rows: int):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(c) for c in next(rows, ())]
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) == chunk_rows:
+                yield pd.DataFrame(buffer, columns=header)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header)
+    finally:
+        workbook.close()
+
+
+def rows_to_text(df: pd.DataFrame, prefix: str = "") -> list:
+    """`"<prefix>col - value, col - value, "` for every row, built one column at a time."""
+    text = np.full(len(df), prefix, dtype=object).astype(str)
+    for col in df.columns:
+        # str() of each value, as the f-string did (NaN -> "nan", None -> "None").
+        values = df[col].to_numpy(dtype=object).astype(str)
+        text = np.char.add(np.char.add(text, f"{col} - "), np.char.add(values, ", "))
+    return text.tolist()
+
+
+def truncate_bytes(texts: list, max_bytes: int) -> list:
+    # VARCHAR max_length is checked on the UTF-8 size.
+    out = []
+    for text in texts:
+        if len(text) * 4 > max_bytes:
+            encoded = text.encode("utf-8")
+            if len(encoded) > max_bytes:
+                text = encoded[:max_bytes].decode("utf-8", errors="ignore")
+        out.append(text)
+    return out
+
+
+_worker_model = None
+_worker_cache = None
+
+
+def _init_worker(model_name: str, threads=None):
+    if threads is not None:
+        # Pool processes only, before torch/onnxruntime are imported by the model load.
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(var, str(threads))
+        os.environ["EMBED_BATCH"] = "0"
+    global _worker_model, _worker_cache
+    _worker_model = get_embedding_model(model_name, local=True)
+    # Only the on-disk tier (EMBED_CACHE_DIR) is shared between workers and runs.
+    _worker_cache = get_embedding_cache(f"{model_name}:document")
+
+
+def embed_texts(texts: list) -> np.ndarray:
+    vectors = cached_encode(_worker_cache, texts, _worker_model.encode_documents)
+    return np.asarray([np.asarray(v, dtype=np.float32) for v in vectors], dtype=np.float32)
+
+
+class Progress:
+    def __init__(self, every: float = 5.0):
+        self.every = every
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.read = 0
+        self.inserted = 0
+
+    def report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last < self.every:
+            return
+        self._last = now
+        elapsed = now - self.start
+        print(f"ingest: read {self.read} rows, inserted {self.inserted} ({self.inserted / max(elapsed, 1e-9):.0f} rows/s, {elapsed:.1f}s)")
+
+
+def _text_chunks(sources: list, texts: list, chunk_rows: int, max_bytes: int, progress: Progress):
+    if texts:
+        for start in range(0, len(texts), chunk_rows):
+            chunk = truncate_bytes(texts[start:start + chunk_rows], max_bytes)
+            progress.read += len(chunk)
+            yield chunk
+    for path, prefix in sources:
+        for df in read_chunks(path, chunk_rows):
+            progress.read += len(df)
+            yield truncate_bytes(rows_to_text(df, prefix), max_bytes)
+
+
+def ingest(db, sources: list = (), texts: list = (), model_name: str = DEFAULT_MODEL, workers=None,
+           chunk_rows: int = CHUNK_ROWS, insert_batch: int = INSERT_BATCH) -> dict:
+    """
+    Embed and insert `texts` and every row of `sources` (`(path, prefix)`
+    pairs) into the `VectorDB` `db`, whose collection must exist. `workers`
+    embedding processes are used (default: cpu count, `0` embeds in this
+    process). Returns row count and timings.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    progress = Progress()
+    chunks = _text_chunks(list(sources), list(texts), chunk_rows, db.max_length, progress)
+
+    def insert(chunk_texts, vectors):
+        for start in range(0, len(chunk_texts), insert_batch):
+            db.insert_data(vectors[start:start + insert_batch], chunk_texts[start:start + insert_batch], flush=False)
+        progress.inserted += len(chunk_texts)
+        progress.report()
+
+    if workers == 0:
+        _init_worker(model_name)
+        for chunk in chunks:
+            insert(chunk, embed_texts(chunk))
+    else:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(model_name, threads)) as pool:
+            pending = {}
+            for chunk in chunks:
+                # At most two chunks per worker in flight.
+                while len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        insert(pending.pop(future), future.result())
+                pending[pool.submit(embed_texts, chunk)] = chunk
+            for future in list(pending):
+                insert(pending.pop(future), future.result())
+
+    db.flush()
+    progress.report(force=True)
+    elapsed = time.perf_counter() - progress.start
+    return {"rows": progress.inserted, "seconds": round(elapsed, 3), "rows_per_second": round(progress.inserted / max(elapsed, 1e-9), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help='File to ingest, optionally with a row prefix: path="Customer Record: "')
+    parser.add_argument("--db", default="data_storage/democompany-vector.db")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--insert-batch", type=int, default=INSERT_BATCH)
+    parser.add_argument("--append", action="store_true", help="Keep the existing collection instead of recreating it")
+    args = parser.parse_args()
+
+    from lib.embedding_models import embedding_dim
+    from lib.vectordatabase import VectorDB
+
+    db = VectorDB(database_path=args.db, embeding_size=embedding_dim(args.model))
+    if not args.append:
+        db.drop_collection()
+        db.create_db()
+    else:
+        db.getCollection()
+    sources = [tuple(source.split("=", 1)) if "=" in source else (source, "") for source in args.sources]
+    print(ingest(db, sources, model_name=args.model, workers=args.workers, chunk_rows=args.chunk_rows, insert_batch=args.insert_batch))
+
+
+if __name__ == "__main__":
+    main()
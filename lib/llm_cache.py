@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .metrics import cache_lookup
+
+DEFAULT_LLM_CACHE_PATH = "data_storage/llm_cache.db"
+
+
+def normalize_question(question: str) -> str:
+    question = " ".join(question.lower().split())
+    return re.sub(r"[\s?.!]+$", "", question)
+
+
+def normalize_messages(messages) -> list:
+    """`(role, content)` pairs with runs of whitespace collapsed, for prompt cache keys."""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    return [
+        (message.get("role", ""), " ".join(str(message.get("content", "")).split()))
+        if isinstance(message, dict) else " ".join(str(message).split())
+        for message in messages
+    ]
+
+
+def make_key(*parts) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite backed cache of LLM responses shared by every Vanna instance in the process.
+
+    Args:
+        - path: SQLite file. Defaults to `LLM_CACHE_PATH` or `data_storage/llm_cache.db`.
+        - ttl: seconds an entry is served. Defaults to `LLM_CACHE_TTL` (one day).
+        - max_entries: entries kept; least recently used ones are evicted. Defaults to `LLM_CACHE_MAX_ENTRIES`.
+    """
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or os.getenv("LLM_CACHE_PATH", DEFAULT_LLM_CACHE_PATH)
+        self.ttl = ttl or float(os.getenv("LLM_CACHE_TTL", 86400))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10_000))
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache(last_used)")
+        self._conn.commit()
+
+    def get(self, kind: str, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses[kind] = self.misses.get(kind, 0) + 1
+                cache_lookup(f"llm_{kind}", hit=False)
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+        cache_lookup(f"llm_{kind}", hit=True)
+        return json.loads(row[0])
+
+    def set(self, kind: str, key: str, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, kind, value, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._writes += 1
+            # Trimming is a table scan, so only do it every few hundred writes.
+            if self._writes % 256 == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            return {"entries": entries, "hits": dict(self.hits), "misses": dict(self.misses)}
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Process wide cache, or None when disabled with `LLM_CACHE=0`."""
+    global _llm_cache
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMCache()
+        return _llm_cache
@@ -0,0 +1,37 @@
+from .metrics import timed
+
+
+def iter_completion_text(response):
+    """
+    Yield text from a `stream=True` chat completion.
+
+    Providers that ignore `stream=True` hand back a complete response; its
+    content is yielded as a single chunk so callers do not need to care.
+    """
+    choices = getattr(response, "choices", None)
+    if choices is not None:
+        content = choices[0].message.content
+        if content:
+            yield content
+        return
+
+    for chunk in response:
+        if not getattr(chunk, "choices", None):
+            continue
+        delta = chunk.choices[0].delta
+        text = getattr(delta, "content", None)
+        if text:
+            yield text
+
+
+def create_completion_stream(client, model: str, messages: list):
+    """Start a streaming completion through an aisuite client and yield its text chunks."""
+    with timed("llm_stream", model):
+        response = client.chat.completions.create(messages=messages, model=model, stream=True)
+        try:
+            yield from iter_completion_text(response)
+        finally:
+            # Stops the download when the consumer gave up early.
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
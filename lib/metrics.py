@@ -0,0 +1,223 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from .tracing import current_trace
+
+# Seconds; spans an embedding lookup (ms) up to a slow LLM call (a minute).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A gauge whose samples are read from `collect()` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        if self.collect is not None:
+            for labels, value in self.collect():
+                self.set(value, **labels)
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def _render_value(self, key, value):
+        lines = [
+            f"{self.name}_bucket{_labels(self.label_names, key, [('le', bound)])} {count}"
+            for bound, count in zip(self.buckets, value["counts"])
+        ]
+        lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', '+Inf')])} {value['count']}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {value['sum']}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {value['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _pool_depths():
+    from lib.executor import _pools, _pools_lock
+
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [({"pool": pool.name}, pool.depth) for pool in pools]
+
+
+def _pool_abandoned():
+    from lib.executor import _pools, _pools_lock
+
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [({"pool": pool.name}, pool.abandoned) for pool in pools]
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "llmmiddleware_stage_seconds", "Time spent per pipeline stage.", ["stage", "model"]))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "llmmiddleware_stage_errors_total", "Pipeline stages that raised.", ["stage", "model"]))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llmmiddleware_llm_tokens_total", "Tokens reported by the LLM provider.", ["model", "kind"]))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "llmmiddleware_cache_requests_total", "Cache lookups by cache and result (hit/miss).", ["cache", "result"]))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "llmmiddleware_http_request_seconds", "HTTP request latency until the response starts.", ["path", "status"]))
+EMBED_BATCH_SIZE = REGISTRY.register(Histogram(
+    "llmmiddleware_embedding_batch_size", "Texts per embedding batch.", ["model", "kind"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+EMBED_BATCH_WAIT = REGISTRY.register(Histogram(
+    "llmmiddleware_embedding_batch_wait_seconds", "Time an encode request waited for its batch to start.", ["model", "kind"],
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)))
+POOL_DEPTH = REGISTRY.register(Gauge(
+    "llmmiddleware_pool_depth", "Jobs running or queued per worker pool.", ["pool"], collect=_pool_depths))
+POOL_ABANDONED = REGISTRY.register(Counter(
+    "llmmiddleware_pool_abandoned_total", "Pool jobs still running when their caller was cancelled (timeout, disconnect).", ["pool"]))
+POOL_ABANDONED_RUNNING = REGISTRY.register(Gauge(
+    "llmmiddleware_pool_abandoned_running", "Abandoned pool jobs still holding a slot.", ["pool"], collect=_pool_abandoned))
+
+
+@contextmanager
+def timed(stage: str, model: str = ""):
+    """
+    Record the duration of a block under `stage`, and count it as an error if
+    it raises. The block is also added as a span to the current request trace.
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        STAGE_ERRORS.inc(stage=stage, model=model)
+        raise
+    finally:
+        end = time.perf_counter()
+        STAGE_SECONDS.observe(end - start, stage=stage, model=model)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_span(f"{stage} [{model}]" if model else stage, start, end, error)
+
+
+def record_usage(model: str, response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value is None and isinstance(usage, dict):
+            value = usage.get(kind)
+        if value:
+            LLM_TOKENS.inc(value, model=model, kind=kind.split("_")[0])
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def install(app):
+    """Add the HTTP latency middleware and a `GET /metrics` endpoint to a FastAPI app."""
+    from fastapi import Request
+    from fastapi.responses import Response
+
+    @app.middleware("http")
+    async def record_http_latency(request: Request, call_next):
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            route = request.scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - start, path=path, status=status)
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,228 @@
+import asyncio
+import os
+
+import orjson
+
+from lib.executor import run_in_pool, stream_in_pool
+from lib.dataframe_transport import dataframe_to_field
+from lib.sql_paging import estimate_count, result_page_token
+from lib.sql_guard import QueryTimeout, QueryRejected
+from lib.chart_downsample import downsample_for_chart, chart_figure
+from lib.metrics import timed
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Same cap the Streamlit frontend applied before posting the DataFrame back for
+# plotting, summary and followups.
+CHART_ROWS = 200
+
+# Rows sent with the `table` event; the rest are fetched page by page on demand.
+PAGE_ROWS = 100
+
+# Stages that only need the query result; they run concurrently.
+POST_QUERY_STAGES = ("chart", "answer", "summary", "followups")
+STAGE_TIMEOUT = 60.0
+
+
+def stage_settings(stages=None, timeouts=None):
+    """
+    Enabled post-query stages and their timeouts in seconds.
+
+    Defaults come from `PIPELINE_STAGES` (comma separated) and
+    `PIPELINE_TIMEOUT_<STAGE>`; a request may narrow them with its own
+    `stages` list and `timeouts` dict. Raises ValueError when those are
+    malformed, so an endpoint can reject them before it starts streaming.
+    """
+    if stages is None:
+        stages = os.getenv("PIPELINE_STAGES", ",".join(POST_QUERY_STAGES)).split(",")
+    if not isinstance(stages, (list, tuple)) or not all(isinstance(stage, str) for stage in stages):
+        raise ValueError("stages must be a list of stage names")
+    if timeouts is not None and not isinstance(timeouts, dict):
+        raise ValueError("timeouts must be an object mapping stage names to seconds")
+    enabled = [stage.strip() for stage in stages if stage.strip() in POST_QUERY_STAGES]
+    timeouts = timeouts or {}
+    limits = {}
+    for stage in enabled:
+        value = timeouts.get(stage, os.getenv(f"PIPELINE_TIMEOUT_{stage.upper()}", STAGE_TIMEOUT))
+        try:
+            limits[stage] = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"timeout of stage '{stage}' must be a number of seconds, not {value!r}")
+    return enabled, limits
+
+
+def sse_event(event: str, data) -> bytes:
+    return b"event: " + event.encode("utf-8") + b"\ndata: " + orjson.dumps(data, option=ORJSON_OPTIONS) + b"\n\n"
+
+
+async def ask_pipeline(vn, state, question: str, messages: list = None, chart_rows: int = CHART_ROWS, df_format: str = "json", results=None, page_rows: int = PAGE_ROWS,
+                       stages=None, timeouts=None):
+    """
+    Run the whole question -> SQL -> table -> chart -> summary -> followups chain
+    server side, yielding `(event, data)` as each stage completes. The answer
+    and summary are also streamed token by token as `*_token` events.
+
+    `messages` is the chat history; when given, an `answer` stage is produced
+    as well (and it is the only stage after `sql` when the SQL is not valid).
+    `df_format` selects how the `table` stage carries the DataFrame
+    (see `lib.dataframe_transport`). When a `results` store is given the full
+    result is kept there and its `result_id` is sent with the table, which then
+    only carries the first `page_rows` rows plus a `page_token` for the rest.
+
+    Once the table is sent, the chart, answer, summary and followups stages
+    run concurrently and their events are interleaved as they arrive; see
+    `stage_settings` for `stages` and `timeouts`.
+    """
+    model = getattr(vn, "_model", "")
+    enabled, limits = stage_settings(stages, timeouts)
+    try:
+        with timed("generate_sql", model):
+            sql = await run_in_pool('llm', vn.generate_sql, question=question, allow_llm_to_see_data=True)
+    except Exception as e:
+        yield "error", {"stage": "sql", "message": str(e)}
+        yield "done", {}
+        return
+    state.sql = sql
+    is_valid = bool(sql) and vn.is_sql_valid(sql=sql)
+    yield "sql", {"sql": sql, "valid": is_valid}
+
+    if not is_valid:
+        if messages and "answer" in enabled:
+            async for item in _run_concurrently({"answer": _answer_stage(vn, messages)}, limits):
+                yield item
+        yield "done", {}
+        return
+
+    try:
+        df = await run_in_pool('sql', vn.run_sql, sql=sql)
+    except QueryTimeout as e:
+        yield "error", {"stage": "table", "reason": "timeout", "message": f"{e}. Please ask a narrower question."}
+        yield "done", {}
+        return
+    except QueryRejected as e:
+        yield "error", {"stage": "table", "reason": "rejected", "message": str(e)}
+        yield "done", {}
+        return
+    except Exception as e:
+        yield "error", {"stage": "table", "message": f"Could not create table with the following sql \n```sql\n{sql}\n```"}
+        yield "done", {}
+        return
+    result_id = None
+    page = df
+    page_token = None
+    if results is not None:
+        result_id = await run_in_pool('cpu', results.put, df)
+        state.result_id = result_id
+        if len(df) > page_rows:
+            page = df.head(page_rows)
+            page_token = result_page_token(result_id, page_rows)
+    truncated = bool(df.attrs.get("truncated"))
+    total_rows = len(df)
+    if truncated and getattr(vn, "sql_db", None):
+        total_rows = await run_in_pool('sql', estimate_count, vn.sql_db, sql)
+    table = await run_in_pool('cpu', dataframe_to_field, page, df_format)
+    yield "table", {"df": table, "rows": len(df), "result_id": result_id, "page_token": page_token, "truncated": truncated, "total_rows": total_rows,
+                    "warnings": df.attrs.get("warnings", [])}
+    if messages:
+        messages = messages + [{"role": "assistant", "content": "### Query Table"}]
+
+    # The chart sees the whole result, reduced to a bounded number of points;
+    # summary and followups only need the first rows.
+    chart_df = await run_in_pool('cpu', downsample_for_chart, df) if "chart" in enabled else None
+    result_df = df
+    df = df.head(chart_rows)
+    candidates = {
+        "chart": lambda: _chart_stage(vn, state, question, sql, chart_df, result_df, model),
+        "answer": lambda: _answer_stage(vn, messages) if messages else None,
+        "summary": lambda: _summary_stage(vn, question, df, model),
+        "followups": lambda: _followups_stage(vn, question, sql, df, model),
+    }
+    tasks = {}
+    for stage in enabled:
+        generator = candidates[stage]()
+        if generator is not None:
+            tasks[stage] = generator
+    async for item in _run_concurrently(tasks, limits):
+        yield item
+
+    yield "done", {}
+
+
+_STAGE_DONE = object()
+
+
+async def _run_concurrently(stages: dict, timeouts: dict):
+    """
+    Drive several stage generators at once and yield their events as they
+    arrive. A stage that raises or runs past its timeout yields an `error`
+    event instead; the others are not affected.
+
+    On timeout, streamed stages (answer, summary) stop and close the
+    provider stream at the next chunk. A blocking LLM call (chart code,
+    followups) cannot be interrupted: its `llm` pool slot stays taken until
+    the provider returns, and is counted by
+    `llmmiddleware_pool_abandoned_total` / `_running`.
+    """
+    queue = asyncio.Queue()
+
+    async def consume(generator):
+        async for item in generator:
+            await queue.put(item)
+
+    async def drive(stage, generator):
+        try:
+            await asyncio.wait_for(consume(generator), timeouts.get(stage, STAGE_TIMEOUT))
+        except asyncio.TimeoutError:
+            await queue.put(("error", {"stage": stage, "reason": "timeout", "message": f"{stage} took longer than {timeouts.get(stage, STAGE_TIMEOUT):g}s"}))
+        except Exception as e:
+            await queue.put(("error", {"stage": stage, "message": str(e)}))
+        finally:
+            await generator.aclose()
+            await queue.put(_STAGE_DONE)
+
+    tasks = [asyncio.create_task(drive(stage, generator)) for stage, generator in stages.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await queue.get()
+            if item is _STAGE_DONE:
+                remaining -= 1
+                continue
+            yield item
+    finally:
+        # The client went away; stop whatever is still running.
+        for task in tasks:
+            task.cancel()
+
+
+async def _chart_stage(vn, state, question, sql, chart_df, result_df, model):
+    with timed("generate_plotly_code", model):
+        code = await run_in_pool('llm', vn.generate_plotly_code, question=question, sql=sql, df=chart_df)
+    state.plotly_code = code
+    yield "plotly_code", {"code": code}
+    # The code is run on the whole result, downsampled in a way that suits it.
+    fig = await run_in_pool('cpu', chart_figure, vn, code, result_df)
+    yield "figure", {"figure": fig.to_json() if fig is not None else None}
+
+
+async def _summary_stage(vn, question, df, model):
+    parts = []
+    with timed("summary", model):
+        async for text in stream_in_pool('llm', vn.generate_summary_stream, question=question, df=df):
+            parts.append(text)
+            yield "summary_token", {"text": text}
+    yield "summary", {"summary": "".join(parts) or None}
+
+
+async def _followups_stage(vn, question, sql, df, model):
+    with timed("followups", model):
+        followups = await run_in_pool('llm', vn.generate_followup_questions, question=question, sql=sql, df=df)
+    yield "followups", {"questions": followups}
+
+
+async def _answer_stage(vn, messages):
+    parts = []
+    async for text in stream_in_pool('llm', vn.submit_prompt_stream, messages):
+        parts.append(text)
+        yield "answer_token", {"text": text}
+    yield "answer", {"answer": "".join(parts)}
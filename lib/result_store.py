@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class ResultNotFound(Exception):
+    pass
+
+
+def dataframe_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultStore:
+    """
+    Bounded store of query results so follow-on endpoints can pass a `result_id`
+    instead of re-uploading the DataFrame.
+
+    Args:
+        - max_bytes: in-memory budget; least recently used results are evicted past it.
+        - spill_dir: when set, evicted results are written there as Parquet and reloaded on demand.
+        - ttl: seconds a result (in memory or spilled) stays available.
+    """
+    def __init__(self, max_bytes=None, spill_dir=None, ttl=None):
+        self.max_bytes = max_bytes or int(float(os.getenv("RESULT_STORE_MAX_MB", 256)) * 1024 * 1024)
+        self.spill_dir = spill_dir if spill_dir is not None else os.getenv("RESULT_SPILL_DIR", "")
+        self.ttl = ttl or float(os.getenv("RESULT_TTL", 3600))
+        self._results = OrderedDict()
+        self._spilled = {}
+        # Evicted results whose Parquet file is being written outside the lock.
+        self._spilling = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, df: pd.DataFrame) -> str:
+        """Store `df` and return its id. Blocking when results spill to disk: call it from a worker pool."""
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            evicted = self._insert(result_id, df, time.time())
+        self._spill(evicted)
+        return result_id
+
+    def get(self, result_id: str) -> pd.DataFrame:
+        with self._lock:
+            entry = self._results.get(result_id)
+            if entry is not None:
+                df, size, created = entry
+                if time.time() - created <= self.ttl:
+                    self._results.move_to_end(result_id)
+                    return df
+                self._drop(result_id)
+            spilling = self._spilling.pop(result_id, None)
+            if spilling is not None:
+                # Still being written: take it back from memory, the file is removed once written.
+                df, created = spilling
+                evicted = self._insert(result_id, df, created)
+                spilled = None
+            else:
+                evicted = []
+                spilled = self._spilled.pop(result_id, None)
+        if spilling is not None:
+            self._spill(evicted)
+            return df
+
+        if spilled is None:
+            raise ResultNotFound(f"Result '{result_id}' has expired, please run the query again")
+        path, created = spilled
+        try:
+            if time.time() - created > self.ttl:
+                raise ResultNotFound(f"Result '{result_id}' has expired, please run the query again")
+            df = pd.read_parquet(path)
+        finally:
+            self._remove_file(path)
+        with self._lock:
+            evicted = self._insert(result_id, df, created)
+        self._spill(evicted)
+        return df
+
+    def _insert(self, result_id, df, created) -> list:
+        # Under the lock. Returns the evicted results for `_spill`, which writes them without it.
+        size = dataframe_bytes(df)
+        self._results[result_id] = (df, size, created)
+        self._bytes += size
+        self._expire()
+        evicted = []
+        while self._bytes > self.max_bytes and len(self._results) > 1:
+            oldest = next(iter(self._results))
+            old_df, old_created = self._drop(oldest)
+            if self.spill_dir:
+                self._spilling[oldest] = (old_df, old_created)
+                evicted.append(oldest)
+        return evicted
+
+    def _drop(self, result_id):
+        df, size, created = self._results.pop(result_id)
+        self._bytes -= size
+        return df, created
+
+    def _spill(self, result_ids):
+        for result_id in result_ids:
+            with self._lock:
+                entry = self._spilling.get(result_id)
+            if entry is None:
+                continue
+            df, created = entry
+            path = os.path.join(self.spill_dir, f"{result_id}.parquet")
+            try:
+                df.to_parquet(path, index=False)
+            except Exception as e:
+                print(f"Could not spill result {result_id}: {e}")
+                with self._lock:
+                    self._spilling.pop(result_id, None)
+                self._remove_file(path)
+                continue
+            with self._lock:
+                written = self._spilling.pop(result_id, None) is not None
+                if written:
+                    self._spilled[result_id] = (path, created)
+            if not written:
+                # Read back by `get` while it was being written.
+                self._remove_file(path)
+
+    def _expire(self):
+        now = time.time()
+        for result_id in [r for r, (_, _, created) in self._results.items() if now - created > self.ttl]:
+            self._drop(result_id)
+        for result_id in [r for r, (_, created) in self._spilled.items() if now - created > self.ttl]:
+            path, _ = self._spilled.pop(result_id)
+            self._remove_file(path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"results": len(self._results), "bytes": self._bytes, "spilled": len(self._spilled) + len(self._spilling)}
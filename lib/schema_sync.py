@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import weakref
+
+from .sqlite_pool import connect_readonly
+
+# Training is keyed on the DDL text itself, so a restart or a second session on
+# the same database only compares hashes against what is already in `vannaddl`
+# and embeds nothing unless the schema actually changed.
+
+_sync_locks = weakref.WeakKeyDictionary()
+_sync_locks_guard = threading.Lock()
+
+
+def ddl_hash(ddl: str) -> str:
+    normalized = " ".join(ddl.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def schema_fingerprint(ddls) -> str:
+    digest = hashlib.sha256()
+    for h in sorted(ddl_hash(ddl) for ddl in ddls):
+        digest.update(h.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def read_schema_version(vn) -> int:
+    # PRAGMA schema_version is bumped by sqlite on every schema change.
+    return int(vn.run_sql("PRAGMA schema_version").iloc[0, 0])
+
+
+def read_ddls(vn) -> list:
+    df_ddl = vn.run_sql("SELECT type, sql FROM sqlite_master WHERE sql is not null")
+    return df_ddl['sql'].to_list()
+
+
+def _lock_for(vn) -> threading.Lock:
+    with _sync_locks_guard:
+        if vn not in _sync_locks:
+            _sync_locks[vn] = threading.Lock()
+        return _sync_locks[vn]
+
+
+def schema_status(vn) -> dict:
+    """Cheap check: one PRAGMA, no hashing and no vector store round trip."""
+    schema_version = read_schema_version(vn)
+    return {
+        "fingerprint": getattr(vn, "_schema_fingerprint", None),
+        "schema_version": schema_version,
+        "up_to_date": getattr(vn, "_schema_version", None) == schema_version,
+    }
+
+
+def sync_schema(vn, force: bool = False) -> dict:
+    """
+    Bring the DDL training data of `vn` in line with its connected database.
+
+    Only statements whose hash is new are embedded and only statements that
+    disappeared from `sqlite_master` are removed. Question/SQL pairs and
+    documentation are left untouched.
+    """
+    with _lock_for(vn):
+        schema_version = read_schema_version(vn)
+        if not force and getattr(vn, "_schema_version", None) == schema_version:
+            return {"status": "unchanged", "fingerprint": vn._schema_fingerprint, "added": 0, "removed": 0}
+
+        ddls = read_ddls(vn)
+        fingerprint = schema_fingerprint(ddls)
+        wanted = {ddl_hash(ddl): ddl for ddl in ddls}
+
+        have = {}
+        to_remove = []
+        for _id, ddl in vn.get_trained_ddl().items():
+            h = ddl_hash(ddl)
+            if h in wanted and h not in have:
+                have[h] = _id
+            else:
+                to_remove.append(_id)
+        to_add = [ddl for h, ddl in wanted.items() if h not in have]
+
+        vn.remove_training_data_bulk(ids=to_remove)
+        vn.add_ddl_bulk(to_add)
+
+        vn._schema_version = schema_version
+        vn._schema_fingerprint = fingerprint
+        status = "unchanged" if not to_add and not to_remove else "updated"
+        print(f"schema sync {fingerprint}: {status}, +{len(to_add)} -{len(to_remove)}")
+        return {"status": status, "fingerprint": fingerprint, "added": len(to_add), "removed": len(to_remove)}
+
+
+def train_question_file(vn, path: str) -> dict:
+    """Bulk load question/SQL pairs from a questions.json file, skipping pairs already trained."""
+    with open(path, "r") as json_file:
+        qsql_list = json.load(json_file)
+
+    have = {(qs["question"], qs["sql"]) for qs in vn.get_trained_question_sql().values()}
+    to_add = []
+    for qsql in qsql_list:
+        pair = (qsql['question'], qsql['answer'])
+        if pair not in have:
+            have.add(pair)
+            to_add.append({"question": pair[0], "sql": pair[1]})
+    vn.add_question_sql_bulk(to_add)
+    print(f"question training from {path}: +{len(to_add)}")
+    return {"added": len(to_add), "total": len(qsql_list)}
+
+
+class SchemaWatcher(threading.Thread):
+    """
+    Polls `PRAGMA schema_version` of the sql_db and re-syncs DDL training
+    data when it changes. The file mtime is not enough: in WAL mode schema
+    changes land in `<db>-wal` and the main file only changes at checkpoint.
+    """
+    def __init__(self, vn, path: str, interval: float):
+        super().__init__(daemon=True, name=f"schema-watcher-{os.path.basename(path)}")
+        self._vn = weakref.ref(vn)
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._conn = None
+        self._last_version = self._schema_version()
+
+    def _schema_version(self):
+        try:
+            if self._conn is None:
+                self._conn = connect_readonly(self.path)
+            return self._conn.execute("PRAGMA schema_version").fetchone()[0]
+        except sqlite3.Error:
+            # Missing or replaced file: reconnect on the next tick.
+            self._close()
+            return None
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def run(self):
+        try:
+            while not self._stop_event.wait(self.interval):
+                version = self._schema_version()
+                if version is None or version == self._last_version:
+                    continue
+                vn = self._vn()
+                if vn is None:
+                    return
+                self._last_version = version
+                try:
+                    sync_schema(vn)
+                except Exception as e:
+                    print(f"schema watcher failed for {self.path}: {e}")
+                # Drop the strong reference so an evicted instance can be collected.
+                vn = None
+        finally:
+            self._close()
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,110 @@
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from .executor import cancel_event
+
+_SELECT = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_SCAN = re.compile(r"^SCAN (TABLE )?(\w+)", re.IGNORECASE)
+
+# The progress handler runs every this many SQLite VM instructions.
+PROGRESS_STEPS = 10_000
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def query_plan(conn, sql: str) -> list:
+    """`EXPLAIN QUERY PLAN` rows as `(id, parent, detail)`."""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql.strip().rstrip(';')}").fetchall()
+    return [(row[0], row[1], row[-1]) for row in rows]
+
+
+def cross_join_tables(plan: list) -> list:
+    """
+    Tables full scanned as siblings of the same join loop, i.e. a join with no
+    index to drive it. Scans in different arms of a UNION or in separate
+    subqueries have different parents and are not reported.
+    """
+    scans = {}
+    for _, parent, detail in plan:
+        match = _SCAN.match(detail)
+        if match and "CONSTANT ROW" not in detail.upper():
+            scans.setdefault(parent, []).append(match.group(2))
+    return [tables for tables in scans.values() if len(tables) > 1]
+
+
+def check_plan(conn, sql: str, policy: str = None) -> list:
+    """
+    Inspect the plan of a SELECT before running it.
+
+    `policy` (default `SQL_GUARD_CROSS_JOIN`) is "reject" to raise
+    QueryRejected on an unindexed cross join, "warn" to return warnings, or
+    "off". Statements SQLite cannot plan are left for execution to report.
+    """
+    policy = policy or os.getenv("SQL_GUARD_CROSS_JOIN", "warn")
+    if policy == "off" or not _SELECT.match(sql):
+        return []
+    try:
+        plan = query_plan(conn, sql)
+    except sqlite3.Error:
+        return []
+    warnings = [f"Unindexed cross join between {', '.join(tables)}" for tables in cross_join_tables(plan)]
+    if warnings and policy == "reject":
+        raise QueryRejected("; ".join(warnings) + ". Please rephrase the question or add a join condition.")
+    return warnings
+
+
+@contextmanager
+def query_budget(conn, timeout: float = None, max_steps: int = None, cancel=None):
+    """
+    Abort statements on `conn` that run past `timeout` seconds or `max_steps`
+    VM instructions, or once the `cancel` event is set. `cancel` defaults to
+    the pool job's cancel event, so a query stops as soon as the request or
+    stage waiting for it is cancelled. Aborted statements raise QueryTimeout.
+    """
+    if cancel is None:
+        cancel = cancel_event()
+    timeout = timeout if timeout is not None else float(os.getenv("SQL_TIMEOUT", 30))
+    max_steps = max_steps if max_steps is not None else int(os.getenv("SQL_MAX_STEPS", 0))
+    deadline = time.monotonic() + timeout if timeout > 0 else None
+    state = {"steps": 0, "reason": None}
+
+    def progress():
+        state["steps"] += PROGRESS_STEPS
+        if deadline is not None and time.monotonic() > deadline:
+            state["reason"] = f"exceeded the {timeout:g}s time limit"
+        elif max_steps and state["steps"] > max_steps:
+            state["reason"] = f"exceeded the {max_steps} step budget"
+        elif cancel is not None and cancel.is_set():
+            state["reason"] = "was cancelled"
+        return 1 if state["reason"] else 0
+
+    conn.set_progress_handler(progress, PROGRESS_STEPS)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if state["reason"] is not None:
+            raise QueryTimeout(f"Query {state['reason']}") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+def run_guarded(conn, sql: str, fn, **budget):
+    """Check the plan of `sql`, then call `fn(conn)` under a query budget."""
+    warnings = check_plan(conn, sql)
+    for warning in warnings:
+        print(f"SQL guard: {warning}")
+    with query_budget(conn, **budget):
+        df = fn(conn)
+    if warnings:
+        df.attrs["warnings"] = warnings
+    return df
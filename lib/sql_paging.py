@@ -0,0 +1,184 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from .sqlite_pool import connect_readonly, get_sqlite_pool
+from .sql_guard import check_plan, query_budget
+
+_SELECT = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+FETCH_CHUNK_ROWS = 1_000
+RESULT_TOKEN_PREFIX = "result:"
+
+
+def limit_sql(sql: str, limit: int) -> str:
+    """Wrap a SELECT so SQLite itself stops after `limit` rows; other statements are left alone."""
+    sql = sql.strip().rstrip(";")
+    if not _SELECT.match(sql):
+        return sql
+    return f"SELECT * FROM (\n{sql}\n) LIMIT {int(limit)}"
+
+
+def _row_bytes(rows) -> float:
+    if not rows:
+        return 0.0
+    return sum(sys.getsizeof(v) for row in rows for v in row) / len(rows)
+
+
+def execute_capped(conn, sql: str, max_rows: int, max_bytes: int, chunk_rows: int = FETCH_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Run `sql` and materialize at most `max_rows` rows / roughly `max_bytes`.
+
+    A LIMIT is injected so SQLite stops early; rows are pulled with `fetchmany`
+    and the byte cap is estimated from the first chunk. When the result was cut
+    short `df.attrs["truncated"]` is True.
+    """
+    cursor = conn.execute(limit_sql(sql, max_rows + 1))
+    try:
+        if cursor.description is None:
+            return pd.DataFrame()
+        columns = [d[0] for d in cursor.description]
+
+        rows = cursor.fetchmany(chunk_rows)
+        row_bytes = _row_bytes(rows)
+        cap = max_rows
+        if row_bytes > 0:
+            cap = min(cap, max(1, int(max_bytes // row_bytes)))
+        while len(rows) <= cap:
+            chunk = cursor.fetchmany(min(chunk_rows, cap + 1 - len(rows)))
+            if not chunk:
+                break
+            rows.extend(chunk)
+    finally:
+        cursor.close()
+
+    truncated = len(rows) > cap
+    df = pd.DataFrame.from_records(rows[:cap], columns=columns, coerce_float=True)
+    df.attrs["truncated"] = truncated
+    if truncated:
+        print(f"run_sql result truncated to {cap} rows")
+    return df
+
+
+def estimate_count(db_path: str, sql: str, max_steps: int = None):
+    """COUNT(*) of a query, or None if it would cost more than `max_steps` VM steps."""
+    max_steps = max_steps or int(os.getenv("SQL_COUNT_MAX_STEPS", 5_000_000))
+    conn = connect_readonly(db_path)
+    steps = {"n": 0}
+
+    def progress():
+        steps["n"] += 1
+        return 1 if steps["n"] * 1000 > max_steps else 0
+
+    conn.set_progress_handler(progress, 1000)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM (\n{sql.strip().rstrip(';')}\n)").fetchone()[0]
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+
+def result_page_token(result_id: str, offset: int) -> str:
+    return f"{RESULT_TOKEN_PREFIX}{result_id}:{offset}"
+
+
+def parse_result_page_token(token: str):
+    result_id, offset = token[len(RESULT_TOKEN_PREFIX):].rsplit(":", 1)
+    return result_id, int(offset)
+
+
+class PageNotFound(Exception):
+    pass
+
+
+class QueryPager:
+    """
+    Paging through a query, one `LIMIT ... OFFSET` statement per page.
+
+    Nothing stays open between pages: each page runs to completion on the
+    pool's read connection of the calling thread, so an idle page token
+    holds no cursor and no read transaction (which would block WAL
+    checkpoints). Statements that cannot be wrapped in a SELECT are
+    materialized once and sliced. Tokens expire after `ttl` idle seconds
+    and at most `max_open` are kept.
+    """
+    def __init__(self, ttl=None, max_open=None):
+        self.ttl = ttl or float(os.getenv("SQL_PAGE_TTL", 300))
+        self.max_open = max_open or int(os.getenv("SQL_PAGE_MAX_OPEN", 32))
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def open(self, db_path: str, sql: str, page_size: int):
+        sql = sql.strip().rstrip(";")
+        conn = get_sqlite_pool(db_path).reader()
+        check_plan(conn, sql)
+        entry = {"db_path": db_path, "sql": sql, "rows": None, "offset": 0, "last_used": time.time(), "lock": threading.Lock()}
+        if not _SELECT.match(sql):
+            with query_budget(conn):
+                cursor = conn.execute(sql)
+                try:
+                    entry["columns"] = [d[0] for d in cursor.description] if cursor.description else []
+                    entry["rows"] = cursor.fetchall() if cursor.description else []
+                finally:
+                    cursor.close()
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            while len(self._queries) >= self.max_open:
+                self._close(min(self._queries, key=lambda t: self._queries[t]["last_used"]))
+            self._queries[token] = entry
+        return self.fetch(token, page_size)
+
+    def fetch(self, token: str, page_size: int):
+        """Return `(df, next_token, offset)`; `next_token` is None once the query is exhausted."""
+        with self._lock:
+            entry = self._queries.get(token)
+            if entry is None:
+                raise PageNotFound(f"Page token '{token}' has expired, please run the query again")
+            entry["last_used"] = time.time()
+        # Pages of one token are read in order.
+        with entry["lock"]:
+            offset = entry["offset"]
+            try:
+                rows, columns = self._page(entry, offset, page_size + 1)
+            except Exception:
+                with self._lock:
+                    self._close(token)
+                raise
+            more = len(rows) > page_size
+            rows = rows[:page_size]
+            entry["offset"] += len(rows)
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        if not more:
+            with self._lock:
+                self._close(token)
+            return df, None, offset
+        return df, token, offset
+
+    @staticmethod
+    def _page(entry, offset: int, limit: int):
+        if entry["rows"] is not None:
+            return entry["rows"][offset:offset + limit], entry["columns"]
+        conn = get_sqlite_pool(entry["db_path"]).reader()
+        with query_budget(conn):
+            cursor = conn.execute(f"SELECT * FROM (\n{entry['sql']}\n) LIMIT ? OFFSET ?", (limit, offset))
+            try:
+                columns = [d[0] for d in cursor.description]
+                return cursor.fetchall(), columns
+            finally:
+                cursor.close()
+
+    def _close(self, token):
+        self._queries.pop(token, None)
+
+    def _expire(self):
+        now = time.time()
+        for token in [t for t, e in self._queries.items() if now - e["last_used"] > self.ttl]:
+            self._close(token)
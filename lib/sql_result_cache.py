@@ -0,0 +1,102 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from .metrics import cache_lookup
+
+# Only plain reads are cached, and not ones whose result changes without a write.
+_CACHEABLE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_NON_DETERMINISTIC = re.compile(r"\b(random|randomblob|changes|last_insert_rowid)\s*\(|'now'", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split()).rstrip(";").strip()
+
+
+class SQLResultCache:
+    """
+    Query results keyed on (database, normalized SQL), shared by every session on the same `sql_db`.
+
+    Each database gets one monitor connection; its `PRAGMA data_version` changes
+    whenever any other connection commits, which together with the file (and
+    WAL) mtime invalidates every cached result for that database.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or int(float(os.getenv("SQL_CACHE_MAX_MB", 64)) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._monitors = {}
+
+    def _version(self, db_path: str):
+        with self._lock:
+            monitor = self._monitors.get(db_path)
+            if monitor is None:
+                monitor = sqlite3.connect(db_path, check_same_thread=False)
+                self._monitors[db_path] = monitor
+            data_version = monitor.execute("PRAGMA data_version").fetchone()[0]
+        stamps = []
+        for path in (db_path, db_path + "-wal"):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamps.append(None)
+        return (data_version, tuple(stamps))
+
+    def run(self, db_path: str, sql: str, run_sql) -> pd.DataFrame:
+        if not _CACHEABLE.match(sql) or _NON_DETERMINISTIC.search(sql):
+            return run_sql(sql)
+
+        key = (db_path, normalize_sql(sql))
+        version = self._version(db_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                cache_lookup("sql", hit=True)
+                # Plotly code may mutate the frame it is handed.
+                return entry[1].copy()
+            self.misses += 1
+        cache_lookup("sql", hit=False)
+
+        df = run_sql(sql)
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return df
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (version, df.copy(), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+        return df
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+_sql_result_cache = None
+_sql_result_cache_lock = threading.Lock()
+
+
+def get_sql_result_cache():
+    """Process wide cache, or None when disabled with `SQL_CACHE=0`."""
+    global _sql_result_cache
+    if os.getenv("SQL_CACHE", "1") == "0":
+        return None
+    with _sql_result_cache_lock:
+        if _sql_result_cache is None:
+            _sql_result_cache = SQLResultCache()
+        return _sql_result_cache
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+def _read_pragmas():
+    return {
+        "mmap_size": int(float(os.getenv("SQLITE_MMAP_MB", 256)) * 1024 * 1024),
+        # Negative cache_size is in KiB.
+        "cache_size": -int(float(os.getenv("SQLITE_CACHE_MB", 64)) * 1024),
+        "temp_store": "MEMORY",
+    }
+
+
+def connect_readonly(path: str) -> sqlite3.Connection:
+    """A read-only connection tuned for analytic queries."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    for name, value in _read_pragmas().items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+class SQLitePool:
+    """
+    Connections to one SQLite database: one read-only connection per thread and a single writer.
+
+    Readers never share a connection, so run_sql calls from the `sql` worker
+    pool execute in parallel instead of serializing on one handle. The
+    database is switched to WAL once so readers are not blocked while the
+    writer (`with pool.writer() as conn:`) ingests data.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._readers = []
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._enable_wal()
+
+    def _enable_wal(self):
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+        except sqlite3.OperationalError as e:
+            # Read-only mounts keep whatever journal mode the file has.
+            print(f"Could not enable WAL on {self.path}: {e}")
+
+    def reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_readonly(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Serialized write access; commits on success and rolls back on error."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = sqlite3.connect(self.path, check_same_thread=False)
+                self._writer.execute("PRAGMA synchronous=NORMAL")
+                self._writer.execute("PRAGMA temp_store=MEMORY")
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        with self._lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self._local = threading.local()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"path": self.path, "readers": len(self._readers), "writer": self._writer is not None}
+
+
+_sqlite_pools = {}
+_sqlite_pools_lock = threading.Lock()
+
+
+def get_sqlite_pool(path: str) -> SQLitePool:
+    """Process wide pool for `path`, shared by every Vanna instance on the same database."""
+    with _sqlite_pools_lock:
+        if path not in _sqlite_pools:
+            _sqlite_pools[path] = SQLitePool(path)
+        return _sqlite_pools[path]
@@ -0,0 +1,288 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+TRACE_HEADER = "X-Trace-Id"
+PROFILE_HEADER = "X-Profile"
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    Span timings of the requests sharing one trace id (e.g. a question and
+    the page fetches that follow it), and optionally a sampled CPU profile of
+    every thread that worked on them (the event loop and pool workers).
+    """
+    def __init__(self, trace_id: str, name: str = "", profile: bool = False):
+        self.trace_id = trace_id
+        self.name = name
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.requests = 0
+        self.threads = Counter()
+        self.samples = Counter() if profile else None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def profiling(self) -> bool:
+        return self.samples is not None
+
+    def add_span(self, name: str, start: float, end: float, error: bool = False):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self._t0) * 1000, 3),
+                "duration_ms": round((end - start) * 1000, 3),
+                "thread": threading.current_thread().name,
+                "error": error,
+            })
+
+    def enter_thread(self):
+        with self._lock:
+            self.threads[threading.get_ident()] += 1
+
+    def exit_thread(self):
+        with self._lock:
+            ident = threading.get_ident()
+            self.threads[ident] -= 1
+            if self.threads[ident] <= 0:
+                del self.threads[ident]
+
+    def begin(self, profile: bool = False):
+        """Count one more request working on this trace."""
+        with self._lock:
+            self._active += 1
+            self.requests += 1
+            self.duration = None
+            if profile and self.samples is None:
+                self.samples = Counter()
+
+    def finish(self):
+        """One request is done; the trace is complete once none is left."""
+        with self._lock:
+            self._active = max(0, self._active - 1)
+            if self._active or self.duration is not None:
+                return
+            self.duration = time.perf_counter() - self._t0
+        _sampler.remove(self)
+
+    def close(self):
+        with self._lock:
+            self._active = 0
+            if self.duration is None:
+                self.duration = time.perf_counter() - self._t0
+        _sampler.remove(self)
+
+    def folded(self) -> str:
+        """The profile in folded stack format (`frame;frame;frame count`), for flamegraph tools."""
+        with self._lock:
+            samples = list(self.samples.items()) if self.samples else []
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(samples))
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "requests": self.requests,
+            "spans": spans,
+            "profiled": self.profiling,
+        }
+
+
+def current_trace():
+    return _current.get()
+
+
+def run_traced(fn, *args, **kwargs):
+    """Run `fn` on a worker thread, counting that thread as part of the current trace while it runs."""
+    trace = _current.get()
+    if trace is None:
+        return fn(*args, **kwargs)
+    trace.enter_thread()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        trace.exit_thread()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class _Sampler:
+    """One daemon thread sampling the stacks of threads that belong to profiled traces."""
+    def __init__(self):
+        self.interval = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+        self._traces = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces.add(trace)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, trace: Trace):
+        with self._lock:
+            self._traces.discard(trace)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                traces = list(self._traces)
+                if not traces:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for trace in traces:
+                with trace._lock:
+                    idents = list(trace.threads)
+                for ident in idents:
+                    frame = frames.get(ident)
+                    if frame is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(_frame_name(frame))
+                        frame = frame.f_back
+                    with trace._lock:
+                        trace.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+
+_sampler = _Sampler()
+
+
+class TraceStore:
+    """The most recent traces, kept in memory for `GET /api/v2/traces/{trace_id}`."""
+    def __init__(self, max_traces=None):
+        self.max_traces = max_traces or int(os.getenv("TRACE_BUFFER", 200))
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace):
+        with self._lock:
+            self._traces[trace.trace_id] = trace
+            self._traces.move_to_end(trace.trace_id)
+            self._evict()
+
+    def open(self, trace_id: str, name: str = "", profile: bool = False) -> Trace:
+        """The trace for `trace_id`, created unless a request already started it."""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                trace = self._traces[trace_id] = Trace(trace_id, name=name, profile=profile)
+            self._traces.move_to_end(trace_id)
+            self._evict()
+        return trace
+
+    def _evict(self):
+        while len(self._traces) > self.max_traces:
+            _, evicted = self._traces.popitem(last=False)
+            evicted.close()
+
+    def get(self, trace_id: str):
+        with self._lock:
+            return self._traces.get(trace_id)
+
+
+traces = TraceStore()
+
+
+def profiling_allowed(value) -> bool:
+    """`X-Profile` must be "1", or match `PROFILE_TOKEN` when one is configured."""
+    if not value:
+        return False
+    token = os.getenv("PROFILE_TOKEN")
+    return value == token if token else value == "1"
+
+
+def start_trace(trace_id: str = None, name: str = "", profile: bool = False) -> Trace:
+    """
+    Make the trace `trace_id` current for this request. A request reusing the
+    id of an earlier one adds its spans (and samples) to the same trace
+    instead of replacing it.
+    """
+    trace = traces.open(trace_id or uuid.uuid4().hex, name=name, profile=profile)
+    trace.begin(profile)
+    _current.set(trace)
+    if profile:
+        trace.enter_thread()
+        _sampler.add(trace)
+    return trace
+
+
+def install(app):
+    """Trace every request of a FastAPI app and serve the recorded traces and profiles."""
+    from fastapi import Request
+    from fastapi.responses import JSONResponse, PlainTextResponse
+
+    @app.middleware("http")
+    async def trace_request(request: Request, call_next):
+        name = f"{request.method} {request.url.path}"
+        start = time.perf_counter()
+        profile = profiling_allowed(request.headers.get(PROFILE_HEADER))
+        trace = start_trace(request.headers.get(TRACE_HEADER), name=name, profile=profile)
+
+        def finish(error=False):
+            # Each request is a span of its own, around the stages it timed.
+            trace.add_span(name, start, time.perf_counter(), error)
+            if profile:
+                # Runs on the event loop thread start_trace registered; stop sampling it
+                # for this trace, or later requests reusing the id would be sampled too.
+                trace.exit_thread()
+            trace.finish()
+
+        try:
+            response = await call_next(request)
+        except BaseException:
+            finish(error=True)
+            raise
+        response.headers[TRACE_HEADER] = trace.trace_id
+        body = getattr(response, "body_iterator", None)
+        if body is None:
+            finish(response.status_code >= 500)
+            return response
+
+        # Streaming responses keep working after the headers are sent.
+        async def finish_with_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                finish(response.status_code >= 500)
+
+        response.body_iterator = finish_with_body()
+        return response
+
+    @app.get("/api/v2/traces/{trace_id}")
+    async def get_trace(trace_id: str):
+        trace = traces.get(trace_id)
+        if trace is None:
+            return JSONResponse(status_code=404, content={'statusCode': 404, "response": f"Trace '{trace_id}' not found"})
+        return {'statusCode': 200, "response": trace.to_dict()}
+
+    @app.get("/api/v2/traces/{trace_id}/profile")
+    async def get_profile(trace_id: str):
+        trace = traces.get(trace_id)
+        if trace is None or not trace.profiling:
+            return JSONResponse(status_code=404, content={'statusCode': 404, "response": f"No profile for trace '{trace_id}'"})
+        return PlainTextResponse(
+            trace.folded(),
+            headers={"Content-Disposition": f'attachment; filename="profile-{trace_id}.folded"'},
+        )
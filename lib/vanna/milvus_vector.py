@@ -2,12 +2,19 @@ import uuid
 from typing import List
 
 import pandas as pd
-from pymilvus import DataType, MilvusClient, model
-from pymilvus import connections, utility
+from pymilvus import DataType, MilvusClient
+from pymilvus import connections
 import os
 
 from vanna.base import VannaBase
 
+from ..metrics import timed
+from ..executor import get_pool
+from ..embedding_cache import get_embedding_cache, cached_encode
+from ..embedding_models import DEFAULT_EMBEDDING_MODEL, embedding_dim, embedding_model_name, embedding_model
+from ..vector_snapshot import export_collection, import_collection, read_header
+from ..vector_index import index_config
+
 # Setting the URI as a local file, e.g.`./milvus.db`,
 # is the most convenient method, as it automatically utilizes Milvus Lite
 # to store all data in this file.
@@ -21,7 +28,13 @@ DEFAULT_MILVUS_URI = "milvus.db"
 # DEFAULT_MILVUS_URI = "http://localhost:19530"
 
 MAX_LIMIT_SIZE = 10_000
+INSERT_BATCH_SIZE = 1_000
 
+TRAINING_COLLECTIONS = {
+    "-sql": "vannasql",
+    "-ddl": "vannaddl",
+    "-doc": "vannadoc",
+}
 
 class Milvus_VectorStore(VannaBase):
     """
@@ -55,13 +68,30 @@ class Milvus_VectorStore(VannaBase):
         self.related_training_data = {}
 
         if "embedding_function" in config:
-            self.embedding_function = config.get("embedding_function")
+            self._embedding_function = config.get("embedding_function")
+            embedding_name = embedding_model_name(self._embedding_function)
+            self._embedding_dim = embedding_dim(embedding_name, self._embedding_function)
         else:
-            self.embedding_function = model.DefaultEmbeddingFunction()
-        self._embedding_dim = self.embedding_function.encode_documents(["foo"])[0].shape[0]
+            # One default model per process, shared by every instance. It loads in the
+            # background while the collections are set up; its dimension comes from
+            # the registry instead of a probe encode.
+            self._embedding_function = None
+            embedding_name = DEFAULT_EMBEDDING_MODEL
+            self._embedding_loader = embedding_model(embedding_name).start()
+            self._embedding_dim = embedding_dim(embedding_name)
+        self._embedding_name = embedding_name
+        # Queries and documents may be embedded differently, so they are cached apart.
+        self._query_cache = get_embedding_cache(f"{embedding_name}:query", self._embedding_dim)
+        self._document_cache = get_embedding_cache(f"{embedding_name}:document", self._embedding_dim)
         self._create_collections()
         self.n_results = config.get("n_results", 10)
 
+    @property
+    def embedding_function(self):
+        if self._embedding_function is None:
+            self._embedding_function = self._embedding_loader.get()
+        return self._embedding_function
+
     def _create_collections(self):
         self._create_sql_collection("vannasql")
         self._create_ddl_collection("vannaddl")
@@ -73,9 +103,7 @@ class Milvus_VectorStore(VannaBase):
 
 
     def _create_sql_collection(self, name: str):
-        # if not self.milvus_client.has_collection(collection_name=name):
-        # print(utility.has_collection(collection_name=name))
-        if not utility.has_collection(collection_name=name):
+        if not self.milvus_client.has_collection(collection_name=name):
             vannasql_schema = MilvusClient.create_schema(
                 auto_id=False,
                 enable_dynamic_field=False,
@@ -85,18 +113,20 @@ class Milvus_VectorStore(VannaBase):
             vannasql_schema.add_field(field_name="sql", datatype=DataType.VARCHAR, max_length=65535)
             vannasql_schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=self._embedding_dim)
 
+            index = index_config(name)
             vannasql_index_params = self.milvus_client.prepare_index_params()
             vannasql_index_params.add_index(
                 field_name="vector",
                 index_name="vector",
-                index_type="AUTOINDEX",
-                metric_type="L2",
+                index_type=index.index_type,
+                metric_type=index.metric_type,
+                params=index.build_params,
             )
             self.milvus_client.create_collection(
                 collection_name=name,
                 schema=vannasql_schema,
                 index_params=vannasql_index_params,
-                consistency_level="Strong"
+                consistency_level=index.consistency_level
             )
 
     def _create_ddl_collection(self, name: str):
@@ -109,18 +139,20 @@ class Milvus_VectorStore(VannaBase):
             vannaddl_schema.add_field(field_name="ddl", datatype=DataType.VARCHAR, max_length=65535)
             vannaddl_schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=self._embedding_dim)
 
+            index = index_config(name)
             vannaddl_index_params = self.milvus_client.prepare_index_params()
             vannaddl_index_params.add_index(
                 field_name="vector",
                 index_name="vector",
-                index_type="AUTOINDEX",
-                metric_type="L2",
+                index_type=index.index_type,
+                metric_type=index.metric_type,
+                params=index.build_params,
             )
             self.milvus_client.create_collection(
                 collection_name=name,
                 schema=vannaddl_schema,
                 index_params=vannaddl_index_params,
-                consistency_level="Strong"
+                consistency_level=index.consistency_level
             )
 
     def _create_doc_collection(self, name: str):
@@ -133,25 +165,27 @@ class Milvus_VectorStore(VannaBase):
             vannadoc_schema.add_field(field_name="doc", datatype=DataType.VARCHAR, max_length=65535)
             vannadoc_schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=self._embedding_dim)
 
+            index = index_config(name)
             vannadoc_index_params = self.milvus_client.prepare_index_params()
             vannadoc_index_params.add_index(
                 field_name="vector",
                 index_name="vector",
-                index_type="AUTOINDEX",
-                metric_type="L2",
+                index_type=index.index_type,
+                metric_type=index.metric_type,
+                params=index.build_params,
             )
             self.milvus_client.create_collection(
                 collection_name=name,
                 schema=vannadoc_schema,
                 index_params=vannadoc_index_params,
-                consistency_level="Strong"
+                consistency_level=index.consistency_level
             )
 
     def add_question_sql(self, question: str, sql: str, **kwargs) -> str:
         if len(question) == 0 or len(sql) == 0:
             raise Exception("pair of question and sql can not be null")
         _id = str(uuid.uuid4()) + "-sql"
-        embedding = self.embedding_function.encode_documents([question])[0]
+        embedding = self.embed_documents([question])[0]
         self.milvus_client.insert(
             collection_name="vannasql",
             data={
@@ -167,7 +201,7 @@ class Milvus_VectorStore(VannaBase):
         if len(ddl) == 0:
             raise Exception("ddl can not be null")
         _id = str(uuid.uuid4()) + "-ddl"
-        embedding = self.embedding_function.encode_documents([ddl])[0]
+        embedding = self.embed_documents([ddl])[0]
         self.milvus_client.insert(
             collection_name="vannaddl",
             data={
@@ -182,7 +216,7 @@ class Milvus_VectorStore(VannaBase):
         if len(documentation) == 0:
             raise Exception("documentation can not be null")
         _id = str(uuid.uuid4()) + "-doc"
-        embedding = self.embedding_function.encode_documents([documentation])[0]
+        embedding = self.embed_documents([documentation])[0]
         self.milvus_client.insert(
             collection_name="vannadoc",
             data={
@@ -193,6 +227,53 @@ class Milvus_VectorStore(VannaBase):
         )
         return _id
 
+    def _insert_chunked(self, collection_name: str, rows: list):
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            self.milvus_client.insert(
+                collection_name=collection_name,
+                data=rows[start:start + INSERT_BATCH_SIZE],
+            )
+
+    def add_question_sql_bulk(self, question_sql_list: list, **kwargs) -> List[str]:
+        """Embed all questions in one batch. Items are `{"question": ..., "sql": ...}` dicts."""
+        question_sql_list = [qs for qs in question_sql_list if len(qs["question"]) > 0 and len(qs["sql"]) > 0]
+        if len(question_sql_list) == 0:
+            return []
+        embeddings = self.embed_documents([qs["question"] for qs in question_sql_list])
+        ids = [str(uuid.uuid4()) + "-sql" for _ in question_sql_list]
+        rows = [
+            {"id": _id, "text": qs["question"], "sql": qs["sql"], "vector": embedding}
+            for _id, qs, embedding in zip(ids, question_sql_list, embeddings)
+        ]
+        self._insert_chunked("vannasql", rows)
+        return ids
+
+    def add_ddl_bulk(self, ddl_list: List[str], **kwargs) -> List[str]:
+        ddl_list = [ddl for ddl in ddl_list if len(ddl) > 0]
+        if len(ddl_list) == 0:
+            return []
+        embeddings = self.embed_documents(ddl_list)
+        ids = [str(uuid.uuid4()) + "-ddl" for _ in ddl_list]
+        rows = [
+            {"id": _id, "ddl": ddl, "vector": embedding}
+            for _id, ddl, embedding in zip(ids, ddl_list, embeddings)
+        ]
+        self._insert_chunked("vannaddl", rows)
+        return ids
+
+    def add_documentation_bulk(self, documentation_list: List[str], **kwargs) -> List[str]:
+        documentation_list = [doc for doc in documentation_list if len(doc) > 0]
+        if len(documentation_list) == 0:
+            return []
+        embeddings = self.embed_documents(documentation_list)
+        ids = [str(uuid.uuid4()) + "-doc" for _ in documentation_list]
+        rows = [
+            {"id": _id, "doc": doc, "vector": embedding}
+            for _id, doc, embedding in zip(ids, documentation_list, embeddings)
+        ]
+        self._insert_chunked("vannadoc", rows)
+        return ids
+
     def get_training_data(self, **kwargs) -> pd.DataFrame:
         sql_data = self.milvus_client.query(
             collection_name="vannasql",
@@ -240,20 +321,95 @@ class Milvus_VectorStore(VannaBase):
         df = pd.concat([df, df_doc])
         return df
 
-    def get_similar_question_sql(self, question: str, **kwargs) -> list:
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 128},
-        }
-        embeddings = self.embedding_function.encode_queries([question])
-        res = self.milvus_client.search(
+    def get_trained_ddl(self, **kwargs) -> dict:
+        ddl_data = self.milvus_client.query(
+            collection_name="vannaddl",
+            output_fields=["id", "ddl"],
+            limit=MAX_LIMIT_SIZE,
+        )
+        return {doc["id"]: doc["ddl"] for doc in ddl_data}
+
+    def get_trained_question_sql(self, **kwargs) -> dict:
+        sql_data = self.milvus_client.query(
             collection_name="vannasql",
-            anns_field="vector",
-            data=embeddings,
-            limit=self.n_results,
-            output_fields=["text", "sql"],
-            search_params=search_params
+            output_fields=["id", "text", "sql"],
+            limit=MAX_LIMIT_SIZE,
         )
+        return {doc["id"]: {"question": doc["text"], "sql": doc["sql"]} for doc in sql_data}
+
+    def export_snapshot(self, directory: str) -> dict:
+        """Write the three training collections to `<directory>/<collection>.npz`."""
+        return {
+            name: export_collection(self.milvus_client, name, os.path.join(directory, f"{name}.npz"), self._embedding_name)["count"]
+            for name in TRAINING_COLLECTIONS.values()
+        }
+
+    def restore_snapshot(self, directory: str, replace: bool = False) -> dict:
+        """
+        Load the training collections from a snapshot written by
+        `export_snapshot`, without calling the encoder. Unless `replace` is
+        set, nothing is restored when the collections already hold data.
+        """
+        paths = {name: os.path.join(directory, f"{name}.npz") for name in TRAINING_COLLECTIONS.values()}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return {"status": "missing"}
+        for path in paths.values():
+            header = read_header(path)
+            if header["model"] != self._embedding_name or header["dim"] != self._embedding_dim:
+                return {"status": "mismatch", "model": header["model"], "dim": header["dim"]}
+        if replace:
+            for name in paths:
+                self.milvus_client.drop_collection(collection_name=name)
+            self._create_collections()
+        elif any(self.milvus_client.query(collection_name=name, filter="", output_fields=["id"], limit=1) for name in paths):
+            return {"status": "skipped"}
+        counts = {
+            name: import_collection(self.milvus_client, name, path, model=self._embedding_name, dim=self._embedding_dim)
+            for name, path in paths.items()
+        }
+        return {"status": "restored", **counts}
+
+    def embed_question(self, question: str) -> list:
+        with timed("embed_query"):
+            # Cache hits do not wait for the model to finish loading.
+            return cached_encode(self._query_cache, [question], lambda texts: self.embedding_function.encode_queries(texts))
+
+    def embed_documents(self, documents: List[str]) -> list:
+        return cached_encode(self._document_cache, documents, lambda texts: self.embedding_function.encode_documents(texts))
+
+    def retrieve_context(self, question: str, **kwargs) -> dict:
+        """
+        Everything `generate_sql` retrieves for a question: the question is
+        embedded once and the three collections are searched concurrently.
+        """
+        embeddings = self.embed_question(question)
+        searches = {
+            "question_sql_list": self.get_similar_question_sql,
+            "ddl_list": self.get_related_ddl,
+            "doc_list": self.get_related_documentation,
+        }
+        # Shared by every instance; raises PoolSaturated rather than queueing without bound.
+        pool = get_pool("search")
+        futures = {
+            name: pool.submit(search, question, embeddings=embeddings, **kwargs)
+            for name, search in searches.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+    def get_similar_question_sql(self, question: str, embeddings=None, **kwargs) -> list:
+        index = index_config("vannasql")
+        if embeddings is None:
+            embeddings = self.embed_question(question)
+        with timed("milvus_search_vannasql"):
+            res = self.milvus_client.search(
+                collection_name="vannasql",
+                anns_field="vector",
+                data=embeddings,
+                limit=self.n_results,
+                output_fields=["text", "sql"],
+                search_params=index.search_param(),
+                consistency_level=index.consistency_level
+            )
         res = res[0]
 
         list_sql = []
@@ -264,20 +420,20 @@ class Milvus_VectorStore(VannaBase):
             list_sql.append(dict)
         return list_sql
 
-    def get_related_ddl(self, question: str, **kwargs) -> list:
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 128},
-        }
-        embeddings = self.embedding_function.encode_queries([question])
-        res = self.milvus_client.search(
-            collection_name="vannaddl",
-            anns_field="vector",
-            data=embeddings,
-            limit=self.n_results,
-            output_fields=["ddl"],
-            search_params=search_params
-        )
+    def get_related_ddl(self, question: str, embeddings=None, **kwargs) -> list:
+        index = index_config("vannaddl")
+        if embeddings is None:
+            embeddings = self.embed_question(question)
+        with timed("milvus_search_vannaddl"):
+            res = self.milvus_client.search(
+                collection_name="vannaddl",
+                anns_field="vector",
+                data=embeddings,
+                limit=self.n_results,
+                output_fields=["ddl"],
+                search_params=index.search_param(),
+                consistency_level=index.consistency_level
+            )
         res = res[0]
 
         list_ddl = []
@@ -285,20 +441,20 @@ class Milvus_VectorStore(VannaBase):
             list_ddl.append(doc["entity"]["ddl"])
         return list_ddl
 
-    def get_related_documentation(self, question: str, **kwargs) -> list:
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 128},
-        }
-        embeddings = self.embedding_function.encode_queries([question])
-        res = self.milvus_client.search(
-            collection_name="vannadoc",
-            anns_field="vector",
-            data=embeddings,
-            limit=self.n_results,
-            output_fields=["doc"],
-            search_params=search_params
-        )
+    def get_related_documentation(self, question: str, embeddings=None, **kwargs) -> list:
+        index = index_config("vannadoc")
+        if embeddings is None:
+            embeddings = self.embed_question(question)
+        with timed("milvus_search_vannadoc"):
+            res = self.milvus_client.search(
+                collection_name="vannadoc",
+                anns_field="vector",
+                data=embeddings,
+                limit=self.n_results,
+                output_fields=["doc"],
+                search_params=index.search_param(),
+                consistency_level=index.consistency_level
+            )
         res = res[0]
 
         list_doc = []
@@ -317,4 +473,30 @@ class Milvus_VectorStore(VannaBase):
             self.milvus_client.delete(collection_name="vannadoc", ids=[id])
             return True
         else:
-            return False
\ No newline at end of file
+            return False
+
+    def remove_training_data_bulk(self, ids: List[str] = None, filter: str = None, collection_name: str = None, **kwargs) -> int:
+        """
+        Delete many training rows at once.
+
+        Ids are grouped by their `-sql`/`-ddl`/`-doc` suffix into one delete per
+        collection. A filter expression (e.g. `id like "%-ddl"`) is applied to
+        `collection_name`, or to all three collections when it is not given.
+        """
+        removed = 0
+        if ids:
+            grouped = {}
+            for _id in ids:
+                name = TRAINING_COLLECTIONS.get(_id[-4:])
+                if name is not None:
+                    grouped.setdefault(name, []).append(_id)
+            for name, group in grouped.items():
+                self.milvus_client.delete(collection_name=name, ids=group)
+                removed += len(group)
+        if filter:
+            names = [collection_name] if collection_name else list(TRAINING_COLLECTIONS.values())
+            for name in names:
+                res = self.milvus_client.delete(collection_name=name, filter=filter)
+                if isinstance(res, dict):
+                    removed += res.get("delete_count", 0)
+        return removed
@@ -17,6 +17,13 @@ def pprint(data, width=80):
     pp(data, width=width)
 
 from .milvus_vector import Milvus_VectorStore
+from ..llm_cache import get_llm_cache, make_key, normalize_messages, normalize_question
+from ..sql_result_cache import get_sql_result_cache
+from ..sql_paging import execute_capped
+from ..sqlite_pool import get_sqlite_pool
+from ..sql_guard import run_guarded
+from ..metrics import timed, record_usage
+from ..llm_stream import create_completion_stream
 
 def sanitize_model_name(model_name):
     try:
@@ -46,6 +53,11 @@ def sanitize_model_name(model_name):
     except Exception as e:
         raise ValidationError(e)
 
+def _cacheable(content, validate=None) -> bool:
+    if not isinstance(content, str) or not content.strip():
+        return False
+    return validate is None or bool(validate(content))
+
 class aisuite_Chat(Milvus_VectorStore):
     def __init__(self, client=None, config={'milvus_client':'data_storage/vanna-democompany-vector.db','model':'groq:llama-3.2-3b-preview'}):
         VannaBase.__init__(self, config=config)
@@ -58,6 +70,7 @@ class aisuite_Chat(Milvus_VectorStore):
         else:
             self._model = config['model']
         self._api_key = os.getenv('GROQ_API_KEY')
+        self.llm_cache = get_llm_cache()
 
         if client is not None:
             self.client = client
@@ -67,6 +80,36 @@ class aisuite_Chat(Milvus_VectorStore):
             self.client = ai.Client()
             return
 
+    def connect_to_sqlite(self, url: str, **kwargs):
+        self.sql_db = url
+        # Each worker thread reads through its own connection from the shared pool.
+        self.sql_pool = get_sqlite_pool(url)
+
+        # Generated SQL is not trusted to be bounded, so results are capped
+        # instead of materializing a whole table into pandas.
+        max_rows = int(os.getenv("SQL_MAX_ROWS", 100_000))
+        max_bytes = int(float(os.getenv("SQL_MAX_MB", 128)) * 1024 * 1024)
+
+        def run_sql_sqlite(sql: str):
+            # Runaway queries are interrupted instead of pinning a worker.
+            with timed("run_sql"):
+                return run_guarded(self.sql_pool.reader(), sql, lambda conn: execute_capped(conn, sql, max_rows, max_bytes))
+
+        self.dialect = "SQLite"
+        self.run_sql_is_set = True
+        self.run_sql = run_sql_sqlite
+
+        # Results are shared with every other instance on the same database
+        # and dropped as soon as the database changes.
+        sql_cache = get_sql_result_cache()
+        if sql_cache is not None:
+            run_sql_uncached = self.run_sql
+
+            def run_sql_sqlite_cached(sql: str):
+                return sql_cache.run(url, sql, run_sql_uncached)
+
+            self.run_sql = run_sql_sqlite_cached
+
     def system_message(self, message: str) -> any:
         return {"role": "system", "content": message}
 
@@ -76,25 +119,167 @@ class aisuite_Chat(Milvus_VectorStore):
     def assistant_message(self, message: str) -> any:
         return {"role": "assistant", "content": message}
     
-    def submit_prompt(self, prompt, **kwargs) -> str:
+    def _prompt_key(self, prompt) -> str:
+        # The prompt already embeds the retrieved context, so identical prompts
+        # to the same model can be answered from the cache.
+        return make_key("prompt", self._model, normalize_messages(prompt))
+
+    def submit_prompt(self, prompt, use_cache=True, validate=None, **kwargs) -> str:
+        """
+        Completion text for `prompt`, served from the LLM cache when the same
+        model saw the same (whitespace normalized) messages. A response is
+        stored only when it is non-empty and `validate(response)`, if given,
+        accepts it.
+        """
         if prompt is None:
             raise Exception("Prompt is None")
 
         if len(prompt) == 0:
             raise Exception("Prompt is empty")
+
+        cache = self.llm_cache if use_cache else None
+        if cache is not None:
+            key = self._prompt_key(prompt)
+            cached = cache.get("prompt", key)
+            if cached is not None:
+                return cached
         
         # Count the number of tokens in the message log
         # Use 4 as an approximation for the number of characters per token
         # num_tokens = 0
         # for message in prompt:
         #     num_tokens += len(message["content"]) / 4
-        response = self.client.chat.completions.create(
-            messages=prompt,
-            # model='groq:llama-3.2-3b-preview',
-            model=self._model
+        with timed("llm", self._model):
+            response = self.client.chat.completions.create(
+                messages=prompt,
+                # model='groq:llama-3.2-3b-preview',
+                model=self._model
+            )
+        record_usage(self._model, response)
+
+        content = response.choices[0].message.content
+        if cache is not None and _cacheable(content, validate):
+            cache.set("prompt", key, content)
+        return content
+
+    def submit_prompt_stream(self, prompt, use_cache=True, validate=None, **kwargs):
+        """
+        Like `submit_prompt`, but yields the completion text as the provider
+        streams it. A cached response is yielded in one piece; a streamed one
+        is stored only once the stream has run to its end.
+        """
+        if prompt is None:
+            raise Exception("Prompt is None")
+
+        if len(prompt) == 0:
+            raise Exception("Prompt is empty")
+
+        cache = self.llm_cache if use_cache else None
+        if cache is not None:
+            key = self._prompt_key(prompt)
+            cached = cache.get("prompt", key)
+            if cached is not None:
+                yield cached
+                return
+
+        chunks = []
+        for chunk in create_completion_stream(self.client, self._model, prompt):
+            chunks.append(chunk)
+            yield chunk
+        content = "".join(chunks)
+        if cache is not None and _cacheable(content, validate):
+            cache.set("prompt", key, content)
+
+    def generate_summary_stream(self, question: str, df: pd.DataFrame, **kwargs):
+        """Streaming counterpart of `VannaBase.generate_summary`, built from the same prompt."""
+        response_language = self._response_language() if hasattr(self, "_response_language") else ""
+        message_log = [
+            self.system_message(
+                f"You are a helpful data assistant. The user asked the question: '{question}'\n\nThe following is a pandas DataFrame with the results of the query: \n{df.to_markdown()}\n\n"
+            ),
+            self.user_message(
+                "Briefly summarize the data based on the question that was asked. Do not respond with any additional explanation beyond the summary." +
+                response_language
+            ),
+        ]
+        yield from self.submit_prompt_stream(message_log, **kwargs)
+
+    def generate_sql(self, question: str, allow_llm_to_see_data=False, **kwargs) -> str:
+        """
+        VannaBase.generate_sql with a response cache in front of the LLM.
+
+        The cache key combines the normalized question, the model, the schema
+        fingerprint recorded by `lib.schema_sync` and a hash of the retrieved
+        training context, which is retrieved with one embedding of the question
+        and three concurrent searches. Answers that needed intermediate SQL
+        depend on the data and are not cached, and neither is a response that
+        does not hold a valid query. The prompt itself also goes through the
+        `submit_prompt` cache, which applies the same check.
+        """
+        initial_prompt = self.config.get("initial_prompt", None) if self.config is not None else None
+        context = self.retrieve_context(question, **kwargs)
+        question_sql_list = context["question_sql_list"]
+        ddl_list = context["ddl_list"]
+        doc_list = context["doc_list"]
+
+        cache = self.llm_cache
+        if cache is not None:
+            key = make_key(
+                "sql",
+                self._model,
+                normalize_question(question),
+                getattr(self, "_schema_fingerprint", None),
+                make_key(question_sql_list, ddl_list, doc_list),
+                allow_llm_to_see_data,
+            )
+            cached = cache.get("sql", key)
+            if cached is not None:
+                return cached
+
+        prompt = self.get_sql_prompt(
+            initial_prompt=initial_prompt,
+            question=question,
+            question_sql_list=question_sql_list,
+            ddl_list=ddl_list,
+            doc_list=doc_list,
+            **kwargs,
         )
+        self.log(title="SQL Prompt", message=prompt)
+        llm_response = self.submit_prompt(prompt, validate=self._is_sql_response, **kwargs)
+        self.log(title="LLM Response", message=llm_response)
+
+        if 'intermediate_sql' in llm_response:
+            if not allow_llm_to_see_data:
+                return "The LLM is not allowed to see the data in your database. Your question requires database introspection to generate the necessary SQL. Please set allow_llm_to_see_data=True to enable this."
+
+            intermediate_sql = self.extract_sql(llm_response)
+            try:
+                self.log(title="Running Intermediate SQL", message=intermediate_sql)
+                df = self.run_sql(intermediate_sql)
+                prompt = self.get_sql_prompt(
+                    initial_prompt=initial_prompt,
+                    question=question,
+                    question_sql_list=question_sql_list,
+                    ddl_list=ddl_list,
+                    doc_list=doc_list + [f"The following is a pandas DataFrame with the results of the intermediate SQL query {intermediate_sql}: \n" + df.to_markdown()],
+                    **kwargs,
+                )
+                self.log(title="Final SQL Prompt", message=prompt)
+                # The prompt holds query results, which change with the data.
+                llm_response = self.submit_prompt(prompt, use_cache=False, **kwargs)
+                self.log(title="LLM Response", message=llm_response)
+            except Exception as e:
+                return f"Error running intermediate SQL: {e}"
+            return self.extract_sql(llm_response)
+
+        sql = self.extract_sql(llm_response)
+        if cache is not None and sql and self.is_sql_valid(sql):
+            cache.set("sql", key, sql)
+        return sql
 
-        return response.choices[0].message.content
+    def _is_sql_response(self, response: str) -> bool:
+        # A request for intermediate SQL is as reusable as the final query.
+        return 'intermediate_sql' in response or bool(self.is_sql_valid(self.extract_sql(response)))
 
 # def test_vn_milvus():
 #     existing_training_data = vn_milvus.get_training_data()
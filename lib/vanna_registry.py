@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+# Only these keys decide which warm instance a session can share.
+FINGERPRINT_KEYS = ("model", "milvus_client", "sql_db")
+
+
+def config_fingerprint(config: dict) -> str:
+    key = {k: config.get(k) for k in FINGERPRINT_KEYS}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def current_rss_mb() -> float:
+    # Linux only; other platforms report 0 and the memory cap is skipped.
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class SessionNotFound(Exception):
+    pass
+
+
+class SessionConflict(Exception):
+    """A session id was re-opened with a config other than the one it was set up with."""
+
+
+@dataclass
+class _Entry:
+    instance: object
+    created: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    # Requests holding the instance; an evicted instance is released when this drops to 0.
+    refs: int = 0
+    evicted: bool = False
+
+
+class VannaRegistry:
+    """
+    LRU/TTL cache of Vanna instances keyed by config fingerprint.
+
+    Args:
+        - factory: callable building an instance from a config dict.
+        - on_evict: optional callable releasing an instance's resources when it is evicted.
+        - max_instances: number of warm instances kept at once.
+        - ttl: seconds an idle instance stays warm.
+        - max_memory_mb: evict the least recently used instance after a build that leaves the process RSS above this. 0 disables.
+
+    Instances taken with `acquire` must be handed back with `release`. An
+    instance evicted while held leaves the cache at once but is only passed
+    to `on_evict` once the last holder releases it. `on_evict` always runs
+    outside the registry lock, as closing a client may wait on the network.
+    """
+    def __init__(self, factory, on_evict=None, max_instances=None, ttl=None, max_memory_mb=None):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.max_instances = max_instances or int(os.getenv("VANNA_MAX_INSTANCES", 4))
+        self.ttl = ttl or float(os.getenv("VANNA_INSTANCE_TTL", 3600))
+        self.max_memory_mb = max_memory_mb if max_memory_mb is not None else float(os.getenv("VANNA_MAX_MEMORY_MB", 0))
+        self._entries = OrderedDict()
+        self._held = {}
+        self._lock = threading.Lock()
+        self._build_locks = {}
+
+    def get(self, fingerprint: str, acquire: bool = False):
+        released = []
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None and time.time() - entry.last_used > self.ttl and entry.refs == 0:
+                released = self._evict(fingerprint)
+                entry = None
+            if entry is not None:
+                entry.last_used = time.time()
+                self._entries.move_to_end(fingerprint)
+                if acquire:
+                    entry.refs += 1
+                    self._held[id(entry.instance)] = entry
+        self._release_all(released)
+        return entry.instance if entry is not None else None
+
+    def acquire(self, fingerprint: str):
+        """The warm instance for `fingerprint`, held until `release`, or None when there is none."""
+        return self.get(fingerprint, acquire=True)
+
+    def release(self, instance):
+        with self._lock:
+            entry = self._held.get(id(instance))
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs > 0:
+                return
+            del self._held[id(instance)]
+            if not entry.evicted:
+                return
+        self._release(entry)
+
+    def get_or_create(self, config: dict):
+        fingerprint = config_fingerprint(config)
+        instance = self.get(fingerprint)
+        if instance is not None:
+            return instance
+
+        # One build per fingerprint; concurrent callers wait for it instead of building twice.
+        # Build locks outlive evictions so that an evicted fingerprint still has a single one.
+        with self._lock:
+            build_lock = self._build_locks.setdefault(fingerprint, threading.Lock())
+        with build_lock:
+            instance = self.get(fingerprint)
+            if instance is None:
+                instance = self.factory(config)
+                with self._lock:
+                    self._entries[fingerprint] = _Entry(instance)
+                    released = self._enforce_limits()
+                self._release_all(released)
+        return instance
+
+    def _evict(self, fingerprint: str) -> list:
+        """Drop `fingerprint` from the cache; returns the entries to pass to `_release` once unlocked."""
+        entry = self._entries.pop(fingerprint, None)
+        if entry is None:
+            return []
+        entry.evicted = True
+        print(f"Evicted vanna instance {fingerprint}")
+        return [entry] if entry.refs == 0 else []
+
+    def _release_all(self, entries: list):
+        for entry in entries:
+            self._release(entry)
+
+    def _release(self, entry: _Entry):
+        if self.on_evict is not None:
+            try:
+                self.on_evict(entry.instance)
+            except Exception as e:
+                print(f"Failed to release vanna instance: {e}")
+
+    def _enforce_limits(self) -> list:
+        released = []
+        now = time.time()
+        for fingerprint in [fp for fp, e in self._entries.items() if now - e.last_used > self.ttl]:
+            released += self._evict(fingerprint)
+        while len(self._entries) > self.max_instances:
+            released += self._evict(next(iter(self._entries)))
+        # RSS does not drop right after an eviction (and held instances stay
+        # alive), so a build over the cap evicts one instance, not all of them.
+        if self.max_memory_mb > 0 and len(self._entries) > 1 and current_rss_mb() > self.max_memory_mb:
+            released += self._evict(next(iter(self._entries)))
+        return released
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "instances": list(self._entries.keys()),
+                "held": {fp: e.refs for fp, e in self._entries.items() if e.refs},
+                "evicted_held": sum(1 for e in self._held.values() if e.evicted),
+                "max_instances": self.max_instances,
+                "rss_mb": round(current_rss_mb(), 1),
+            }
+
+
+@dataclass
+class SessionState:
+    config: dict
+    fingerprint: str
+    sql: str = None
+    plotly_code: str = None
+    result_id: str = None
+    last_seen: float = field(default_factory=time.time)
+
+
+class SessionStore:
+    """Per browser session request state, held server side."""
+    def __init__(self, ttl=None):
+        self.ttl = ttl or float(os.getenv("SESSION_TTL", 3600))
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def open(self, config: dict, session_id: str = None) -> str:
+        """
+        Set up a session and return its id. Ids are generated here; passing the
+        id of a live session set up with the same config keeps that session
+        (and its state) instead, and one set up with another config raises
+        `SessionConflict`.
+        """
+        fingerprint = config_fingerprint(config)
+        with self._lock:
+            self._expire()
+            state = self._sessions.get(session_id) if session_id else None
+            if state is not None:
+                if state.fingerprint != fingerprint:
+                    raise SessionConflict(f"Session '{session_id}' was set up with another config")
+                state.config = config
+                state.last_seen = time.time()
+                return session_id
+            session_id = str(uuid.uuid4())
+            self._sessions[session_id] = SessionState(config=config, fingerprint=fingerprint)
+        return session_id
+
+    def get(self, session_id: str) -> SessionState:
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None or time.time() - state.last_seen > self.ttl:
+                self._sessions.pop(session_id, None)
+                raise SessionNotFound(f"Session '{session_id}' is not set up, call /api/v2/setup_vanna first")
+            state.last_seen = time.time()
+            return state
+
+    def _expire(self):
+        now = time.time()
+        for session_id in [s for s, st in self._sessions.items() if now - st.last_seen > self.ttl]:
+            del self._sessions[session_id]
@@ -0,0 +1,150 @@
+import copy
+import os
+import threading
+from dataclasses import dataclass, field
+
+# Read from `VECTOR_INDEX_CONFIG` (YAML). Without the file, collections keep
+# the settings they were hard-coded with.
+DEFAULT_CONFIG_PATH = "config/VectorIndexConfig.yaml"
+
+# Build and search parameters each index type understands; anything else in
+# the config is dropped with a warning instead of being sent to Milvus.
+INDEX_PARAMS = {
+    "AUTOINDEX": ((), ("level",)),
+    "FLAT": ((), ()),
+    "HNSW": (("M", "efConstruction"), ("ef",)),
+    "IVF_FLAT": (("nlist",), ("nprobe",)),
+    "IVF_SQ8": (("nlist",), ("nprobe",)),
+    "IVF_PQ": (("nlist", "m", "nbits"), ("nprobe",)),
+}
+
+BUILTIN_CONFIG = {
+    "defaults": {"index_type": "AUTOINDEX", "metric_type": "L2", "consistency_level": "Strong"},
+    "collections": {
+        "knowledge_base": {
+            "index_type": "HNSW",
+            "build_params": {"M": 16, "efConstruction": 200},
+            "search_params": {"ef": 64},
+            "consistency_level": "Bounded",
+        },
+    },
+}
+
+
+@dataclass
+class IndexConfig:
+    index_type: str = "AUTOINDEX"
+    metric_type: str = "L2"
+    build_params: dict = field(default_factory=dict)
+    search_params: dict = field(default_factory=dict)
+    consistency_level: str = "Strong"
+
+    def __post_init__(self):
+        self.index_type = self.index_type.upper()
+        known = INDEX_PARAMS.get(self.index_type)
+        if known is None:
+            raise ValueError(f"Unsupported index_type '{self.index_type}', expected one of {sorted(INDEX_PARAMS)}")
+        self.build_params = _known_params(self.build_params, known[0], f"{self.index_type} build")
+        self.search_params = _known_params(self.search_params, known[1], f"{self.index_type} search")
+
+    def index_params(self) -> dict:
+        """`create_index` parameters (ORM style)."""
+        return {"index_type": self.index_type, "metric_type": self.metric_type, "params": dict(self.build_params)}
+
+    def search_param(self) -> dict:
+        """`search` parameters."""
+        return {"metric_type": self.metric_type, "params": dict(self.search_params)}
+
+
+def _known_params(params: dict, names: tuple, what: str) -> dict:
+    params = dict(params or {})
+    unknown = [name for name in params if name not in names]
+    for name in unknown:
+        print(f"Ignoring {what} parameter '{name}'")
+        del params[name]
+    return params
+
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+def load_index_configs(path: str = None) -> dict:
+    """The parsed config file (cached until its mtime changes), or the built-in settings when there is none."""
+    return _load(path)[0]
+
+
+def _load(path: str = None) -> tuple:
+    path = path or os.getenv("VECTOR_INDEX_CONFIG", DEFAULT_CONFIG_PATH)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        path, mtime = None, None
+    with _configs_lock:
+        cached = _configs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1:]
+    if path is None:
+        config = BUILTIN_CONFIG
+    else:
+        import yaml
+
+        with open(path, "r") as f:
+            config = yaml.safe_load(f) or {}
+    with _configs_lock:
+        # (mtime, config, IndexConfig per collection)
+        _configs[path] = (mtime, config, {})
+        return _configs[path][1:]
+
+
+def index_config(collection_name: str, path: str = None) -> IndexConfig:
+    """Settings for `collection_name`: its entry under `collections` on top of `defaults`."""
+    config, resolved = _load(path)
+    if collection_name in resolved:
+        return resolved[collection_name]
+    merged = copy.deepcopy(config.get("defaults") or {})
+    for key, value in ((config.get("collections") or {}).get(collection_name) or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    resolved[collection_name] = IndexConfig(**merged)
+    return resolved[collection_name]
+
+
+def rebuild_index(collection_name: str, config: IndexConfig = None, field_name: str = None):
+    """
+    Replace the vector index of an existing collection with `config` (default:
+    the configured one). The collection is released while the index builds.
+    """
+    from pymilvus import Collection, DataType
+
+    config = config or index_config(collection_name)
+    collection = Collection(collection_name)
+    if field_name is None:
+        field_name = next(f.name for f in collection.schema.fields if f.dtype == DataType.FLOAT_VECTOR)
+    collection.release()
+    for index in collection.indexes:
+        if index.field_name == field_name:
+            collection.drop_index(index_name=index.index_name)
+    collection.create_index(field_name=field_name, index_params=config.index_params(), index_name=field_name)
+    collection.load()
+    print(f"rebuilt '{collection_name}' index: {config.index_params()}")
+
+
+def main():
+    import argparse
+
+    from pymilvus import connections
+
+    parser = argparse.ArgumentParser(description="Rebuild vector indexes with the configured settings.")
+    parser.add_argument("uri", help="Milvus URI or Milvus Lite file")
+    parser.add_argument("collections", nargs="+")
+    args = parser.parse_args()
+    connections.connect(uri=args.uri)
+    for name in args.collections:
+        rebuild_index(name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# A snapshot is one .npz file per collection: a JSON header (collection,
+# embedding model, dimension, row count, fields), the vectors as a float32
+# matrix, and every scalar field as its own column. Strings are stored as one
+# UTF-8 buffer plus offsets, so loading needs no pickle and no encoder.
+
+SNAPSHOT_VERSION = 1
+EXPORT_BATCH_SIZE = 1_000
+INSERT_BATCH_SIZE = 1_000
+
+
+class SnapshotMismatch(Exception):
+    """The snapshot does not fit the collection (other model, dimension or fields)."""
+
+
+def _pack_strings(values: list):
+    encoded = [str(value).encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(data: np.ndarray, offsets: np.ndarray) -> list:
+    buffer = data.tobytes()
+    return [buffer[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def _fields(client, collection_name: str):
+    """(vector field, scalar fields) of a collection, as `describe_collection` dicts."""
+    from pymilvus import DataType
+
+    vector = None
+    scalars = []
+    for field in client.describe_collection(collection_name)["fields"]:
+        if field["type"] == DataType.FLOAT_VECTOR:
+            vector = field
+        else:
+            scalars.append(field)
+    return vector, scalars
+
+
+def read_header(path: str) -> dict:
+    with np.load(path) as snapshot:
+        return json.loads(snapshot["header"].tobytes().decode("utf-8"))
+
+
+def export_collection(client, collection_name: str, path: str, model: str, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """
+    Write every row of `collection_name` to `path`, reading through `client`
+    (a `pymilvus.MilvusClient`, so the store exported is the one that client
+    is connected to). Returns the snapshot header.
+    """
+    from pymilvus import DataType
+
+    client.load_collection(collection_name)
+    vector_field, scalar_fields = _fields(client, collection_name)
+    dim = int(vector_field["params"]["dim"])
+
+    columns = {field["name"]: [] for field in scalar_fields}
+    vectors = []
+    iterator = client.query_iterator(
+        collection_name, batch_size=batch_size, filter="",
+        output_fields=[f["name"] for f in scalar_fields] + [vector_field["name"]],
+    )
+    try:
+        while True:
+            rows = iterator.next()
+            if not rows:
+                break
+            for row in rows:
+                for name, values in columns.items():
+                    values.append(row[name])
+                vectors.append(row[vector_field["name"]])
+    finally:
+        iterator.close()
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "collection": collection_name,
+        "model": model,
+        "dim": dim,
+        "count": len(vectors),
+        "vector_field": vector_field["name"],
+        "fields": [{"name": f["name"], "type": f["type"].name} for f in scalar_fields],
+        "created": time.time(),
+    }
+    arrays = {
+        "header": np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8),
+        "vectors": np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim),
+    }
+    for field in scalar_fields:
+        if field["type"] == DataType.VARCHAR:
+            arrays[f"{field['name']}__bytes"], arrays[f"{field['name']}__offsets"] = _pack_strings(columns[field["name"]])
+        else:
+            arrays[field["name"]] = np.asarray(columns[field["name"]])
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+    print(f"snapshot of '{collection_name}': {len(vectors)} rows -> {path}")
+    return header
+
+
+def import_collection(client, collection_name: str, path: str, model: str = None, dim: int = None, batch_size: int = INSERT_BATCH_SIZE) -> int:
+    """
+    Bulk insert a snapshot into `collection_name` through `client` without
+    embedding anything, with one flush at the end. Raises `SnapshotMismatch`
+    when the snapshot was made with another model or dimension. Returns the
+    number of rows inserted.
+    """
+    with np.load(path) as snapshot:
+        header = json.loads(snapshot["header"].tobytes().decode("utf-8"))
+        if model is not None and header["model"] != model:
+            raise SnapshotMismatch(f"{path} was made with '{header['model']}', not '{model}'")
+        if dim is not None and header["dim"] != dim:
+            raise SnapshotMismatch(f"{path} has {header['dim']} dimensional vectors, not {dim}")
+
+        vector_field, scalar_fields = _fields(client, collection_name)
+        columns = {vector_field["name"]: snapshot["vectors"]}
+        for field in scalar_fields:
+            name = field["name"]
+            if field.get("is_primary") and field.get("auto_id"):
+                continue
+            if f"{name}__bytes" in snapshot.files:
+                columns[name] = _unpack_strings(snapshot[f"{name}__bytes"], snapshot[f"{name}__offsets"])
+            elif name in snapshot.files:
+                columns[name] = snapshot[name].tolist()
+            else:
+                raise SnapshotMismatch(f"{path} has no '{name}' column for '{collection_name}'")
+
+    count = header["count"]
+    for start in range(0, count, batch_size):
+        rows = [dict(zip(columns, values)) for values in zip(*(column[start:start + batch_size] for column in columns.values()))]
+        client.insert(collection_name, data=rows)
+    client.flush(collection_name)
+    print(f"restored '{collection_name}': {count} rows from {path}")
+    return count
@@ -2,6 +2,12 @@ from pymilvus import (
     connections, FieldSchema, CollectionSchema, DataType, Collection, MilvusClient, utility
 )
 import os
+try:
+    from .vector_snapshot import export_collection, import_collection
+    from .vector_index import index_config
+except ImportError:
+    from vector_snapshot import export_collection, import_collection
+    from vector_index import index_config
 
 class VectorDB():
     def __init__(self, database_path:str, embeding_size:int=384, max_length:int=1000):
@@ -16,10 +22,14 @@ class VectorDB():
         token = os.getenv("MILVUS_TOKEN", "")
 
         self.database_path = database_path
+        self.embeding_size = embeding_size
+        self.max_length = max_length
         if uri:
             connections.connect(uri=uri, user=user, password=password, token=token)
         else:
             connections.connect(host=host, port=port, user=user, password=password, token=token)
+        # Snapshots go through a client of this store rather than the ORM's shared default connection.
+        self.milvus_client = MilvusClient(uri=uri or f"http://{host}:{port}", user=user, password=password, token=token)
 
         # Define schema for the collection
         fields = [
@@ -34,38 +44,43 @@ class VectorDB():
         #     FieldSchema(name="sql", dtype=DataType.VARCHAR, max_length=65535)
         # ]
         self.schema = CollectionSchema(fields, description="Knowledge Base Collection")
-        self.index_params = {
-            "index_type": "HNSW",  # Use IVF or HNSW for large datasets
-            "metric_type": "L2",
-            "params": {"nlist": 128}
-        }
         self.collection_name = "knowledge_base"
+        # Index type, build/search params and consistency: config/VectorIndexConfig.yaml
+        self.index = index_config(self.collection_name)
+        self.index_params = self.index.index_params()
     
     def create_db(self):
         # Create collection
-        self.collection = Collection(name=self.collection_name, schema=self.schema)
+        self.collection = Collection(name=self.collection_name, schema=self.schema, consistency_level=self.index.consistency_level)
         self.collection.create_index(field_name="embedding", index_params=self.index_params)
 
     def getCollection(self):
         self.collection = Collection(self.collection_name)
     
-    def insert_data(self, embeddings, texts, sql):
+    def insert_data(self, embeddings, texts, sql=None, flush=True):
+        # `sql` is unused and kept for existing callers. Bulk loads pass flush=False
+        # and call flush() once at the end.
 
         # Insert data into the collection
         data = [embeddings, texts]  # Milvus expects data in columnar format
         self.collection.insert(data)
-        self.collection.flush()
+        if flush:
+            self.flush()
 
         print(f"------ Inserted {len(embeddings)} vectors into the collection '{self.collection_name}'. ------")
 
+    def flush(self):
+        self.collection.flush()
+
     def query_topk(self, query_vector, topk=5):
 
         results = self.collection.search(
             data=[query_vector],
             anns_field="embedding",
-            param={"metric_type": "L2", "params": {"nprobe": 10}},  # Adjust nprobe for recall
+            param=self.index.search_param(),
             limit=topk,  # Retrieve top-5 most relevant documents
-            output_fields=["text"]
+            output_fields=["text"],
+            consistency_level=self.index.consistency_level
         )
 
         retrieved_docs = [result.entity.get('text') for result in results[0]]
@@ -84,6 +99,16 @@ class VectorDB():
         for result in results:
             print(result)
 
+    def export_snapshot(self, path: str, model: str) -> dict:
+        """Write the collection (ids, texts and vectors) to an .npz snapshot."""
+        return export_collection(self.milvus_client, self.collection_name, path, model)
+
+    def restore_snapshot(self, path: str, model: str = None) -> int:
+        """Recreate the collection from a snapshot without re-encoding anything."""
+        self.drop_collection()
+        self.create_db()
+        return import_collection(self.milvus_client, self.collection_name, path, model=model, dim=self.embeding_size)
+
     def drop_collection(self) -> None:
         """Drop a collection."""
         if utility.has_collection(self.collection_name):
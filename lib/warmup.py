@@ -0,0 +1,116 @@
+import threading
+import time
+
+from .metrics import timed
+
+
+class Deferred:
+    """
+    A value built by `loader` on a background thread, so slow imports and
+    model loads do not hold up server start. Loading begins on `start()` or
+    on the first `get()`, which waits for it. A failed load is retried by the
+    next `start()` / `get()`.
+    """
+    def __init__(self, name: str, loader):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.error = None
+        self.seconds = None
+        self._done = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and not (self._done.is_set() and self.error is not None):
+                return self
+            self.error = None
+            self._done.clear()
+            self._thread = threading.Thread(target=self._run, name=f"load-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            with timed(f"load_{self.name}"):
+                self.value = self.loader()
+        except BaseException as e:
+            self.error = e
+            print(f"Loading {self.name} failed: {e}")
+        finally:
+            self.seconds = time.perf_counter() - start
+            self._done.set()
+
+    def get(self, timeout=None):
+        self.start()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.name} is still loading")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.error is None
+
+    def status(self) -> dict:
+        if self._thread is None:
+            state = "pending"
+        elif not self._done.is_set():
+            state = "loading"
+        else:
+            state = "failed" if self.error is not None else "ready"
+        return {
+            "state": state,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "error": str(self.error) if self.error is not None else None,
+        }
+
+
+class Warmup:
+    """The `Deferred` loads a server starts once it is listening; `/ready` waits for all of them."""
+    def __init__(self):
+        self.items = {}
+        self.started = time.time()
+
+    def add(self, name: str, loader) -> Deferred:
+        item = self.items[name] = Deferred(name, loader)
+        return item
+
+    def start(self):
+        for item in self.items.values():
+            item.start()
+
+    @property
+    def ready(self) -> bool:
+        return all(item.ready for item in self.items.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime": round(time.time() - self.started, 3),
+            "items": {name: item.status() for name, item in self.items.items()},
+        }
+
+
+def install(app, warmup: Warmup):
+    """Start `warmup` with a FastAPI app and add `GET /healthz` (liveness) and `GET /ready` (readiness)."""
+    from fastapi.responses import JSONResponse
+
+    @app.on_event("startup")
+    async def start_warmup():
+        warmup.start()
+
+    @app.get("/healthz")
+    async def healthz():
+        return {'statusCode': 200, "response": "ok"}
+
+    @app.get("/ready")
+    async def ready():
+        # Loads that failed are retried on the next probe.
+        warmup.start()
+        status = warmup.status()
+        code = 200 if status["ready"] else 503
+        return JSONResponse(status_code=code, content={'statusCode': code, "response": status})
@@ -1,14 +1,109 @@
-import streamlit as st
-from lib.vanna.vanna_aisuite import aisuite_Chat
+from lib.executor import run_in_pool, stream_in_pool, shutdown_pools, PoolSaturated
+from lib.vanna_registry import VannaRegistry, SessionStore, SessionNotFound, SessionConflict, config_fingerprint
+from lib.schema_sync import sync_schema, schema_status, train_question_file, SchemaWatcher
 from fastapi import FastAPI, Request
+from lib.pipeline import ask_pipeline, sse_event, stage_settings, PAGE_ROWS
+from lib import metrics, tracing, warmup
+from lib.chart_downsample import downsample_for_chart, chart_figure
+from lib.sql_guard import QueryTimeout, QueryRejected
+from lib.sql_paging import QueryPager, PageNotFound, estimate_count, result_page_token, parse_result_page_token, RESULT_TOKEN_PREFIX
+from lib.result_store import ResultStore, ResultNotFound
+from lib.llm_cache import get_llm_cache
+from lib.sql_result_cache import get_sql_result_cache
+from lib.embedding_cache import embedding_cache_stats
+from lib.embedding_models import DEFAULT_EMBEDDING_MODEL, get_embedding_model, embedding_model_stats
+from lib.dataframe_transport import negotiate_format, encode_dataframe, dataframe_from_field, dataframe_to_field, MEDIA_TYPES
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import uvicorn
 import orjson
+import contextvars
+import importlib
 import re
-import pandas as pd
-import json
-import io
+import os
 
 app = FastAPI()
+metrics.install(app)
+tracing.install(app)
+
+# vanna, aisuite and pymilvus are imported once the server is listening, not at import time.
+startup = warmup.Warmup()
+vanna_module = startup.add('vanna', lambda: importlib.import_module('lib.vanna.vanna_aisuite'))
+startup.add('embedding_model', lambda: get_embedding_model(DEFAULT_EMBEDDING_MODEL))
+warmup.install(app, startup)
+
+@app.exception_handler(ResultNotFound)
+async def result_not_found_handler(request: Request, exc: ResultNotFound):
+    return JSONResponse(
+        status_code=404,
+        content={
+            'statusCode' : 404,
+            "response": str(exc)
+        }
+    )
+
+@app.exception_handler(SessionNotFound)
+async def session_not_found_handler(request: Request, exc: SessionNotFound):
+    return JSONResponse(
+        status_code=404,
+        content={
+            'statusCode' : 404,
+            "response": str(exc)
+        }
+    )
+
+@app.exception_handler(PageNotFound)
+async def page_not_found_handler(request: Request, exc: PageNotFound):
+    return JSONResponse(
+        status_code=404,
+        content={
+            'statusCode' : 404,
+            "response": str(exc)
+        }
+    )
+
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    return JSONResponse(
+        status_code=408,
+        content={
+            'statusCode' : 408,
+            "response": f"{exc}. Please ask a narrower question."
+        }
+    )
+
+@app.exception_handler(QueryRejected)
+async def query_rejected_handler(request: Request, exc: QueryRejected):
+    return JSONResponse(
+        status_code=422,
+        content={
+            'statusCode' : 422,
+            "response": str(exc)
+        }
+    )
+
+@app.exception_handler(SessionConflict)
+async def session_conflict_handler(request: Request, exc: SessionConflict):
+    return JSONResponse(
+        status_code=409,
+        content={
+            'statusCode' : 409,
+            "response": str(exc)
+        }
+    )
+
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={
+            'statusCode' : 503,
+            "response": f"Server is busy, please retry: {exc}"
+        }
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_pools()
 
 @app.get("/")
 async def read_root():
@@ -37,50 +132,222 @@ def clean_sql(sql):
     sql = sql.replace('\\"', '"').replace('\\\'', "'")
     return sql
 
+def decode_field(value):
+    # The frontend posts some string fields JSON encoded (wrapped in quotes).
+    if isinstance(value, str) and value.startswith('"') and value.endswith('"'):
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            pass
+    return value
+
 # @st.cache_resource(ttl=3600)
 @app.post("/api/v2/setup_vanna")
 async def setup_vanna(request: Request):
     body = await request.json()
     config = body.get('configs')
-    global vn
     # config={
     #     'milvus_client':'data_storage/vanna-democompany-vector.db',
     #     'model':'groq:llama-3.2-3b-preview', 
     #     'sql_db':'data_storage/democompany.db',
     #     'question_db': 'data_storage/questions.json'
     # }
-    vn = aisuite_Chat(config=config)
-    vn.connect_to_sqlite(config['sql_db'])
+    # The id is generated server side; a client can only re-open its own session with the same config.
+    session_id = sessions.open(config, body.get('session_id'))
+    vn = await checkout_vanna(config)
+    # No-op unless the schema changed since this instance last synced.
+    sync = await run_in_pool('cpu', sync_schema, vn, bool(body.get('force', False)))
+    if body.get('train_questions') and config.get('question_db'):
+        sync['questions'] = await run_in_pool('cpu', train_question_file, vn, config['question_db'])
+    snapshot_dir = _snapshot_dir(config)
+    if snapshot_dir and (sync['status'] == 'updated' or sync.get('questions', {}).get('added')):
+        sync['snapshot'] = await run_in_pool('cpu', vn.export_snapshot, snapshot_dir)
+    print(registry.stats())
 
-    existing_training_data = vn.get_training_data()
-    if len(existing_training_data) > 0:
-        for _, training_data in existing_training_data.iterrows():
-            vn.remove_training_data(training_data['id'])
-    df_ddl = vn.run_sql("SELECT type, sql FROM sqlite_master WHERE sql is not null")
-    for ddl in df_ddl['sql'].to_list():
-        vn.train(ddl=ddl)
+    return {
+                'statusCode' : 200,
+                "response": 'success',
+                "session_id": session_id,
+                "schema": sync
+            }
 
-    # with open(config['question_db'], "r") as json_file:
-    #     qsql_list = json.load(json_file)
-    #     for qsql in qsql_list:
-    #         vn.train(question=qsql['question'], sql=qsql['answer'])
+@app.get("/api/v2/cache_stats")
+async def cache_stats():
+    llm_cache = get_llm_cache()
+    sql_cache = get_sql_result_cache()
+    return {
+                'statusCode' : 200,
+                "response": {
+                    'llm': llm_cache.stats() if llm_cache is not None else None,
+                    'sql': sql_cache.stats() if sql_cache is not None else None,
+                    'results': results.stats(),
+                    'vanna': registry.stats(),
+                    'embeddings': embedding_cache_stats(),
+                    'embedding_models': embedding_model_stats(),
+                }
+            }
 
-    existing_training_data = vn.get_training_data()
-    print(existing_training_data)
-    
+@app.post("/api/v2/export_snapshot")
+async def export_snapshot(request: Request):
+    body = await request.json()
+    vn, state = await get_session(body)
+    path, error = _snapshot_path(body.get('path'), state.config)
+    if error:
+        return JSONResponse(status_code=400, content={'statusCode': 400, "response": error})
+    response = await run_in_pool('cpu', vn.export_snapshot, path)
     return {
                 'statusCode' : 200,
-                "response": 'success'
+                "response": response,
+                "path": path
             }
 
+@app.post("/api/v2/restore_snapshot")
+async def restore_snapshot(request: Request):
+    body = await request.json()
+    vn, state = await get_session(body)
+    path, error = _snapshot_path(body.get('path'), state.config)
+    if error:
+        return JSONResponse(status_code=400, content={'statusCode': 400, "response": error})
+    response = await run_in_pool('cpu', vn.restore_snapshot, path, bool(body.get('replace', False)))
+    if response['status'] == 'restored':
+        # The restored DDL may differ from what this instance synced last.
+        response['schema'] = await run_in_pool('cpu', sync_schema, vn, True)
+    return {
+                'statusCode' : 200,
+                "response": response,
+                "path": path
+            }
+
+@app.post("/api/v2/setup_status")
+async def setup_status(request: Request):
+    body = await request.json()
+    vn, _ = await get_session(body)
+    response = await run_in_pool('sql', schema_status, vn)
+    return {
+                'statusCode' : 200,
+                "response": response
+            }
+
+def _snapshot_dir(config):
+    # One snapshot per vector store, under VANNA_SNAPSHOT_DIR.
+    root = os.getenv('VANNA_SNAPSHOT_DIR')
+    if not root:
+        return None
+    store = os.path.basename(str(config.get('milvus_client', 'milvus.db')).rstrip('/'))
+    return os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]+', '_', store))
+
+def _snapshot_path(path, config):
+    # A requested path names a directory under VANNA_SNAPSHOT_DIR; nothing outside it is read or written.
+    root = os.getenv('VANNA_SNAPSHOT_DIR')
+    if not root:
+        return None, "Set VANNA_SNAPSHOT_DIR"
+    if not path:
+        return _snapshot_dir(config), None
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, str(path)))
+    if os.path.commonpath([root, resolved]) != root or resolved == root:
+        return None, "path must name a directory under VANNA_SNAPSHOT_DIR"
+    return resolved, None
+
+def _build_vanna(config):
+    aisuite_Chat = vanna_module.get().aisuite_Chat
+    vn = aisuite_Chat(config=config)
+    vn.connect_to_sqlite(config['sql_db'])
+    snapshot_dir = _snapshot_dir(config)
+    if snapshot_dir:
+        # A fresh replica loads the last snapshot instead of re-embedding the training data.
+        print(f"snapshot restore: {vn.restore_snapshot(snapshot_dir)}")
+    sync_schema(vn)
+
+    watch_interval = float(os.getenv('SCHEMA_WATCH_INTERVAL', 0))
+    if watch_interval > 0:
+        vn._schema_watcher = SchemaWatcher(vn, config['sql_db'], watch_interval)
+        vn._schema_watcher.start()
+
+    return vn
+
+def _release_vanna(vn):
+    watcher = getattr(vn, '_schema_watcher', None)
+    if watcher is not None:
+        watcher.stop()
+    if hasattr(vn.milvus_client, 'close'):
+        vn.milvus_client.close()
+
+# Warm instances are shared by every session that uses the same model, vector store and database.
+registry = VannaRegistry(factory=_build_vanna, on_evict=_release_vanna)
+sessions = SessionStore()
+results = ResultStore()
+pager = QueryPager()
+
+# Instances checked out by the current request, handed back once its response (streamed body included) is done.
+_held_instances = contextvars.ContextVar('held_instances', default=None)
+
+@app.middleware("http")
+async def release_vanna_instances(request: Request, call_next):
+    held = []
+    _held_instances.set(held)
+
+    def release():
+        while held:
+            registry.release(held.pop())
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+    body = getattr(response, "body_iterator", None)
+    if body is None:
+        release()
+        return response
+
+    async def release_with_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+
+    response.body_iterator = release_with_body()
+    return response
+
+async def checkout_vanna(config):
+    # Held for the rest of the request, so eviction cannot close it under a running search.
+    fingerprint = config_fingerprint(config)
+    held = _held_instances.get()
+    if held is None:
+        return registry.get(fingerprint) or await run_in_pool('cpu', registry.get_or_create, config)
+    vn = registry.acquire(fingerprint)
+    while vn is None:
+        await run_in_pool('cpu', registry.get_or_create, config)
+        vn = registry.acquire(fingerprint)
+    held.append(vn)
+    return vn
+
+async def get_session(body):
+    state = sessions.get(body.get('session_id'))
+    vn = await checkout_vanna(state.config)
+    return vn, state
+
+async def load_dataframe(body, state):
+    # Prefer the server side handle returned by run_sql; an uploaded `df` is still accepted.
+    if body.get('df') and not body.get('result_id'):
+        df = await run_in_pool('cpu', dataframe_from_field, body.get('df'))
+    else:
+        result_id = body.get('result_id') or state.result_id
+        if result_id is None:
+            raise ResultNotFound("No result to work on, please run the query first")
+        df = await run_in_pool('cpu', results.get, result_id)
+    max_rows = body.get('max_rows')
+    return df.head(int(max_rows)) if max_rows else df
+
 # @merged_decorator_with_args("Genera/ting sample questions ...", "/api/v2/generate_questions_cached")
 # @st.cache_data(show_spinner="Generating sample questions ...")
 @app.post("/api/v2/generate_questions_cached")
 async def generate_questions_cached(request: Request):
     body = await request.json()
-    # config = body.get('configs')
-    # vn = setup_vanna(config)
-    response = vn.generate_questions()
+    vn, _ = await get_session(body)
+    response = await run_in_pool('llm', vn.generate_questions)
     return {
                 'statusCode' : 200,
                 "response": response
@@ -92,9 +359,9 @@ async def generate_questions_cached(request: Request):
 async def generate_sql_cached(request: Request):
     body = await request.json()
     question = body.get('question') 
-    response = vn.generate_sql(question=question, allow_llm_to_see_data=True)
-    global generate_sql_ans
-    generate_sql_ans = response
+    vn, state = await get_session(body)
+    response = await run_in_pool('llm', vn.generate_sql, question=question, allow_llm_to_see_data=True)
+    state.sql = response
     print("generate_sql: ", response)
     return {
                 'statusCode' : 200,
@@ -106,6 +373,7 @@ async def generate_sql_cached(request: Request):
 async def is_sql_valid_cached(request: Request):
     body = await request.json()
     sql = body.get('sql')
+    vn, _ = await get_session(body)
     response = vn.is_sql_valid(sql=sql)
     print("is_sql_valid: ", response)
     return {
@@ -118,18 +386,28 @@ async def is_sql_valid_cached(request: Request):
 async def run_sql_cached(request: Request):
     body = await request.body()
     body = orjson.loads(body)
-    sql = body.get('sql')
+    vn, state = await get_session(body)
+    sql = body.get('sql') or state.sql
     sql = clean_sql(sql)
     print(sql)
-    # response = vn.run_sql(sql=sql)
-    response = vn.run_sql(sql=generate_sql_ans)
-    print("run_sql: ", response)
     try:
-        response = vn.run_sql(sql=sql)
+        response = await run_in_pool('sql', vn.run_sql, sql=sql)
+        print("run_sql: ", response)
+        result_id = await run_in_pool('cpu', results.put, response)
+        state.result_id = result_id
+        truncated = bool(response.attrs.get('truncated'))
+        fmt = negotiate_format(request.headers.get('accept'))
+        if fmt != 'json':
+            fmt, payload = await run_in_pool('cpu', encode_dataframe, response, fmt)
+            return Response(content=payload, media_type=MEDIA_TYPES[fmt], headers={'X-Row-Count': str(len(response)), 'X-Result-Id': result_id, 'X-Truncated': str(truncated).lower()})
         return {
                     'statusCode' : 200,
-                    "response": orjson.dumps(response.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8")
+                    "response": orjson.dumps(response.to_json(orient="records"), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8"),
+                    "result_id": result_id,
+                    "truncated": truncated
                 }
+    except (QueryTimeout, QueryRejected):
+        raise
     except Exception as e:
         return {
                     'statusCode' : 500,
@@ -137,17 +415,56 @@ async def run_sql_cached(request: Request):
                 }
 
 
+@app.post("/api/v2/run_sql_page")
+async def run_sql_page(request: Request):
+    # Streams a query through a server side cursor instead of materializing it;
+    # the returned page_token is passed to /api/v2/fetch_page for the next page.
+    body = await request.json()
+    vn, state = await get_session(body)
+    sql = clean_sql(body.get('sql') or state.sql)
+    page_size = int(body.get('page_size', PAGE_ROWS))
+    df, page_token, offset = await run_in_pool('sql', pager.open, vn.sql_db, sql, page_size)
+    total_rows = len(df)
+    if page_token is not None and body.get('count', True):
+        total_rows = await run_in_pool('sql', estimate_count, vn.sql_db, sql)
+    return {
+                'statusCode' : 200,
+                "response": await run_in_pool('cpu', dataframe_to_field, df, body.get('df_format', 'json')),
+                "page_token": page_token,
+                "offset": offset,
+                "total_rows": total_rows
+            }
+
+@app.post("/api/v2/fetch_page")
+async def fetch_page(request: Request):
+    body = await request.json()
+    page_token = body.get('page_token')
+    page_size = int(body.get('page_size', PAGE_ROWS))
+    if page_token is None:
+        raise PageNotFound("No page_token given")
+    if page_token.startswith(RESULT_TOKEN_PREFIX):
+        # Pages of a result already held in the result store (see /api/v2/ask).
+        result_id, offset = parse_result_page_token(page_token)
+        df = await run_in_pool('cpu', results.get, result_id)
+        next_token = result_page_token(result_id, offset + page_size) if offset + page_size < len(df) else None
+        df = df.iloc[offset:offset + page_size]
+    else:
+        df, next_token, offset = await run_in_pool('sql', pager.fetch, page_token, page_size)
+    return {
+                'statusCode' : 200,
+                "response": await run_in_pool('cpu', dataframe_to_field, df, body.get('df_format', 'json')),
+                "page_token": next_token,
+                "offset": offset
+            }
+
+
 # @st.cache_data(show_spinner="Checking if we should generate a chart ...")
 @app.post("/api/v2/should_generate_chart_cached")
 async def should_generate_chart_cached(request: Request):
     body = await request.body()
     body = orjson.loads(body)
-    sql = body.get('sql')
-    sql = clean_sql(sql)
-    df = body.get('df')
-    df = json.loads(df)
-    # df = pd.read_json(io.StringIO(df), dtype=None, precise_float=True, lines=True)
-    df = pd.read_json(io.StringIO(df), dtype=None, precise_float=True)
+    vn, state = await get_session(body)
+    df = await load_dataframe(body, state)
     question = body.get('question')
     response = vn.should_generate_chart(df=df)
     return {
@@ -160,18 +477,15 @@ async def should_generate_chart_cached(request: Request):
 async def generate_plotly_code_cached(request: Request):
     body = await request.body()
     body = orjson.loads(body)
-    sql = body.get('sql')
+    vn, state = await get_session(body)
+    sql = body.get('sql') or state.sql
     sql = clean_sql(sql)
-    df = body.get('df')
-    df = json.loads(df)
-    df = pd.read_json(df)
+    df = await load_dataframe(body, state)
+    df = await run_in_pool('cpu', downsample_for_chart, df)
     question = body.get('question')
-    # code = vn.generate_plotly_code(question=question, sql=sql, df=df)
-    code = vn.generate_plotly_code(question=question, sql=generate_sql_ans, df=df)
+    code = await run_in_pool('llm', vn.generate_plotly_code, question=question, sql=sql, df=df)
     response = code
-
-    global generate_code_ans
-    generate_code_ans = code
+    state.plotly_code = code
     return {
                 'statusCode' : 200,
                 "response": response
@@ -184,14 +498,11 @@ async def generate_plotly_code_cached(request: Request):
 async def generate_plot_cached(request: Request):
     body = await request.body()
     body = orjson.loads(body)
-    df = body.get('df')
-    df = json.loads(df)
-    df = pd.read_json(df)
-    code = body.get('code')
-    code = clean_sql(code)
+    vn, state = await get_session(body)
+    df = await load_dataframe(body, state)
+    code = decode_field(body.get('code')) or state.plotly_code
     print('code: ', code)
-    # response = vn.get_plotly_figure(plotly_code=code, df=df)
-    response = vn.get_plotly_figure(plotly_code=generate_code_ans, df=df)
+    response = await run_in_pool('cpu', chart_figure, vn, code, df)
     return {
                 'statusCode' : 200,
                 "response": orjson.dumps(response.to_json(), option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode("utf-8")
@@ -202,13 +513,12 @@ async def generate_plot_cached(request: Request):
 async def generate_followup_cached(request: Request):
     body = await request.body()
     body = orjson.loads(body)
-    sql = body.get('sql')
+    vn, state = await get_session(body)
+    sql = body.get('sql') or state.sql
     sql = clean_sql(sql)
-    df = body.get('df')
-    df = json.loads(df)
-    df = pd.read_json(df)
+    df = await load_dataframe(body, state)
     question = body.get('question')
-    response = vn.generate_followup_questions(question=question, sql=sql, df=df)
+    response = await run_in_pool('llm', vn.generate_followup_questions, question=question, sql=sql, df=df)
     return {
                 'statusCode' : 200,
                 "response": response
@@ -219,11 +529,10 @@ async def generate_followup_cached(request: Request):
 async def generate_summary_cached(request: Request):
     body = await request.body()
     body = orjson.loads(body)
-    df = body.get('df')
-    df = json.loads(df)
-    df = pd.read_json(df)
+    vn, state = await get_session(body)
+    df = await load_dataframe(body, state)
     question = body.get('question')
-    response = vn.generate_summary(question=question, df=df)
+    response = await run_in_pool('llm', vn.generate_summary, question=question, df=df)
     return {
                 'statusCode' : 200,
                 "response": response
@@ -233,7 +542,8 @@ async def generate_summary_cached(request: Request):
 async def generate_answer_cached(request: Request):
     body = await request.json()
     question = body.get('question')
-    response = vn.submit_prompt(prompt=question)
+    vn, _ = await get_session(body)
+    response = await run_in_pool('llm', vn.submit_prompt, prompt=question)
     print('submit_prompt: ', response)
     return {
                 'statusCode' : 200,
@@ -241,5 +551,53 @@ async def generate_answer_cached(request: Request):
             }
 
 
+@app.post("/api/v2/generate_answer_stream")
+async def generate_answer_stream(request: Request):
+    body = await request.json()
+    question = body.get('question')
+    vn, _ = await get_session(body)
+    return StreamingResponse(
+        stream_in_pool('llm', vn.submit_prompt_stream, question),
+        media_type="text/plain; charset=utf-8",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.post("/api/v2/generate_summary_stream")
+async def generate_summary_stream(request: Request):
+    body = await request.body()
+    body = orjson.loads(body)
+    vn, state = await get_session(body)
+    df = await load_dataframe(body, state)
+    question = body.get('question')
+    return StreamingResponse(
+        stream_in_pool('llm', vn.generate_summary_stream, question=question, df=df),
+        media_type="text/plain; charset=utf-8",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.post("/api/v2/ask")
+async def ask(request: Request):
+    body = await request.json()
+    # Once the stream has started, errors can only be sent as events.
+    try:
+        stage_settings(body.get('stages'), body.get('timeouts'))
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={'statusCode': 400, "response": str(e)})
+    vn, state = await get_session(body)
+    question = body.get('question')
+    messages = body.get('messages')
+
+    async def events():
+        async for event, data in ask_pipeline(vn, state, question, messages=messages, df_format=body.get('df_format', 'json'), results=results,
+                                              stages=body.get('stages'), timeouts=body.get('timeouts')):
+            yield sse_event(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run("middleware:app", host="0.0.0.0",port=8000, log_level="info", reload=True)
\ No newline at end of file
@@ -36,6 +36,27 @@ def query_llm(model_config, chat_history):
         st.error(f"Error querying {model_config['name']}: {e}")
         return "Error with LLM response."
     
+# Streams the response text of one LLM as the backend generates it
+def stream_llm(model_config, chat_history):
+    model = model_config["provider"] + ":" + model_config["model"]
+    api_url = os.getenv('API_URL', 'http://backend:8000')
+    try:
+        requests.post(api_url+'/model', json={'model':model})
+    except:
+        api_url = 'http://localhost:8000'
+        requests.post(api_url+'/model', json={'model':model})
+    with requests.post(api_url+'/generate_stream', json=chat_history, stream=True) as response:
+        if not response.ok:
+            # A JSON error body (busy server, models still loading) is not part of the answer.
+            try:
+                body = response.json()
+                message = body.get('response') if isinstance(body, dict) else None
+            except ValueError:
+                message = None
+            raise requests.HTTPError(message or f"{response.status_code} {response.reason}", response=response)
+        for text in response.iter_content(chunk_size=None, decode_unicode=True):
+            yield text
+
 def query_llm_and_append_to_history(model_config, chat_history):
     response = query_llm(model_config, chat_history)
     chat_history.append({"role": "assistant", "content": response})
@@ -175,6 +196,9 @@ def stramlit_ui():
         chat_container = st.container(height=500)
         with chat_container:
             display_chat_history(st.session_state.chat_history_1, selected_model_1)
+    # Set by a failed streamed answer, shown after the rerun that follows it.
+    if st.session_state.get("stream_error"):
+        st.error(st.session_state.pop("stream_error"))
 
     # Bottom Section - User Input
     st.markdown("<div style='height: 20px;'></div>", unsafe_allow_html=True)
@@ -241,6 +265,20 @@ def stramlit_ui():
         st.rerun()
     
     # Handle the actual processing
+    if st.session_state.is_processing and user_query and not st.session_state.use_comparison_mode:
+        model_config_1 = next(
+            llm for llm in configured_llms if llm["name"] == selected_model_1
+        )
+        try:
+            with chat_container:
+                with st.chat_message("assistant", avatar="🤖"):
+                    response = st.write_stream(stream_llm(model_config_1, st.session_state.chat_history_1))
+            st.session_state.chat_history_1.append({"role": "assistant", "content": response})
+        except Exception as e:
+            st.session_state.stream_error = f"An error occurred: {e}"
+        st.session_state.is_processing = False
+        st.rerun()
+
     if st.session_state.is_processing and user_query:
         # Query the selected LLM(s)
         with ThreadPoolExecutor() as executor:
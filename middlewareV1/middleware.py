@@ -1,29 +1,41 @@
 from fastapi import FastAPI, Request
-from sentence_transformers import SentenceTransformer
-import faiss
+from fastapi.responses import StreamingResponse
 import os
 from dotenv import load_dotenv
 # from openai import OpenAI
 import aisuite as ai
 import uvicorn
 import time
-import pandas as pd
-import json
-import numpy as np
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from lib.database_processor_for_rag import database_demo
-from lib.vectordatabase import VectorDB
+from lib.executor import run_in_pool, stream_in_pool
+from lib.llm_stream import create_completion_stream
+from lib import metrics, tracing, warmup
+from lib.metrics import timed, record_usage
+from lib.embedding_cache import get_embedding_cache, cached_encode
+from lib.embedding_models import get_embedding_model
 load_dotenv()
 
 client = ai.Client()
 app = FastAPI()
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+metrics.install(app)
+tracing.install(app)
 
-t0 = time.time()
-db = VectorDB(database_path='data_storage/democompany-vector.db')
-db.getCollection()
-print(f'database reading time: {time.time() - t0} s')
+def open_vector_db():
+    from lib.vectordatabase import VectorDB
+    t0 = time.time()
+    db = VectorDB(database_path='data_storage/democompany-vector.db')
+    db.getCollection()
+    print(f'database reading time: {time.time() - t0} s')
+    return db
+
+# Both load in the background once the server is listening; `/ready` reports when they are done.
+startup = warmup.Warmup()
+# Shared with the rest of the process, or served by the embedding server when EMBED_SERVER_SOCKET is set.
+embedding_model = startup.add('embedding_model', lambda: get_embedding_model("all-MiniLM-L6-v2"))
+vector_db = startup.add('vector_db', open_vector_db)
+warmup.install(app, startup)
+embedding_cache = get_embedding_cache("all-MiniLM-L6-v2:query")
 
 # def faiss_retrieve_context(query, top_k=2):
 #     # Search FAISS index
@@ -42,8 +54,10 @@ print(f'database reading time: {time.time() - t0} s')
 
 def retrieve_context(query, top_k=5):
     # Generate embedding for the query
-    query_embedding = embedding_model.encode(query)
-    retrieved_texts = db.query_topk(query_embedding, topk=top_k)
+    with timed("embed_query"):
+        query_embedding = cached_encode(embedding_cache, [query], lambda texts: embedding_model.get().encode_queries(texts))[0]
+    with timed("vector_search"):
+        retrieved_texts = vector_db.get().query_topk(query_embedding, topk=top_k)
     return retrieved_texts
 
 @app.post("/model")
@@ -56,10 +70,7 @@ async def generate_response(request: Request):
             "response": model
     } 
 
-# Middleware endpoint
-@app.post("/generate")
-async def generate_response(request: Request):
-    body = await request.json()
+def build_messages(body):
     if isinstance(body, list):
         role = body[-1].get("role", "")
         user_prompt = body[-1].get("content", "")
@@ -84,13 +95,23 @@ async def generate_response(request: Request):
                 {"role": role, "content": user_prompt}
             ]
     print(messages)
+    return messages
+
+# Middleware endpoint
+@app.post("/generate")
+async def generate_response(request: Request):
+    body = await request.json()
+    # Retrieval waits for the embedding model and vector store to load; keep it off the event loop.
+    messages = await run_in_pool('cpu', build_messages, body)
 
     try:
-        response = client.chat.completions.create(
-            messages=messages,
-            # model='groq:llama-3.2-3b-preview',
-            model=model
-        )
+        with timed("llm", model):
+            response = client.chat.completions.create(
+                messages=messages,
+                # model='groq:llama-3.2-3b-preview',
+                model=model
+            )
+        record_usage(model, response)
         
         return {
             'statusCode' : 200,
@@ -103,5 +124,16 @@ async def generate_response(request: Request):
             "response": str(e)
         }
 
+# Streams the completion as plain text chunks while the provider generates it.
+@app.post("/generate_stream")
+async def generate_stream(request: Request):
+    body = await request.json()
+    messages = await run_in_pool('cpu', build_messages, body)
+    return StreamingResponse(
+        stream_in_pool('llm', create_completion_stream, client, model, messages),
+        media_type="text/plain; charset=utf-8",
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 if __name__ == "__main__":
     uvicorn.run("middleware:app", host="0.0.0.0",port=8000, log_level="info")
\ No newline at end of file
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from lib.chart_downsample import OTHER, bin_rows, cap_categories, counts_rows, downsample_for_chart, lttb_indices
+
+
+def test_lttb_keeps_endpoints_and_point_count():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    indices = lttb_indices(x, y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(1000)
+    y[500] = 100.0
+    assert 500 in lttb_indices(np.arange(1000), y, 50)
+
+
+def test_lttb_returns_everything_when_short_enough():
+    assert lttb_indices(np.arange(10), np.arange(10), 20).tolist() == list(range(10))
+
+
+def test_cap_categories_folds_the_tail_into_other():
+    df = pd.DataFrame({"city": [f"c{i}" for i in range(10)], "sales": range(10)})
+    capped = cap_categories(df, max_categories=4)
+    assert capped["city"].tolist() == ["c7", "c8", "c9", OTHER]
+    assert capped["sales"].sum() == df["sales"].sum()
+    relabelled = cap_categories(df, max_categories=4, fold=False)
+    assert len(relabelled) == 10
+    assert (relabelled["city"] == OTHER).sum() == 7
+
+
+def test_bin_rows_bounds_rows_per_group():
+    df = pd.DataFrame({"group": ["a", "b"] * 500, "value": np.arange(1000.0)})
+    binned = bin_rows(df, "value", max_points=100, max_categories=20)
+    assert len(binned) == 100
+    assert binned.groupby("group").size().tolist() == [50, 50]
+    assert binned["value"].mean() == df["value"].mean()
+
+
+def test_time_series_is_reduced_with_lttb():
+    df = pd.DataFrame({"day": pd.date_range("2024-01-01", periods=5000, freq="h"), "value": np.random.default_rng(0).normal(size=5000)})
+    small = downsample_for_chart(df, max_points=500)
+    assert len(small) <= 500
+    assert small.attrs["downsampled_from"] == 5000
+    assert small["day"].iloc[0] == df["day"].iloc[0]
+    assert small["day"].iloc[-1] == df["day"].iloc[-1]
+
+
+def test_count_charts_keep_every_row():
+    df = pd.DataFrame({"city": [f"c{i % 50}" for i in range(5000)], "amount": np.arange(5000.0)})
+    code = "fig = px.histogram(df, x='amount')"
+    assert counts_rows(code)
+    kept = downsample_for_chart(df, max_points=100, max_categories=10, plotly_code=code)
+    assert len(kept) == 5000
+    assert kept["city"].nunique() == 10
+    assert len(downsample_for_chart(df, max_points=100, max_categories=10, plotly_code="fig = px.bar(df, x='city', y='amount')")) <= 100
+
+
+def test_small_frames_are_untouched():
+    df = pd.DataFrame({"x": [1, 2, 3], "y": [4, 5, 6]})
+    assert downsample_for_chart(df, max_points=10) is df
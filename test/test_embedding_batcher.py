@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from lib.embedding_batcher import BatchedEmbedding, MicroBatcher
+
+
+class Encoder:
+    """Encodes a text as `[len(text)]`; the first call blocks until `gate` is set."""
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+        self.started = threading.Event()
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        self.started.set()
+        self.gate.wait(timeout=5)
+        return [[float(len(text))] for text in texts]
+
+
+def test_concurrent_calls_share_a_batch_and_get_their_own_rows():
+    encoder = Encoder()
+    batcher = MicroBatcher(encoder, max_batch=32, max_wait_ms=50)
+    with ThreadPoolExecutor(4) as pool:
+        first = pool.submit(batcher.encode, ["a"])
+        assert encoder.started.wait(timeout=5)
+        # These queue up while the first batch is being encoded.
+        rest = [pool.submit(batcher.encode, ["b" * n, "c" * n]) for n in (2, 3, 4)]
+        while batcher._queue.qsize() < 3:
+            time.sleep(0.01)
+        encoder.gate.set()
+        assert first.result(timeout=5).tolist() == [[1.0]]
+        assert [f.result(timeout=5)[:, 0].tolist() for f in rest] == [[2, 2], [3, 3], [4, 4]]
+    assert len(encoder.calls) == 2
+    assert sorted(encoder.calls[1]) == sorted(["bb", "cc", "bbb", "ccc", "bbbb", "cccc"])
+
+
+def test_full_batches_skip_the_queue():
+    encoder = Encoder()
+    encoder.gate.set()
+    batcher = MicroBatcher(encoder, max_batch=2)
+    assert batcher.encode(["a", "bb"]).shape == (2, 1)
+    assert batcher._thread is None
+    assert batcher.encode([]).shape == (0, 0)
+
+
+def test_worker_survives_a_failed_batch():
+    def encoder(texts):
+        if "boom" in texts:
+            raise KeyboardInterrupt
+        return [[1.0] for _ in texts]
+
+    batcher = MicroBatcher(encoder, max_batch=8, max_wait_ms=0)
+    with pytest.raises(KeyboardInterrupt):
+        batcher.encode(["boom"])
+    thread = batcher._thread
+    assert batcher.encode(["fine"]).tolist() == [[1.0]]
+    assert batcher._thread is thread
+
+
+def test_batched_embedding_wraps_both_encoders():
+    class Model:
+        dim = 3
+
+        def encode_queries(self, texts):
+            return [np.zeros(3) for _ in texts]
+
+        def encode_documents(self, texts):
+            return [np.ones(3) for _ in texts]
+
+    model = BatchedEmbedding(Model(), "model", max_wait_ms=0)
+    assert model.encode_queries(["q"]).tolist() == [[0.0, 0.0, 0.0]]
+    assert model.encode_documents(["d"]).tolist() == [[1.0, 1.0, 1.0]]
+    assert model.dim == 3
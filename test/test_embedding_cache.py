@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+
+from lib.embedding_cache import EmbeddingCache, text_key
+
+
+class Encoder:
+    def __init__(self, dim=4):
+        self.dim = dim
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [np.full(self.dim, len(text), dtype=np.float32) for text in texts]
+
+
+def test_encoder_sees_only_uncached_unique_texts():
+    cache, encoder = EmbeddingCache("model", max_entries=10, disk_dir=""), Encoder()
+    vectors = cache.encode(["a", "bb", "a"], encoder)
+    assert [v[0] for v in vectors] == [1, 2, 1]
+    cache.encode(["bb", "ccc"], encoder)
+    assert encoder.calls == [["a", "bb"], ["ccc"]]
+    assert cache.stats()["hits"] == 1
+
+
+def test_memory_tier_is_lru_bounded():
+    cache, encoder = EmbeddingCache("model", max_entries=2, disk_dir=""), Encoder()
+    cache.encode(["a", "b", "c"], encoder)
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+
+
+def test_disk_tier_survives_a_new_process(tmp_path):
+    encoder = Encoder()
+    EmbeddingCache("org/model", disk_dir=str(tmp_path)).encode(["a", "bb"], encoder)
+    # A fresh cache finds the tier (and its dimension) left by the previous one.
+    cache = EmbeddingCache("org/model", max_entries=10, disk_dir=str(tmp_path))
+    assert cache.dim == 4
+    assert cache.encode(["bb", "a"], encoder)[0].tolist() == [2.0] * 4
+    assert encoder.calls == [["a", "bb"]]
+
+
+def test_disk_tier_realigns_after_a_crashed_writer(tmp_path):
+    encoder = Encoder()
+    EmbeddingCache("model", disk_dir=str(tmp_path)).encode(["a"], encoder)
+    tier = os.path.join(tmp_path, "model-4")
+    # A writer that died mid-append: one orphan vector and half an index line.
+    with open(os.path.join(tier, "vectors.f32"), "ab") as f:
+        f.write(np.full(4, 9, dtype=np.float32).tobytes())
+    with open(os.path.join(tier, "index.tsv"), "a") as f:
+        f.write(f"{text_key('zzz')}\t")
+
+    EmbeddingCache("model", disk_dir=str(tmp_path)).encode(["bb", "ccc"], encoder)
+    cache = EmbeddingCache("model", disk_dir=str(tmp_path))
+    assert [cache.get(text)[0] for text in ("a", "bb", "ccc")] == [1, 2, 3]
+    assert os.path.getsize(os.path.join(tier, "vectors.f32")) == 3 * 4 * 4
+
+
+def test_corrupt_index_lines_are_skipped(tmp_path):
+    encoder = Encoder()
+    EmbeddingCache("model", disk_dir=str(tmp_path)).encode(["a"], encoder)
+    with open(os.path.join(tmp_path, "model-4", "index.tsv"), "ab") as f:
+        f.write(b"not a row\n\xff\xfe\t0\n" + f"{text_key('b')}\t7\n".encode())
+    cache = EmbeddingCache("model", disk_dir=str(tmp_path))
+    assert cache.get("a")[0] == 1
+    assert cache.get("b") is None
+    assert cache.encode(["b"], encoder)[0][0] == 1
+    assert EmbeddingCache("model", disk_dir=str(tmp_path)).get("b")[0] == 1
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+import pytest
+
+from lib.executor import BoundedPool, PoolSaturated, cancel_event
+
+
+def test_submit_rejects_beyond_workers_and_queue():
+    pool = BoundedPool("test", workers=1, queue=1)
+    gate = threading.Event()
+    try:
+        running = pool.submit(gate.wait)
+        queued = pool.submit(lambda: "queued")
+        with pytest.raises(PoolSaturated):
+            pool.submit(lambda: "rejected")
+        assert pool.depth == 2
+        gate.set()
+        running.result(timeout=5)
+        assert queued.result(timeout=5) == "queued"
+        # Slots are released once jobs finish.
+        assert pool.submit(lambda: "again").result(timeout=5) == "again"
+    finally:
+        gate.set()
+        pool.shutdown(wait=True)
+    assert pool.depth == 0
+
+
+def test_run_sets_cancel_event_when_caller_is_cancelled():
+    pool = BoundedPool("test", workers=1, queue=0)
+    started = threading.Event()
+    seen = {}
+
+    def job():
+        cancel = cancel_event()
+        started.set()
+        seen["stopped"] = cancel.wait(timeout=5)
+
+    async def main():
+        task = asyncio.ensure_future(pool.run(job))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    try:
+        asyncio.run(main())
+        pool.shutdown(wait=True)
+        assert seen["stopped"] is True
+        assert pool.abandoned == 0
+        assert pool.depth == 0
+    finally:
+        pool.shutdown(wait=True)
+
+
+def test_cancel_event_is_none_outside_a_pool_job():
+    assert cancel_event() is None
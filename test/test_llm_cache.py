@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+from lib import llm_cache
+from lib.llm_cache import LLMCache, make_key, normalize_messages, normalize_question
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+def test_normalized_keys_ignore_case_whitespace_and_trailing_punctuation():
+    assert normalize_question("  How many   Orders? ") == normalize_question("how many orders")
+    assert make_key("sql", normalize_question("How many orders?")) == make_key("sql", "how many orders")
+    assert normalize_messages([{"role": "user", "content": "a\n  b"}]) == normalize_messages("a b")
+
+
+def test_get_returns_stored_value_and_counts_lookups(tmp_path, clock):
+    cache = LLMCache(path=str(tmp_path / "cache.db"))
+    assert cache.get("sql", "k") is None
+    cache.set("sql", "k", {"sql": "SELECT 1"})
+    assert cache.get("sql", "k") == {"sql": "SELECT 1"}
+    assert cache.stats() == {"entries": 1, "hits": {"sql": 1}, "misses": {"sql": 1}}
+
+
+def test_expired_entry_is_a_miss_and_deleted(tmp_path, clock):
+    cache = LLMCache(path=str(tmp_path / "cache.db"), ttl=60)
+    cache.set("prompt", "k", "answer")
+    clock.value += 61
+    assert cache.get("prompt", "k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_trim_keeps_most_recently_used_entries(tmp_path, clock):
+    cache = LLMCache(path=str(tmp_path / "cache.db"), max_entries=10)
+    for i in range(255):
+        clock.value += 1
+        cache.set("sql", f"k{i}", i)
+    clock.value += 1
+    assert cache.get("sql", "k0") == 0
+    # The 256th write trims the table down to the `max_entries` most recently used.
+    clock.value += 1
+    cache.set("sql", "k255", 255)
+    assert cache.stats()["entries"] == 10
+    assert cache.get("sql", "k0") == 0
+    assert cache.get("sql", "k255") == 255
+    assert cache.get("sql", "k1") is None
@@ -0,0 +1,72 @@
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+from lib.sql_guard import QueryRejected, QueryTimeout, check_plan, cross_join_tables, query_budget, query_plan, run_guarded
+
+ENDLESS = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE a (id INTEGER PRIMARY KEY, v INTEGER)")
+    conn.execute("CREATE TABLE b (id INTEGER PRIMARY KEY, a_id INTEGER)")
+    yield conn
+    conn.close()
+
+
+def test_cross_join_is_reported(conn):
+    assert cross_join_tables(query_plan(conn, "SELECT * FROM a, b")) == [["a", "b"]]
+
+
+def test_indexed_join_and_union_arms_are_not_reported(conn):
+    assert cross_join_tables(query_plan(conn, "SELECT * FROM b JOIN a ON a.id = b.a_id")) == []
+    assert cross_join_tables(query_plan(conn, "SELECT id FROM a UNION ALL SELECT id FROM b")) == []
+
+
+def test_check_plan_policies(conn):
+    assert check_plan(conn, "SELECT * FROM a, b", policy="warn") == ["Unindexed cross join between a, b"]
+    assert check_plan(conn, "SELECT * FROM a, b", policy="off") == []
+    with pytest.raises(QueryRejected):
+        check_plan(conn, "SELECT * FROM a, b", policy="reject")
+    # Non-SELECTs and statements SQLite cannot plan are left alone.
+    assert check_plan(conn, "DELETE FROM a", policy="reject") == []
+    assert check_plan(conn, "SELECT * FROM missing", policy="reject") == []
+
+
+def test_query_budget_stops_at_step_limit(conn):
+    with pytest.raises(QueryTimeout, match="step budget"):
+        with query_budget(conn, timeout=0, max_steps=100_000):
+            conn.execute(ENDLESS).fetchone()
+    # The handler is removed again afterwards.
+    assert conn.execute("SELECT COUNT(*) FROM (SELECT 1 UNION ALL SELECT 2)").fetchone()[0] == 2
+
+
+def test_query_budget_stops_at_deadline(conn):
+    with pytest.raises(QueryTimeout, match="time limit"):
+        with query_budget(conn, timeout=0.05, max_steps=0):
+            conn.execute(ENDLESS).fetchone()
+
+
+def test_query_budget_stops_once_cancelled(conn):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(QueryTimeout, match="cancelled"):
+        with query_budget(conn, timeout=0, max_steps=0, cancel=cancel):
+            conn.execute(ENDLESS).fetchone()
+
+
+def test_other_errors_pass_through(conn):
+    with pytest.raises(sqlite3.OperationalError):
+        with query_budget(conn, timeout=1):
+            conn.execute("SELECT * FROM missing")
+
+
+def test_run_guarded_attaches_plan_warnings(conn, monkeypatch):
+    monkeypatch.setenv("SQL_GUARD_CROSS_JOIN", "warn")
+    sql = "SELECT * FROM a, b"
+    df = run_guarded(conn, sql, lambda c: pd.read_sql_query(sql, c), timeout=1)
+    assert df.attrs["warnings"] == ["Unindexed cross join between a, b"]
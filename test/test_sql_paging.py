@@ -0,0 +1,79 @@
+import sqlite3
+
+import pytest
+
+from lib.sql_paging import (
+    PageNotFound, QueryPager, estimate_count, execute_capped, limit_sql, parse_result_page_token, result_page_token,
+)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "data.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER, label TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", [(i, f"row {i}") for i in range(25)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_limit_sql_wraps_selects_only():
+    assert limit_sql("SELECT x FROM t;", 10) == "SELECT * FROM (\nSELECT x FROM t\n) LIMIT 10"
+    assert limit_sql("  with a AS (SELECT 1) SELECT * FROM a", 5).endswith(") LIMIT 5")
+    assert limit_sql("PRAGMA table_info(t);", 10) == "PRAGMA table_info(t)"
+
+
+def test_execute_capped_truncates_at_max_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    df = execute_capped(conn, "SELECT * FROM t", max_rows=10, max_bytes=1 << 30, chunk_rows=3)
+    assert len(df) == 10
+    assert df.attrs["truncated"] is True
+    df = execute_capped(conn, "SELECT * FROM t", max_rows=25, max_bytes=1 << 30)
+    assert len(df) == 25
+    assert df.attrs["truncated"] is False
+
+
+def test_execute_capped_truncates_at_max_bytes(db_path):
+    conn = sqlite3.connect(db_path)
+    df = execute_capped(conn, "SELECT * FROM t", max_rows=1000, max_bytes=1)
+    assert len(df) == 1
+    assert df.attrs["truncated"] is True
+
+
+def test_estimate_count(db_path):
+    assert estimate_count(db_path, "SELECT * FROM t WHERE x < 5;") == 5
+    assert estimate_count(db_path, "SELECT * FROM t a, t b, t c", max_steps=1000) is None
+
+
+def test_result_page_token_round_trip():
+    assert parse_result_page_token(result_page_token("abc:def", 40)) == ("abc:def", 40)
+
+
+def test_pager_walks_pages_and_closes_exhausted_token(db_path):
+    pager = QueryPager()
+    df, token, offset = pager.open(db_path, "SELECT x FROM t ORDER BY x;", page_size=10)
+    assert (df["x"].tolist(), offset) == (list(range(10)), 0)
+    df, same, offset = pager.fetch(token, 10)
+    assert (df["x"].tolist(), same, offset) == (list(range(10, 20)), token, 10)
+    df, done, offset = pager.fetch(token, 10)
+    assert (df["x"].tolist(), done, offset) == (list(range(20, 25)), None, 20)
+    with pytest.raises(PageNotFound):
+        pager.fetch(token, 10)
+
+
+def test_pager_materializes_statements_it_cannot_wrap(db_path):
+    pager = QueryPager()
+    df, token, _ = pager.open(db_path, "PRAGMA table_info(t)", page_size=1)
+    assert df["name"].tolist() == ["x"]
+    df, token, offset = pager.fetch(token, 1)
+    assert (df["name"].tolist(), token, offset) == (["label"], None, 1)
+
+
+def test_pager_drops_least_recently_used_token_past_max_open(db_path):
+    pager = QueryPager(max_open=1)
+    _, first, _ = pager.open(db_path, "SELECT x FROM t", page_size=1)
+    _, second, _ = pager.open(db_path, "SELECT x FROM t", page_size=1)
+    with pytest.raises(PageNotFound):
+        pager.fetch(first, 1)
+    assert pager.fetch(second, 1)[2] == 1
@@ -0,0 +1,76 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from lib.sql_result_cache import SQLResultCache, normalize_sql
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "data.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(1,), (2,)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def runner(db_path, calls):
+    def run_sql(sql):
+        calls.append(sql)
+        conn = sqlite3.connect(db_path)
+        try:
+            return pd.read_sql_query(sql, conn)
+        finally:
+            conn.close()
+    return run_sql
+
+
+def test_normalize_sql():
+    assert normalize_sql("  SELECT *\n  FROM t;") == "SELECT * FROM t"
+
+
+def test_repeated_query_is_served_from_cache(db_path):
+    cache, calls = SQLResultCache(), []
+    first = cache.run(db_path, "SELECT x FROM t", runner(db_path, calls))
+    second = cache.run(db_path, "SELECT x\n FROM t;", runner(db_path, calls))
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+    # Callers get a copy they are free to mutate.
+    second["x"] = 0
+    assert cache.run(db_path, "SELECT x FROM t", runner(db_path, calls))["x"].tolist() == [1, 2]
+    assert cache.stats()["hits"] == 2
+
+
+def test_write_from_another_connection_invalidates(db_path):
+    cache, calls = SQLResultCache(), []
+    assert cache.run(db_path, "SELECT COUNT(*) AS n FROM t", runner(db_path, calls))["n"][0] == 2
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO t VALUES (3)")
+    conn.commit()
+    conn.close()
+    assert cache.run(db_path, "SELECT COUNT(*) AS n FROM t", runner(db_path, calls))["n"][0] == 3
+    assert len(calls) == 2
+
+
+def test_writes_and_non_deterministic_reads_are_not_cached(db_path):
+    cache, calls = SQLResultCache(), []
+    for _ in range(2):
+        cache.run(db_path, "SELECT random() AS r", runner(db_path, calls))
+        cache.run(db_path, "SELECT date('now') AS d", runner(db_path, calls))
+    assert len(calls) == 4
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_results_are_evicted_past_max_bytes(db_path):
+    calls = []
+    run_sql = runner(db_path, calls)
+    size = int(run_sql("SELECT x FROM t").memory_usage(index=True, deep=True).sum())
+    cache = SQLResultCache(max_bytes=size)
+    cache.run(db_path, "SELECT x FROM t", run_sql)
+    cache.run(db_path, "SELECT x FROM t ORDER BY x DESC", run_sql)
+    assert cache.stats()["entries"] == 1
+    cache.run(db_path, "SELECT x FROM t ORDER BY x DESC", run_sql)
+    assert len(calls) == 3
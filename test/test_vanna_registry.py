@@ -0,0 +1,91 @@
+import pytest
+
+from lib.vanna_registry import SessionConflict, SessionNotFound, SessionStore, VannaRegistry, config_fingerprint
+
+
+class Instance:
+    def __init__(self, config):
+        self.config = config
+
+
+def config(n):
+    return {"model": f"model-{n}", "milvus_client": "milvus", "sql_db": "db"}
+
+
+def make_registry(released, **kwargs):
+    return VannaRegistry(Instance, on_evict=released.append, max_memory_mb=0, **kwargs)
+
+
+def test_get_or_create_reuses_instance_per_fingerprint():
+    registry = make_registry([])
+    first = registry.get_or_create(config(1))
+    assert registry.get_or_create(dict(config(1), api_key="other")) is first
+    assert registry.get_or_create(config(2)) is not first
+
+
+def test_lru_eviction_releases_idle_instance():
+    released = []
+    registry = make_registry(released, max_instances=1)
+    first = registry.get_or_create(config(1))
+    registry.get_or_create(config(2))
+    assert released == [first]
+    assert registry.get(config_fingerprint(config(1))) is None
+
+
+def test_held_instance_is_released_after_last_holder():
+    released = []
+    registry = make_registry(released, max_instances=1)
+    first = registry.get_or_create(config(1))
+    fingerprint = config_fingerprint(config(1))
+    assert registry.acquire(fingerprint) is first
+    assert registry.acquire(fingerprint) is first
+
+    registry.get_or_create(config(2))
+    assert registry.get(fingerprint) is None
+    assert released == []
+    assert registry.stats()["evicted_held"] == 1
+
+    registry.release(first)
+    assert released == []
+    registry.release(first)
+    assert released == [first]
+    assert registry.stats()["evicted_held"] == 0
+
+
+def test_release_of_unknown_instance_is_ignored():
+    released = []
+    registry = make_registry(released)
+    registry.release(object())
+    assert released == []
+
+
+def test_ttl_expires_idle_instance():
+    released = []
+    registry = make_registry(released, ttl=1e-9)
+    first = registry.get_or_create(config(1))
+    assert registry.get(config_fingerprint(config(1))) is None
+    assert released == [first]
+
+
+def test_on_evict_errors_are_swallowed():
+    def fail(_instance):
+        raise RuntimeError("close failed")
+
+    registry = VannaRegistry(Instance, on_evict=fail, max_instances=1, max_memory_mb=0)
+    registry.get_or_create(config(1))
+    registry.get_or_create(config(2))
+    assert registry.stats()["instances"] == [config_fingerprint(config(2))]
+
+
+def test_session_store_generates_ids_and_rejects_config_conflicts():
+    store = SessionStore()
+    session_id = store.open(config(1))
+    assert store.open(config(1)) != session_id
+    assert store.open(config(1), session_id) == session_id
+    assert store.get(session_id).fingerprint == config_fingerprint(config(1))
+    with pytest.raises(SessionConflict):
+        store.open(config(2), session_id)
+    # An unknown id is not taken over; a fresh one is generated.
+    assert store.open(config(1), "chosen-by-client") != "chosen-by-client"
+    with pytest.raises(SessionNotFound):
+        store.get("chosen-by-client")
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+pymilvus = pytest.importorskip("pymilvus")
+from pymilvus import DataType  # noqa: E402
+
+from lib.vector_snapshot import SnapshotMismatch, export_collection, import_collection, read_header  # noqa: E402
+
+DIM = 4
+
+
+class FakeClient:
+    """The slice of `MilvusClient` snapshots use, over in-memory rows."""
+    def __init__(self, auto_id=False, rows=None):
+        self.fields = [
+            {"name": "id", "type": DataType.INT64, "is_primary": True, "auto_id": auto_id},
+            {"name": "text", "type": DataType.VARCHAR},
+            {"name": "vector", "type": DataType.FLOAT_VECTOR, "params": {"dim": DIM}},
+        ]
+        self.rows = rows or []
+        self.inserts = []
+        self.flushed = 0
+
+    def load_collection(self, collection_name):
+        pass
+
+    def describe_collection(self, collection_name):
+        return {"collection_name": collection_name, "fields": self.fields}
+
+    def query_iterator(self, collection_name, batch_size, filter, output_fields):
+        rows = self.rows
+
+        class Iterator:
+            offset = 0
+
+            def next(self):
+                batch = rows[self.offset:self.offset + batch_size]
+                self.offset += batch_size
+                return [{name: row[name] for name in output_fields} for row in batch]
+
+            def close(self):
+                pass
+
+        return Iterator()
+
+    def insert(self, collection_name, data):
+        self.inserts.append(len(data))
+        self.rows.extend(data)
+
+    def flush(self, collection_name):
+        self.flushed += 1
+
+
+def rows(n):
+    return [{"id": i, "text": f"row {i} – ü", "vector": [float(i)] * DIM} for i in range(n)]
+
+
+def test_header_and_rows_round_trip(tmp_path):
+    path = str(tmp_path / "snapshots" / "sql.npz")
+    header = export_collection(FakeClient(rows=rows(25)), "sql", path, "model-a", batch_size=10)
+    assert read_header(path) == header
+    assert {k: header[k] for k in ("version", "collection", "model", "dim", "count", "vector_field")} == {
+        "version": 1, "collection": "sql", "model": "model-a", "dim": DIM, "count": 25, "vector_field": "vector",
+    }
+    assert header["fields"] == [{"name": "id", "type": "INT64"}, {"name": "text", "type": "VARCHAR"}]
+
+    target = FakeClient()
+    assert import_collection(target, "sql", path, model="model-a", dim=DIM, batch_size=10) == 25
+    assert target.inserts == [10, 10, 5]
+    assert target.flushed == 1
+    restored = sorted(target.rows, key=lambda row: row["id"])
+    assert [row["text"] for row in restored] == [row["text"] for row in rows(25)]
+    assert np.asarray([row["vector"] for row in restored]).tolist() == [row["vector"] for row in rows(25)]
+
+
+def test_auto_id_primary_keys_are_not_inserted(tmp_path):
+    path = str(tmp_path / "sql.npz")
+    export_collection(FakeClient(rows=rows(3)), "sql", path, "model-a")
+    target = FakeClient(auto_id=True)
+    import_collection(target, "sql", path)
+    assert all("id" not in row for row in target.rows)
+
+
+def test_mismatched_snapshot_is_refused(tmp_path):
+    path = str(tmp_path / "sql.npz")
+    export_collection(FakeClient(rows=rows(3)), "sql", path, "model-a")
+    with pytest.raises(SnapshotMismatch):
+        import_collection(FakeClient(), "sql", path, model="model-b")
+    with pytest.raises(SnapshotMismatch):
+        import_collection(FakeClient(), "sql", path, dim=DIM * 2)
+    target = FakeClient()
+    target.fields.insert(2, {"name": "extra", "type": DataType.VARCHAR})
+    with pytest.raises(SnapshotMismatch):
+        import_collection(target, "sql", path)
+    assert target.rows == []